@@ -1 +1,6 @@
-from .wallet import Wallet
\ No newline at end of file
+from .wallet import Wallet
+from .manager import WalletManager
+from .view import WalletView
+from .signer import ColdSigner
+from .replica import WalletReplica, DirectoryChangeSource, SocketChangeSource, ChangeStreamServer
+from .pipeline import TransactionPipeline
@@ -0,0 +1,158 @@
+# Author: Leandro Rometsch, 2021
+# Email: leandro@rometsch.org
+# TU Darmstadt, Chair of Applied Cryptography
+
+import threading
+from collections import OrderedDict
+
+from utils.wrapper import ColdWalletWrapper, HotWalletWrapper, SynchronizedWrapper
+from wallet import Wallet
+
+
+class WalletManager:
+    """Manages many independent wallets (e.g. one per customer) that are stored below common base directories.
+    Wallets are opened lazily and only a bounded number of them is kept open (least recently used ones are closed).
+    All wallets share the JVM and one set of (java) hot and cold wallet objects. Calls to these objects are serialized,
+    so the wallets of different tenants can be used from different threads at the same time."""
+
+    def __init__(self, base_directory_hw="data/", base_directory_cw="data/", max_open_wallets=128, **wallet_options):
+        """
+        Instantiate a wallet manager.
+        The wallet of a tenant is stored under base_directory_hw + tenant + "/" (and base_directory_cw respectively).
+
+        :param base_directory_hw: specifies the storage location of all hot wallets
+        :param base_directory_cw: specifies the storage location of all cold wallets
+        :param max_open_wallets: maximum number of wallets kept open at the same time
+        :param wallet_options: further keyword arguments passed to every Wallet (e.g. secret_key_cache_size)
+        """
+        if max_open_wallets < 1:
+            raise ValueError("tudwallet - At least one wallet must be allowed to be open.")
+
+        self.__base_directory_hw = base_directory_hw
+        self.__base_directory_cw = base_directory_cw
+        self.__max_open_wallets = max_open_wallets
+        self.__wallet_options = wallet_options
+
+        self.__cold_wallet_wrapper = None
+        self.__hot_wallet_wrapper = None
+        self.__open_wallets = OrderedDict()  # tenant -> Wallet, least recently used first
+        self.__lock = threading.RLock()
+
+    def get_wallet(self, tenant) -> Wallet:
+        """
+        Get the wallet of a tenant. The wallet is opened if it is not open yet.
+        Note that the master key of a new tenant still needs to be generated via generate_master_key().
+
+        :param tenant: the tenant's name (used as directory name)
+        :return: the tenant's wallet
+        """
+        tenant = self._check_tenant(tenant)
+
+        with self.__lock:
+            wallet = self.__open_wallets.get(tenant)
+            if wallet is not None:
+                self.__open_wallets.move_to_end(tenant)
+                return wallet
+
+            cold_wallet_wrapper, hot_wallet_wrapper = self._get_wrappers()
+            wallet = Wallet(self.__base_directory_hw + tenant + "/", self.__base_directory_cw + tenant + "/",
+                            cold_wallet_wrapper=cold_wallet_wrapper, hot_wallet_wrapper=hot_wallet_wrapper,
+                            **self.__wallet_options)
+            self.__open_wallets[tenant] = wallet
+
+            while len(self.__open_wallets) > self.__max_open_wallets:
+                _, evicted_wallet = self.__open_wallets.popitem(last=False)
+                evicted_wallet.close()
+
+            return wallet
+
+    def close_wallet(self, tenant):
+        """
+        Close the wallet of a tenant (if open). Its in-memory secrets are wiped.
+
+        :param tenant: the tenant's name
+        """
+        with self.__lock:
+            wallet = self.__open_wallets.pop(self._check_tenant(tenant), None)
+            if wallet is not None:
+                wallet.close()
+
+    def close(self):
+        """
+        Close all open wallets.
+        """
+        with self.__lock:
+            while self.__open_wallets:
+                _, wallet = self.__open_wallets.popitem(last=False)
+                wallet.close()
+
+    def get_open_tenants(self):
+        """
+        Learn which wallets are currently open.
+
+        :return: list of tenants with an open wallet, least recently used first
+        """
+        with self.__lock:
+            return list(self.__open_wallets.keys())
+
+    def apply(self, tenants, operation):
+        """
+        Perform an operation on the wallets of many tenants.
+
+        :param tenants: iterable of tenant names
+        :param operation: function taking a Wallet, its result is collected
+        :return: dict mapping each tenant to the result of the operation
+        """
+        results = {}
+        for tenant in tenants:
+            results[tenant] = operation(self.get_wallet(tenant))
+        return results
+
+    def generate_master_keys(self, tenants, overwrite=False):
+        """
+        Generate the master key pair for the wallets of many tenants.
+
+        :param tenants: iterable of tenant names
+        :param overwrite: replace possibly existing key pairs (or not)
+        """
+        self.apply(tenants, lambda wallet: wallet.generate_master_key(overwrite=overwrite))
+
+    def public_key_derive_many(self, tenants):
+        """
+        Derive one new session public key (with the next possible id) for each of the given tenants.
+
+        :param tenants: iterable of tenant names
+        :return: dict mapping each tenant to its new session public key as dataclass "PublicKey"
+        """
+        return self.apply(tenants, lambda wallet: wallet.public_key_derive())
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
+
+    def _get_wrappers(self):
+        """
+        Getter: Get the (java) cold and hot wallet wrappers shared by all wallets. They are created on first use.
+        The java wallet objects are not thread-safe, therefore all calls to them are serialized.
+
+        :return: tuple of cold wallet wrapper and hot wallet wrapper
+        """
+        if self.__cold_wallet_wrapper is None:
+            self.__cold_wallet_wrapper = SynchronizedWrapper(ColdWalletWrapper())
+            self.__hot_wallet_wrapper = SynchronizedWrapper(HotWalletWrapper())
+        return self.__cold_wallet_wrapper, self.__hot_wallet_wrapper
+
+    @staticmethod
+    def _check_tenant(tenant):
+        """
+        Check that a tenant name can safely be used as directory name.
+
+        :param tenant: the tenant's name
+        :return: the tenant's name as string
+        """
+        tenant = str(tenant)
+        if tenant in ("", ".", "..") or "/" in tenant or "\\" in tenant:
+            raise ValueError("tudwallet - Invalid tenant name: " + tenant)
+        return tenant
@@ -0,0 +1,174 @@
+# Author: Leandro Rometsch, 2021
+# Email: leandro@rometsch.org
+# TU Darmstadt, Chair of Applied Cryptography
+
+import itertools
+import threading
+
+from utils.nonces import NonceStore
+
+DEFAULT_BATCH_SIZE = 256  # Transactions signed (and nonces persisted) at once
+SWEEP_TEMPLATE_FIELDS = ("to", "gas")  # Fields a sweep template must contain (besides gasPrice or maxFeePerGas)
+
+
+class TransactionPipeline:
+    """Builds and signs transactions of the derived accounts of a wallet (keyed by id) with locally tracked nonces.
+    Transactions are completed from a shared template, get the next nonces of their accounts and are signed in batches
+    (one cold wallet session per batch). The nonces of a batch are persisted once it is signed and before it is handed
+    out, so a failed batch consumes no nonces and a crash never reuses one. If transactions were sent elsewhere or
+    dropped, resync() fetches the nonces from a nonce source (e.g. the pending transaction count of a node)."""
+
+    def __init__(self, wallet, chain_id, nonce_store_path, template=None, nonce_source=None,
+                 batch_size=DEFAULT_BATCH_SIZE):
+        """
+        Instantiate a pipeline for one chain.
+
+        :param wallet: the Wallet the accounts belong to
+        :param chain_id: the chain id of all transactions
+        :param nonce_store_path: the path of the file the nonces are persisted in (one file per wallet and chain)
+        :param template: dict of fields shared by all transactions, e.g. to, gas, gasPrice or maxFeePerGas and
+                         maxPriorityFeePerGas
+        :param nonce_source: optional function mapping an address to its next nonce, used by resync() and for
+                             accounts unknown to the nonce store (which start at nonce 0 otherwise)
+        :param batch_size: number of transactions signed at once
+        """
+        if batch_size < 1:
+            raise ValueError("tudwallet - The batch size must be positive.")
+        template = dict(template or {})
+        if "nonce" in template:
+            raise ValueError("tudwallet - Nonces are assigned by the pipeline, remove nonce from the template.")
+
+        self.__wallet = wallet
+        self.__chain_id = chain_id
+        self.__template = template
+        self.__nonce_source = nonce_source
+        self.__batch_size = batch_size
+        self.__nonce_store = NonceStore(nonce_store_path)
+        self.__lock = threading.Lock()
+
+    def sign(self, items):
+        """
+        Completes and signs transactions in batches. Transactions of the same account get consecutive nonces.
+
+        :param items: iterable of (id, transaction fields) tuples; the fields complete (or override) the template
+        :return: generator of batches, each a list of (id, signed transaction) tuples in the order of items
+        """
+        items = iter(items)
+        while True:
+            batch = list(itertools.islice(items, self.__batch_size))
+            if not batch:
+                return
+            yield self._sign_batch(batch)
+
+    def build_sweep(self, balances: dict):
+        """
+        Builds the transactions moving the whole balances of accounts to the template's recipient (e.g. a treasury).
+        Each transaction sends the balance minus the maximum fee (gas times gasPrice or maxFeePerGas); accounts whose
+        balance does not cover the fee are skipped.
+
+        :param balances: dict mapping ids to their balances in wei
+        :return: list of (id, transaction fields) tuples (in the order of balances)
+        """
+        missing_fields = [field for field in SWEEP_TEMPLATE_FIELDS if field not in self.__template]
+        if missing_fields or ("gasPrice" not in self.__template and "maxFeePerGas" not in self.__template):
+            raise ValueError("tudwallet - A sweep template needs to, gas and gasPrice or maxFeePerGas.")
+
+        maximum_fee = self.__template["gas"] * self.__template.get("maxFeePerGas", self.__template.get("gasPrice"))
+        return [(id, {"value": balance - maximum_fee}) for id, balance in balances.items() if balance > maximum_fee]
+
+    def sign_sweep(self, balances: dict):
+        """
+        Builds and signs the sweep transactions of accounts in batches (see build_sweep()).
+
+        :param balances: dict mapping ids to their balances in wei
+        :return: generator of batches, each a list of (id, signed transaction) tuples
+        """
+        return self.sign(self.build_sweep(balances))
+
+    def get_nonce(self, id):
+        """
+        Getter: Get the nonce the next transaction of an account will get.
+
+        :param id: the id (as int) of the account
+        :return: the next nonce
+        """
+        with self.__lock:
+            nonce = self.__nonce_store.get(id)
+            return self._fetch_nonce(id) if nonce is None else nonce
+
+    def set_nonce(self, id, nonce):
+        """
+        Set the nonce of the next transaction of an account (e.g. after replacing a transaction manually).
+
+        :param id: the id (as int) of the account
+        :param nonce: the next nonce
+        """
+        with self.__lock:
+            self.__nonce_store.update({id: nonce})
+
+    def resync(self, ids=None):
+        """
+        Replaces the locally tracked nonces by the ones of the nonce source.
+
+        :param ids: the ids (as int) of the accounts (None for all accounts known to the nonce store)
+        :return: dict of the ids whose nonce changed, mapping to tuples of the old (None if unknown) and the new nonce
+        """
+        if self.__nonce_source is None:
+            raise Exception("tudwallet - Resync needs a nonce source.")
+
+        with self.__lock:
+            known_nonces = self.__nonce_store.get_all()
+            ids = known_nonces.keys() if ids is None else ids
+            changes = {}
+            for id in ids:
+                nonce = self._fetch_nonce(id)
+                if known_nonces.get(id) != nonce:
+                    changes[id] = (known_nonces.get(id), nonce)
+            self.__nonce_store.update({id: nonce for id, (_, nonce) in changes.items()})
+            return changes
+
+    def get_template(self):
+        """
+        Getter: Get the fields shared by all transactions.
+
+        :return: copy of the template (incl. the chain id)
+        """
+        return dict(self.__template, chainId=self.__chain_id)
+
+    def _sign_batch(self, batch):
+        """
+        Assigns the next nonces to a batch of transactions, signs it and persists the new nonces.
+
+        :param batch: list of (id, transaction fields) tuples
+        :return: list of (id, signed transaction) tuples
+        """
+        with self.__lock:
+            next_nonces = {}
+            transactions = []
+            for id, fields in batch:
+                if id not in next_nonces:
+                    nonce = self.__nonce_store.get(id)
+                    next_nonces[id] = self._fetch_nonce(id) if nonce is None else nonce
+                transaction = dict(self.__template)
+                transaction.update(fields)
+                transaction.update(nonce=next_nonces[id], chainId=self.__chain_id)
+                transactions.append((id, transaction))
+                next_nonces[id] += 1
+
+            signed_transactions = self.__wallet.sign_transaction_many(transactions)
+            self.__nonce_store.update(next_nonces)
+        return [(id, signed_transaction) for (id, _), signed_transaction in zip(transactions, signed_transactions)]
+
+    def _fetch_nonce(self, id):
+        """
+        Asks the nonce source for the next nonce of an account. The caller must hold the lock.
+
+        :param id: the id (as int) of the account
+        :return: the next nonce (0 if there is no nonce source)
+        """
+        if self.__nonce_source is None:
+            return 0
+        public_key = self.__wallet.get_public_key(id)
+        if public_key is None:
+            raise Exception("tudwallet - Derive session public key with ID = " + str(id) + " first!")
+        return self.__nonce_source(public_key.address)
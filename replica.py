@@ -0,0 +1,433 @@
+# Author: Leandro Rometsch, 2021
+# Email: leandro@rometsch.org
+# TU Darmstadt, Chair of Applied Cryptography
+
+import json
+import os
+import socket
+import socketserver
+import threading
+import time
+
+from utils.changelog import ChangeLog
+from utils.compact import CompactKeyFile
+from utils.idset import IdIndex
+from utils.keystore import KeyStore
+from utils.records import PublicKey
+from utils.support import delete_files_in_folder, get_dict_from_file, save_dict_to_file
+from wallet import ID_INDEX_FILE_NAME, SPK_DIRECTORY_NAME, SPK_VIEW_FILE_NAME, STATE_FILE_NAME
+
+REPLICA_POSITION_FILE_NAME = "replica.txt"  # Epoch and position of the change stream applied by a replica
+DEFAULT_FETCH_LIMIT = 1000  # Number of changes a replica requests at once
+MAX_FETCH_LIMIT = 10000  # Number of changes a change stream server returns at most per request
+
+
+class DirectoryChangeSource:
+    """Reads the change stream of a hot wallet directly from its directory (same host or shared file system)."""
+
+    def __init__(self, base_directory_hw="data/"):
+        """
+        Instantiate a source for the hot wallet stored in the given directory.
+
+        :param base_directory_hw: specifies the storage location of the primary hot wallet (as given to Wallet)
+        """
+        self.__change_log = ChangeLog(base_directory_hw + "HotWalletData/")
+        if not self.__change_log.exists():
+            raise Exception("tudwallet - No change stream found. Open the wallet with replication=True first!")
+
+    def fetch(self, position, limit=DEFAULT_FETCH_LIMIT, epoch=None):
+        """
+        Reads the changes following a position.
+
+        :param position: the number of changes already applied
+        :param limit: the maximum number of changes
+        :param epoch: the epoch the position belongs to (changes are read from the beginning if it is outdated)
+        :return: dict containing the epoch, the head position and the changes (records)
+        """
+        log_epoch, head, records = self.__change_log.read(position, limit)
+        if epoch is not None and epoch != log_epoch and position > 0:
+            log_epoch, head, records = self.__change_log.read(0, limit)
+        return {"epoch": log_epoch, "head": head, "records": records}
+
+    def close(self):
+        """
+        Nothing to release, the files are opened per fetch.
+        """
+
+
+class SocketChangeSource:
+    """Fetches the change stream of a hot wallet from a ChangeStreamServer (one JSON request/response per line over a
+    persistent TCP connection, which is reopened after errors)."""
+
+    def __init__(self, host, port, timeout=10.0):
+        """
+        Instantiate a source. The connection is opened on the first fetch.
+
+        :param host: host of the change stream server
+        :param port: port of the change stream server
+        :param timeout: seconds to wait for a response
+        """
+        self.__address = (host, port)
+        self.__timeout = timeout
+        self.__connection = None
+        self.__stream = None
+
+    def fetch(self, position, limit=DEFAULT_FETCH_LIMIT, epoch=None):
+        """
+        Requests the changes following a position.
+
+        :param position: the number of changes already applied
+        :param limit: the maximum number of changes
+        :param epoch: the epoch the position belongs to (changes are read from the beginning if it is outdated)
+        :return: dict containing the epoch, the head position and the changes (records)
+        """
+        request = json.dumps({"position": position, "limit": limit, "epoch": epoch}) + "\n"
+        try:
+            if self.__connection is None:
+                self.__connection = socket.create_connection(self.__address, timeout=self.__timeout)
+                self.__stream = self.__connection.makefile('rwb')
+            self.__stream.write(request.encode())
+            self.__stream.flush()
+            line = self.__stream.readline()
+            if not line:
+                raise ConnectionError("Change stream server closed the connection.")
+        except OSError:
+            self.close()
+            raise
+
+        response = json.loads(line)
+        if "error" in response:
+            raise Exception("tudwallet - Change stream server failed: " + response["error"])
+        return response
+
+    def close(self):
+        """
+        Close the connection to the server.
+        """
+        if self.__stream is not None:
+            self.__stream.close()
+            self.__stream = None
+        if self.__connection is not None:
+            self.__connection.close()
+            self.__connection = None
+
+
+class ChangeStreamServer:
+    """Serves the change stream of a hot wallet to replicas on other hosts. The server only reads the change log files,
+    so it can run in its own process next to the (single) primary wallet."""
+
+    def __init__(self, base_directory_hw="data/", host="127.0.0.1", port=0):
+        """
+        Instantiate a server. It starts serving with start().
+
+        :param base_directory_hw: specifies the storage location of the primary hot wallet (as given to Wallet)
+        :param host: the interface to listen on
+        :param port: the port to listen on (0 picks a free port, see get_address())
+        """
+        source = DirectoryChangeSource(base_directory_hw)
+
+        class Handler(socketserver.StreamRequestHandler):
+            def handle(self):
+                for line in self.rfile:
+                    try:
+                        request = json.loads(line)
+                        response = source.fetch(int(request["position"]),
+                                                max(1, min(int(request.get("limit", DEFAULT_FETCH_LIMIT)),
+                                                           MAX_FETCH_LIMIT)), request.get("epoch"))
+                    except Exception as error:  # Reported to the replica, the connection stays usable
+                        response = {"error": str(error)}
+                    self.wfile.write((json.dumps(response, separators=(',', ':')) + "\n").encode())
+
+        self.__server = socketserver.ThreadingTCPServer((host, port), Handler, bind_and_activate=True)
+        self.__server.daemon_threads = True
+        self.__thread = None
+
+    def start(self):
+        """
+        Start serving in a background (daemon) thread.
+        """
+        if self.__thread is None:
+            self.__thread = threading.Thread(target=self.__server.serve_forever, name="tudwallet-changes", daemon=True)
+            self.__thread.start()
+
+    def stop(self):
+        """
+        Stop serving and close the listening socket.
+        """
+        if self.__thread is not None:
+            self.__server.shutdown()
+            self.__thread.join()
+            self.__thread = None
+        self.__server.server_close()
+
+    def get_address(self):
+        """
+        Getter: Get the address the server listens on.
+
+        :return: tuple of host and port
+        """
+        return self.__server.server_address[:2]
+
+    def __enter__(self):
+        self.start()
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.stop()
+
+
+class WalletReplica:
+    """A read replica of a hot wallet: it applies the change stream of the primary incrementally and serves read-only
+    queries, while derivation stays with the single primary. The replica stores the keys in the layout of a hot wallet
+    (incl. the compact keystore file), so WalletView processes can read a replica too. Its position in the change
+    stream is persisted after every applied batch, so a restarted replica resumes where it stopped."""
+
+    def __init__(self, base_directory="replica/", source=None, batch_size=DEFAULT_FETCH_LIMIT):
+        """
+        Instantiate a replica.
+
+        :param base_directory: specifies the storage location of the replica
+        :param source: the change stream to follow (DirectoryChangeSource or SocketChangeSource)
+        :param batch_size: number of changes fetched and applied at once
+        """
+        if source is None:
+            raise ValueError("A replica needs a change source.")
+        if batch_size < 1:
+            raise ValueError("The batch size must be positive.")
+
+        directory = base_directory + "HotWalletData/"
+        if not os.path.exists(directory):
+            os.makedirs(directory)
+
+        self.__source = source
+        self.__batch_size = batch_size
+        self.__directory = directory
+        self.__session_public_store = KeyStore(directory + SPK_DIRECTORY_NAME)
+        self.__state_file_path = directory + STATE_FILE_NAME
+        self.__id_index = IdIndex(self.__state_file_path, directory + ID_INDEX_FILE_NAME)
+        self.__view_file = CompactKeyFile(directory + SPK_VIEW_FILE_NAME)
+        self.__position_file_path = directory + REPLICA_POSITION_FILE_NAME
+        self.__lock = threading.RLock()
+
+        self.__position = {"epoch": None, "position": 0, "time": None}
+        if os.path.exists(self.__position_file_path):
+            self.__position = get_dict_from_file(self.__position_file_path)
+        self.__head = None  # Head of the change stream at the last fetch
+        self.__caught_up_time = None
+        self.__applied = 0
+        self.__last_error = None
+
+        self.__stopped = threading.Event()
+        self.__thread = None
+
+    def sync(self, max_records=None):
+        """
+        Fetches and applies changes until the replica has caught up with the primary.
+
+        :param max_records: maximum number of changes to apply (None for no limit)
+        :return: the number of applied changes
+        """
+        applied = 0
+        with self.__lock:
+            while max_records is None or applied < max_records:
+                limit = self.__batch_size if max_records is None else min(self.__batch_size, max_records - applied)
+                response = self.__source.fetch(self.__position["position"], limit, self.__position["epoch"])
+                if response["epoch"] != self.__position["epoch"]:
+                    self._reset(response["epoch"])  # New replica or the primary started over (new master key)
+                    continue
+
+                self.__head = response["head"]
+                records = response["records"]
+                if not records or records[0]["seq"] != self.__position["position"] + 1:
+                    break
+                self._apply(records)
+                applied += len(records)
+                self.__applied += len(records)
+
+            self.__last_error = None
+            if self.__head is not None and self.__position["position"] >= self.__head:
+                self.__caught_up_time = time.time()
+        return applied
+
+    def start(self, interval=1.0):
+        """
+        Follow the primary in a background (daemon) thread, which syncs every interval seconds.
+        Errors (e.g. an unreachable server) are reported by get_status() and the next sync is tried as usual.
+
+        :param interval: seconds between two syncs
+        """
+        if interval <= 0:
+            raise ValueError("Sync interval must be positive.")
+        if self.__thread is not None:
+            return
+        self.__stopped.clear()
+        self.__thread = threading.Thread(target=self._run, args=(interval,), name="tudwallet-replica", daemon=True)
+        self.__thread.start()
+
+    def stop(self):
+        """
+        Stop following the primary.
+        """
+        if self.__thread is None:
+            return
+        self.__stopped.set()
+        self.__thread.join()
+        self.__thread = None
+
+    def get_position(self):
+        """
+        Getter: Get the position of the last applied change, which is where the replica resumes.
+
+        :return: dict containing the epoch and the position
+        """
+        return {"epoch": self.__position["epoch"], "position": self.__position["position"]}
+
+    def get_lag(self):
+        """
+        Learn how far the replica is behind the primary (as of the last fetch).
+
+        :return: dict containing records (changes not applied yet) and seconds (age of the last applied change if the
+                 replica is behind, 0 if it has caught up)
+        """
+        records = 0 if self.__head is None else max(0, self.__head - self.__position["position"])
+        seconds = 0.0
+        if records > 0 and self.__position["time"] is not None:
+            seconds = max(0.0, time.time() - self.__position["time"])
+        return {"records": records, "seconds": seconds}
+
+    def get_status(self):
+        """
+        Learn the state of the replication.
+
+        :return: dict containing position, head, lag, the time the replica was caught up last, the number of changes
+                 applied by this instance and the last sync error
+        """
+        return {"position": self.get_position(), "head": self.__head, "lag": self.get_lag(),
+                "last_caught_up": self.__caught_up_time, "applied": self.__applied, "last_error": self.__last_error}
+
+    def get_public_key(self, id):
+        """
+        Look up the session public key of the given id.
+
+        :param id: the id (as int)
+        :return: the session public key as record "PublicKey" or None if no key has been replicated for this id
+        """
+        stored_key = self.__session_public_store.get(id)
+        if stored_key is None:
+            return None
+        x, y = stored_key.split(",")
+        return PublicKey(None, id, int(x), int(y))
+
+    def get_address(self, id):
+        """
+        Look up the Ethereum address of the given id.
+
+        :param id: the id (as int)
+        :return: the address or None if no key has been replicated for this id
+        """
+        public_key = self.get_public_key(id)
+        return None if public_key is None else public_key.address
+
+    def iter_public_keys(self, start_id=1):
+        """
+        Streams all replicated session public keys in ascending id order.
+
+        :param start_id: the lowest id to be returned
+        :return: generator of session public keys as record "PublicKey"
+        """
+        for id, stored_key in self.__session_public_store.iterate(start_id):
+            x, y = stored_key.split(",")
+            yield PublicKey(None, id, int(x), int(y))
+
+    def get_ids(self):
+        """
+        List all replicated ids (including ids without key pair, e.g. id 0 and lane anchors).
+
+        :return: the ids
+        """
+        return list(self.__id_index.get())
+
+    def get_max_id(self):
+        """
+        Extracts the highest replicated id.
+
+        :return: the highest id (0 if nothing has been replicated yet)
+        """
+        max_id = self.__id_index.get().get_max()
+        return 0 if max_id is None else max_id
+
+    def has_id(self, id):
+        """
+        Check if an id has been replicated.
+
+        :param id: the id (as int)
+        :return: True if the id is replicated, False if not
+        """
+        return id in self.__id_index.get()
+
+    def close(self):
+        """
+        Stop following the primary and close the source.
+        """
+        self.stop()
+        self.__source.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
+
+    def _run(self, interval):
+        while True:
+            try:
+                self.sync()
+            except Exception as error:
+                self.__last_error = str(error)
+            if self.__stopped.wait(interval):
+                return
+
+    def _apply(self, records):
+        """
+        Applies changes to the replicated files and persists the new position afterwards. Changes applied before a
+        crash (but not recorded in the position) are applied again, which leaves the files unchanged.
+
+        :param records: the changes in stream order
+        """
+        id_set = self.__id_index.get()
+        new_records = [record for record in records if record["id"] not in id_set]
+        id_state_map = get_dict_from_file(self.__state_file_path) if os.path.exists(self.__state_file_path) else {}
+        for record in new_records:
+            id_state_map[str(record["id"])] = record["state"]
+
+        self.__session_public_store.put_many([(record["id"], record["key"]) for record in new_records
+                                              if record["key"] is not None])
+        self.__session_public_store.sync()
+        save_dict_to_file(self.__state_file_path, id_state_map, fsync=True)
+        self.__id_index.add_many(record["id"] for record in new_records)
+
+        last_view_id = self.__view_file.get_last_id()
+        entries = [(record["id"], PublicKey(None, record["id"], *map(int, record["key"].split(","))).coordinates)
+                   for record in records if record["key"] is not None and record["id"] > last_view_id]
+        if not self.__view_file.exists() or any(record["key"] is not None and record["id"] <= last_view_id
+                                                for record in new_records) \
+                or any(first[0] >= second[0] for first, second in zip(entries, entries[1:])):
+            self.__view_file.rebuild((public_key.id, public_key.coordinates) for public_key in self.iter_public_keys())
+        else:
+            self.__view_file.append(entries)
+
+        self.__position = {"epoch": self.__position["epoch"], "position": records[-1]["seq"],
+                           "time": records[-1]["time"]}
+        save_dict_to_file(self.__position_file_path, self.__position, fsync=True)
+
+    def _reset(self, epoch):
+        """
+        Drops all replicated data and starts over at the beginning of the given epoch of the change stream.
+
+        :param epoch: the epoch
+        """
+        self.__view_file.retire()  # Release the old keys from read-only views before deleting them
+        delete_files_in_folder(self.__directory)
+        self.__id_index = IdIndex(self.__state_file_path, self.__directory + ID_INDEX_FILE_NAME)  # Drop cached ids
+        self.__position = {"epoch": epoch, "position": 0, "time": None}
+        save_dict_to_file(self.__position_file_path, self.__position, fsync=True)
@@ -0,0 +1,39 @@
+# Author: Leandro Rometsch, 2021
+# Email: leandro@rometsch.org
+# TU Darmstadt, Chair of Applied Cryptography
+
+import os
+
+from utils.bundle import REQUEST_BUNDLE_FORMAT, load_bundle, save_bundle
+from wallet import MSK_FILE_NAME, _ColdWallet
+
+
+class ColdSigner:
+    """The cold wallet on its own, for offline (air-gapped) signing. The hot wallet bundles many transactions and
+    messages into a signing request (Wallet.create_signing_bundle()), the cold signer processes the whole request in
+    one session and writes back a result bundle that the hot wallet imports (Wallet.import_signed_bundle())."""
+
+    def __init__(self, base_directory_cw="data/", cold_wallet_wrapper=None):
+        """
+        Instantiate a signer for the cold wallet stored in the given directory.
+
+        :param base_directory_cw: specifies the storage location of the cold wallet (as given to Wallet)
+        :param cold_wallet_wrapper: optional ColdWalletWrapper to be used (created on demand if None)
+        """
+        directory = base_directory_cw + "ColdWalletData/"
+        if not os.path.exists(directory + MSK_FILE_NAME):
+            raise Exception("tudwallet - No cold wallet found in " + base_directory_cw + ". Call "
+                            "Wallet.generate_master_key() first!")
+        self.__cold_wallet = _ColdWallet(directory, wrapper=cold_wallet_wrapper)
+
+    def sign_bundle(self, request_path, result_path):
+        """
+        Signs all transactions and messages of a signing request bundle and writes the result bundle.
+
+        :param request_path: the path of the request bundle file (created by the hot wallet)
+        :param result_path: the path where the result bundle file should be written to
+        :return: the number of signatures
+        """
+        result = self.__cold_wallet.sign_bundle(load_bundle(request_path, REQUEST_BUNDLE_FORMAT))
+        save_bundle(result_path, result)
+        return len(result["transactions"]) + len(result["messages"])
@@ -0,0 +1,56 @@
+# Author: Leandro Rometsch, 2021
+# Email: leandro@rometsch.org
+# TU Darmstadt, Chair of Applied Cryptography
+
+import os
+import shutil
+import unittest
+import tools.appcds as appcds
+from utils import wrapper
+
+
+class TestAppCds(unittest.TestCase):
+    folder_location = "tests/fixture/testAppCdsData/"
+
+    def setUp(self):
+        self.environment_value = os.environ.get(wrapper.CDS_ARCHIVE_ENVIRONMENT_VARIABLE)
+
+    def tearDown(self):
+        if self.environment_value is None:
+            os.environ.pop(wrapper.CDS_ARCHIVE_ENVIRONMENT_VARIABLE, None)
+        else:
+            os.environ[wrapper.CDS_ARCHIVE_ENVIRONMENT_VARIABLE] = self.environment_value
+        if os.path.exists(self.folder_location):
+            shutil.rmtree(self.folder_location)
+
+    def test_archive_path(self):
+        os.makedirs(self.folder_location)
+        archive_path = self.folder_location + "test.jsa"
+
+        os.environ[wrapper.CDS_ARCHIVE_ENVIRONMENT_VARIABLE] = archive_path
+        self.assertIsNone(wrapper.get_cds_archive_path())  # Not built yet
+        open(archive_path, 'wb').close()
+        self.assertEqual(wrapper.get_cds_archive_path(), archive_path)
+
+        os.environ[wrapper.CDS_ARCHIVE_ENVIRONMENT_VARIABLE] = ""
+        self.assertIsNone(wrapper.get_cds_archive_path())  # Disabled
+
+    def test_find_java_executable(self):
+        self.assertTrue(os.access(appcds.find_java_executable(), os.X_OK))
+
+    def test_build_and_benchmark(self):
+        os.makedirs(self.folder_location)
+        archive_path = os.path.abspath(self.folder_location + "test.jsa")
+
+        class_count = appcds.build(archive_path)
+        self.assertTrue(class_count > 100)
+        self.assertTrue(os.path.getsize(archive_path) > 0)
+
+        report = appcds.benchmark(runs=1, archive_path=archive_path)
+        self.assertEqual(set(report.keys()), {"without_archive", "with_archive"})
+        for medians in report.values():
+            self.assertTrue(0 < medians["jvm_start"] <= medians["total"] <= medians["process"])
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -3,6 +3,7 @@
 # TU Darmstadt, Chair of Applied Cryptography
 
 import unittest
+from utils.jvmmetrics import get_jvm_metrics
 from utils.wrapper import ColdWalletWrapper
 
 
@@ -28,6 +29,16 @@ class TestJvm(unittest.TestCase):
         self.assertTrue(key_type == '<java class \'com.ewallet.field.util.EllipticCurvePoint\'>')
         self.assertTrue(key_length > 100)
 
+    def test_jvm_metrics(self):
+        ColdWalletWrapper().master_gen()
+
+        metrics = get_jvm_metrics()
+        self.assertTrue(metrics["jvm"]["heap"]["used"] > 0)
+        self.assertTrue(metrics["jvm"]["loaded_classes"] > 0)
+        self.assertTrue(len(metrics["jvm"]["garbage_collectors"]) > 0)
+        self.assertTrue(metrics["jni"]["ColdWallet.MasterGen"]["calls"] >= 1)
+        self.assertTrue(metrics["jni"]["ColdWallet.<init>"]["estimated_crossings"] >= 2)
+
 
 if __name__ == '__main__':
     unittest.main()
@@ -0,0 +1,57 @@
+# Author: Leandro Rometsch, 2021
+# Email: leandro@rometsch.org
+# TU Darmstadt, Chair of Applied Cryptography
+
+import os
+import shutil
+import unittest
+import tools.loadtest as loadtest
+
+
+class TestLoadTest(unittest.TestCase):
+    folder_location = "tests/fixture/testLoadTestData/"
+
+    def tearDown(self):
+        if os.path.exists(self.folder_location):
+            shutil.rmtree(self.folder_location)
+
+    def test_latency_histogram(self):
+        histogram = loadtest.LatencyHistogram()
+        self.assertEqual(histogram.percentile(50), 0.0)
+
+        for i in range(1, 1001):
+            histogram.record(i / 1000)
+        summary = histogram.get_summary()
+        self.assertEqual(summary["count"], 1000)
+        self.assertAlmostEqual(summary["p50"], 0.5, delta=0.5 * 0.02)
+        self.assertAlmostEqual(summary["p99"], 0.99, delta=0.99 * 0.02)
+        self.assertEqual(summary["max"], 1.0)
+
+    def test_workload(self):
+        workload = loadtest.generate_workload(120, burst_every=50, burst_size=10, seed=1)
+        self.assertEqual(len(workload), 120)
+        self.assertEqual(workload, loadtest.generate_workload(120, burst_every=50, burst_size=10, seed=1))
+        self.assertEqual(workload[50:60], [{"op": loadtest.OP_PUBLIC_KEY_DERIVE}] * 10)
+
+        os.makedirs(self.folder_location)
+        loadtest.save_workload(self.folder_location + "workload.jsonl", workload)
+        self.assertEqual(loadtest.load_workload(self.folder_location + "workload.jsonl"), workload)
+
+        with self.assertRaises(ValueError):
+            loadtest.generate_workload(10, mix={"unknown": 1.0})
+
+    def test_run(self):
+        workload = loadtest.generate_workload(40, burst_every=20, burst_size=5)
+        report = loadtest.LoadTest(workload, rate=None, concurrency=2, sample_interval=0.1,
+                                   directory=self.folder_location).run()
+
+        self.assertEqual(sum(summary["count"] for summary in report["operations"].values()), 40)
+        self.assertEqual(sum(summary["errors"] for summary in report["operations"].values()), 0)
+        self.assertGreater(report["throughput"], 0)
+        self.assertGreater(report["wallet_bytes"], 0)
+        self.assertTrue(report["timeline"])
+        self.assertIn("p999", loadtest.format_report(report))
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,95 @@
+# Author: Leandro Rometsch, 2021
+# Email: leandro@rometsch.org
+# TU Darmstadt, Chair of Applied Cryptography
+
+import shutil
+import threading
+import tracemalloc
+import unittest
+import manager as tudmanager
+import utils.support
+from eth_account import Account
+
+
+class TestWalletManager(unittest.TestCase):
+    manager = None
+    folder_location = "tests/fixture/testManagerData/"
+    tenants = ["alice", "bob", "carol"]
+
+    def setUp(self):
+        self.manager = tudmanager.WalletManager(self.folder_location, self.folder_location, max_open_wallets=2)
+        self.manager.generate_master_keys(self.tenants, overwrite=True)
+
+    def tearDown(self):
+        self.manager.close()
+        shutil.rmtree(self.folder_location)
+
+    def test_lru_of_open_wallets(self):
+        self.assertEqual(self.manager.get_open_tenants(), ["bob", "carol"])
+
+        self.manager.get_wallet("bob")
+        self.manager.get_wallet("alice")
+        self.assertEqual(self.manager.get_open_tenants(), ["bob", "alice"])
+
+        self.manager.close_wallet("bob")
+        self.assertEqual(self.manager.get_open_tenants(), ["alice"])
+
+    def test_public_key_derive_many(self):
+        public_keys = self.manager.public_key_derive_many(self.tenants)
+        self.assertEqual(set(public_keys.keys()), set(self.tenants))
+        for public_key in public_keys.values():
+            self.assertTrue(type(public_key) == utils.support.PublicKey)
+            self.assertEqual(public_key.id, 1)
+
+        # Every tenant has its own master key and therefore its own addresses
+        self.assertEqual(len({public_key.address for public_key in public_keys.values()}), len(self.tenants))
+
+        # Reopened (previously evicted) wallets continue where they stopped
+        public_keys = self.manager.public_key_derive_many(self.tenants)
+        for public_key in public_keys.values():
+            self.assertEqual(public_key.id, 2)
+
+    def test_tenants_in_threads(self):
+        manager = tudmanager.WalletManager(self.folder_location, self.folder_location, max_open_wallets=8)
+        results = {}
+
+        def derive(tenant):
+            results[tenant] = [manager.get_wallet(tenant).public_key_derive() for i in range(5)]
+
+        threads = [threading.Thread(target=derive, args=(tenant,)) for tenant in self.tenants]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        for tenant in self.tenants:
+            # The shared java hot wallet was used concurrently, the keys are the same as when derived one by one
+            self.assertEqual([public_key.id for public_key in results[tenant]], [1, 2, 3, 4, 5])
+            sks = manager.get_wallet(tenant).secret_key_derive_many(range(1, 6))
+            self.assertEqual([Account.from_key(sk.key).address for sk in sks],
+                             [public_key.address for public_key in results[tenant]])
+        manager.close()
+
+    def test_memory_per_open_wallet(self):
+        tenants = ["tenant" + str(i) for i in range(33)]
+        self.manager.generate_master_keys(tenants, overwrite=True)
+        manager = tudmanager.WalletManager(self.folder_location, self.folder_location, max_open_wallets=len(tenants))
+        manager.get_wallet(tenants[0])  # Starts the JVM and creates the shared wrappers
+
+        tracemalloc.start()
+        try:
+            memory_before = tracemalloc.get_traced_memory()[0]
+            for tenant in tenants[1:]:
+                manager.get_wallet(tenant)
+            memory_per_wallet = (tracemalloc.get_traced_memory()[0] - memory_before) / (len(tenants) - 1)
+        finally:
+            tracemalloc.stop()
+        self.assertLess(memory_per_wallet, 16 * 1024)  # A few KB per tenant (python objects, the java ones are shared)
+        manager.close()
+
+    def test_invalid_tenant(self):
+        with self.assertRaises(ValueError):
+            self.manager.get_wallet("../escape")
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,122 @@
+# Author: Leandro Rometsch, 2021
+# Email: leandro@rometsch.org
+# TU Darmstadt, Chair of Applied Cryptography
+
+import os
+import shutil
+import time
+import unittest
+import replica as tudreplica
+import view as tudview
+import utils.derivation
+import utils.secp256k1
+import utils.support
+import wallet as tudwallet
+
+
+class TestWalletReplica(unittest.TestCase):
+    folder_location = "tests/fixture/testReplicaData/"
+    primary_location = folder_location + "primary/"
+    hot_wallet_location = primary_location + "HotWalletData/"
+
+    def setUp(self):
+        self.create_hot_wallet_files()
+        self.hot_wallet = self.open_hot_wallet(replication=True)
+        self.hot_wallet.public_key_derive_many([1, 2, 3])
+
+    def tearDown(self):
+        shutil.rmtree(self.folder_location)
+
+    def create_hot_wallet_files(self):
+        # A hot wallet without cold wallet (no JVM needed): the generator point serves as master public key
+        os.makedirs(self.hot_wallet_location)
+        with open(self.hot_wallet_location + tudwallet.MPK_FILE_NAME, 'w') as key_file:
+            key_file.write(str(utils.secp256k1.G[0]) + "\n" + str(utils.secp256k1.G[1]) + "\n")
+        utils.support.save_dict_to_file(self.hot_wallet_location + tudwallet.STATE_FILE_NAME, {"0": [7] * 16})
+
+    def open_hot_wallet(self, replication=False):
+        return tudwallet._HotWallet(self.hot_wallet_location, derivation_engine=utils.derivation.ENGINE_PYTHON,
+                                    replication=replication)
+
+    def assert_replicated(self, replica):
+        self.assertEqual(replica.get_ids(), self.hot_wallet.get_ids())
+        for public_key in replica.iter_public_keys():
+            self.assertEqual(public_key.coordinates, self.hot_wallet.public_key_derive(public_key.id))
+        self.assertEqual([public_key.id for public_key in replica.iter_public_keys()],
+                         [id for id in self.hot_wallet.get_ids() if not self.hot_wallet.is_anchor(id)])
+
+    def test_directory_source(self):
+        replica = tudreplica.WalletReplica(self.folder_location + "replica/",
+                                           tudreplica.DirectoryChangeSource(self.primary_location), batch_size=2)
+        self.assertEqual(replica.sync(), 4)  # id 0 and three keys
+        self.assert_replicated(replica)
+        self.assertEqual(replica.get_lag(), {"records": 0, "seconds": 0.0})
+
+        self.hot_wallet.create_lanes(1, lane_size=100)
+        self.hot_wallet.public_key_derive_lanes({1: 2, 0: 2})
+        self.assertEqual(replica.sync(max_records=1), 1)
+        self.assertEqual(replica.get_lag()["records"], 4)
+        self.assertGreaterEqual(replica.get_lag()["seconds"], 0.0)
+
+        replica.sync()
+        self.assert_replicated(replica)
+        self.assertEqual(replica.get_max_id(), 102)
+        self.assertFalse(replica.has_id(6))
+        self.assertIsNone(replica.get_public_key(100))  # Lane anchors have no key pair
+        self.assertEqual(replica.get_address(101), replica.get_public_key(101).address)
+
+        with tudview.WalletView(self.folder_location + "replica/") as view:  # Replicas can be viewed as well
+            self.assertEqual([public_key.id for public_key in view.iter_public_keys()], [1, 2, 3, 4, 5, 101, 102])
+
+    def test_resume_and_reset(self):
+        replica_location = self.folder_location + "replica/"
+        replica = tudreplica.WalletReplica(replica_location, tudreplica.DirectoryChangeSource(self.primary_location))
+        replica.sync(max_records=2)
+        position = replica.get_position()
+
+        self.hot_wallet.public_key_derive_many([4])
+        resumed = tudreplica.WalletReplica(replica_location, tudreplica.DirectoryChangeSource(self.primary_location))
+        self.assertEqual(resumed.get_position(), position)
+        self.assertEqual(resumed.sync(), 3)
+        self.assert_replicated(resumed)
+
+        self.hot_wallet.reset_change_log()  # E.g. a new master key: the replica starts over
+        self.assertEqual(resumed.sync(), 5)
+        self.assertNotEqual(resumed.get_position()["epoch"], position["epoch"])
+        self.assert_replicated(resumed)
+
+    def test_socket_source(self):
+        with tudreplica.ChangeStreamServer(self.primary_location) as server:
+            host, port = server.get_address()
+            with tudreplica.WalletReplica(self.folder_location + "replica/",
+                                          tudreplica.SocketChangeSource(host, port)) as replica:
+                replica.start(interval=0.01)
+                self.hot_wallet.public_key_derive_many([4, 5])
+
+                deadline = time.time() + 10
+                while replica.get_position()["position"] < self.hot_wallet.get_replication_head()["position"]:
+                    self.assertLess(time.time(), deadline)
+                    time.sleep(0.01)
+                replica.stop()
+
+                self.assert_replicated(replica)
+                self.assertIsNone(replica.get_status()["last_error"])
+
+    def test_enable_on_existing_wallet(self):
+        shutil.rmtree(self.hot_wallet_location)
+        self.create_hot_wallet_files()
+        self.hot_wallet = self.open_hot_wallet()  # Replication disabled at first
+        self.hot_wallet.public_key_derive_many([1, 2])
+        self.assertIsNone(self.hot_wallet.get_replication_head())
+        with self.assertRaises(Exception):
+            tudreplica.DirectoryChangeSource(self.primary_location)
+
+        self.hot_wallet = self.open_hot_wallet(replication=True)  # Starts with a snapshot of the wallet
+        self.assertEqual(self.hot_wallet.get_replication_head()["position"], 3)
+        self.hot_wallet = self.open_hot_wallet()  # An existing change stream is maintained anyway
+        self.hot_wallet.public_key_derive_many([3])
+        self.assertEqual(self.hot_wallet.get_replication_head()["position"], 4)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -2,23 +2,62 @@
 # Email: leandro@rometsch.org
 # TU Darmstadt, Chair of Applied Cryptography
 
+import copy
+import json
+import shutil
+import tempfile
+import threading
+import time
 import unittest
+import random
+import utils.cache
+import utils.changelog
+import utils.derivation
+import utils.idset
+import utils.jvmmetrics
+import utils.secp256k1
+import utils.keystore
+import utils.nonces
+import utils.records
+import utils.wal
 import utils.support
+import utils.typeddata
+import tools.eip712
 import wallet as tudwallet
 import os
+from eth_account import Account
+from eth_account.messages import encode_typed_data
+from eth_keys import keys
+
+
+def copy_fixture(fixture_location):
+    """
+    Copies a committed wallet fixture to a temporary directory, so tests never modify tracked files.
+
+    :param fixture_location: the fixture directory
+    :return: the temporary directory (with trailing slash)
+    """
+    folder_location = tempfile.mkdtemp(prefix="tudwallet-test-") + "/"
+    shutil.copytree(fixture_location, folder_location, dirs_exist_ok=True)
+    return folder_location
 
 
 class TestDataclasses(unittest.TestCase):
     wallet = None
-    folder_location = "tests/fixture/testDataclassesData/"
+    fixture_location = "tests/fixture/testDataclassesData/"
     intended_id = 1
 
     def setUp(self):
+        # Work on a copy, opening a wallet writes to its directories (e.g. the id index of the cold wallet)
+        self.folder_location = copy_fixture(self.fixture_location)
         self.wallet = tudwallet.Wallet(self.folder_location, self.folder_location)
         # self.wallet.generate_master_key(overwrite=False) -> master key already created
         # self.wallet.public_key_derive(1) -> data already present
         # self.wallet.secret_key_derive(1) -> data already present
 
+    def tearDown(self):
+        shutil.rmtree(self.folder_location)
+
     def test_public_key(self):
         public_key = self.wallet.public_key_derive(self.intended_id)
         self.assertTrue(type(public_key) == utils.support.PublicKey)
@@ -34,6 +73,48 @@ class TestDataclasses(unittest.TestCase):
         self.assertTrue(private_key.key.startswith("0x"))
 
 
+class TestRecords(unittest.TestCase):
+    secret_key = bytes.fromhex("00" + "11" * 31)  # Leading zero byte must be kept
+
+    def test_private_key(self):
+        private_key = utils.records.PrivateKey(key=int.from_bytes(self.secret_key, "big"), id=1)
+        self.assertEqual(private_key.key, "0x" + self.secret_key.hex())
+        self.assertEqual(len(private_key.key), 66)
+        self.assertEqual(private_key, utils.records.PrivateKey(key=private_key.key, id=1))
+        self.assertEqual(private_key, utils.records.PrivateKey(key=self.secret_key, id=1))
+
+        with self.assertRaises(AttributeError):
+            private_key.other = "no __dict__"
+
+    def test_public_key(self):
+        coordinates = keys.PrivateKey(self.secret_key).public_key.to_bytes()
+        public_key = utils.records.PublicKey.from_coordinates(1, coordinates)
+
+        self.assertEqual(public_key.address, Account.from_key(self.secret_key).address)
+        self.assertEqual(int(public_key.x, 16), int.from_bytes(coordinates[:32], "big"))
+        self.assertEqual(int(public_key.y, 16), int.from_bytes(coordinates[32:], "big"))
+        self.assertEqual(public_key, utils.records.PublicKey(None, 1, public_key.x, public_key.y))
+        self.assertEqual(public_key, utils.records.PublicKey(public_key.address, 1, public_key.x, public_key.y))
+
+    def test_key_table(self):
+        table = utils.records.KeyTable()
+        expected = []
+        for id in range(1, 4):
+            secret_key = id.to_bytes(32, "big")
+            coordinates = keys.PrivateKey(secret_key).public_key.to_bytes()
+            table.append_coordinates(id, coordinates)
+            expected.append(utils.records.PublicKey.from_coordinates(id, coordinates))
+
+        self.assertEqual(len(table), 3)
+        self.assertEqual(list(table), expected)
+        self.assertEqual(table[-1], expected[-1])
+        self.assertEqual(list(table.get_ids()), [1, 2, 3])
+        self.assertEqual(list(table.addresses()), [(pk.id, pk.address) for pk in expected])
+
+        with self.assertRaises(IndexError):
+            table[3]
+
+
 class TestDictProcessing(unittest.TestCase):
     folder_location = "tests/fixture/testDictProcessingData/"
     file_location = folder_location + "test_dict.txt"
@@ -53,6 +134,16 @@ class TestDictProcessing(unittest.TestCase):
         received_dict = utils.support.get_dict_from_file(self.file_location)
         self.assertEqual(received_dict, self.test_dict)
 
+    def test_dict_appending(self):
+        new_file_location = self.folder_location + "test_appended_dict.txt"
+        utils.support.save_dict_to_file(new_file_location, {"1": [1]})
+        utils.support.append_dict_to_file(new_file_location, {"2": [2]})
+        with open(new_file_location, 'a') as txt_file:
+            txt_file.write('\n{"3": [3')  # Update torn by a crash
+        utils.support.append_dict_to_file(new_file_location, {"1": [4], "5": [5]})
+        self.assertEqual(utils.support.get_dict_from_file(new_file_location), {"1": [4], "2": [2], "5": [5]})
+        os.remove(new_file_location)
+
     def test_find_second_highest_key(self):
         second_highest = utils.support.find_second_highest_key_in_dict(self.test_dict)
         self.assertEqual("3", second_highest)
@@ -69,14 +160,28 @@ class TestDictProcessing(unittest.TestCase):
         with self.assertRaises(Exception):
             second_highest = utils.support.find_second_highest_key_in_dict(empty_dict)
 
+    def test_find_preceding_id(self):
+        sorted_ids = [0, 1, 2, 5]
+        self.assertEqual(utils.support.find_preceding_id(sorted_ids, 1), 0)
+        self.assertEqual(utils.support.find_preceding_id(sorted_ids, 5), 2)
+        self.assertEqual(utils.support.find_preceding_id(sorted_ids, 4), 2)
+
+        with self.assertRaises(Exception):
+            utils.support.find_preceding_id(sorted_ids, 0)
+
+
 class TestKeyLoading(unittest.TestCase):
     wallet = None
-    folder_location = "tests/fixture/testKeyLoadingData/"
+    fixture_location = "tests/fixture/testKeyLoadingData/"
 
     def setUp(self):
+        self.folder_location = copy_fixture(self.fixture_location)
         self.wallet = tudwallet.Wallet(self.folder_location, self.folder_location)
         # self.wallet.generate_master_key(overwrite=False) -> master key already created
 
+    def tearDown(self):
+        shutil.rmtree(self.folder_location)
+
     def test_private_key_loading(self):
         key = utils.support.get_private_key_from_file(self.folder_location + "ColdWalletData/MSK.key")
         self.assertEqual(str(key), "112357194824290667643081788596717750908569231627957702069966763736710490688244")
@@ -89,5 +194,588 @@ class TestKeyLoading(unittest.TestCase):
         self.assertEqual(y, '13562228381135751081805438548054675439132929618183591005162696899711915154384')
 
 
+class TestSecretKeyCache(unittest.TestCase):
+    key_one = bytes(range(32))
+    key_two = bytes(range(32, 64))
+
+    def test_hit_and_miss(self):
+        cache = utils.cache.SecretKeyCache(max_size=2, ttl=None)
+        self.assertIsNone(cache.get(1))
+        cache.put(1, self.key_one)
+        self.assertEqual(cache.get(1), self.key_one)
+
+        statistics = cache.get_statistics()
+        self.assertEqual(statistics["hits"], 1)
+        self.assertEqual(statistics["misses"], 1)
+        self.assertEqual(statistics["size"], 1)
+
+    def test_lru_eviction(self):
+        cache = utils.cache.SecretKeyCache(max_size=2, ttl=None)
+        cache.put(1, self.key_one)
+        cache.put(2, self.key_two)
+        cache.get(1)  # 2 is now the least recently used key
+        cache.put(3, self.key_one)
+
+        self.assertIsNone(cache.get(2))
+        self.assertEqual(cache.get(1), self.key_one)
+        self.assertEqual(cache.get_statistics()["evictions"], 1)
+
+    def test_ttl_expiry(self):
+        cache = utils.cache.SecretKeyCache(max_size=2, ttl=0.01)
+        cache.put(1, self.key_one)
+        time.sleep(0.02)
+        self.assertIsNone(cache.get(1))
+        self.assertEqual(len(cache), 0)
+
+    def test_clear(self):
+        cache = utils.cache.SecretKeyCache(max_size=2, ttl=None)
+        cache.put(1, self.key_one)
+        cache.clear()
+        self.assertIsNone(cache.get(1))
+        self.assertEqual(len(cache), 0)
+
+    def test_put_after_clear(self):
+        cache = utils.cache.SecretKeyCache(max_size=2, ttl=None)
+        generation = cache.get_generation()  # Taken before the key is derived
+        cache.clear()  # e.g. the master key is replaced meanwhile
+        cache.put(1, self.key_one, generation=generation)
+        self.assertIsNone(cache.get(1))
+
+        cache.put(1, self.key_one, generation=cache.get_generation())
+        self.assertEqual(cache.get(1), self.key_one)
+
+
+class TestSignatureCache(unittest.TestCase):
+    def test_retry_is_answered_from_cache(self):
+        cache = utils.cache.SignatureCache(max_size=2, ttl=None)
+        calls = []
+        for i in range(3):
+            self.assertEqual(cache.get_or_sign((1, b"hash"), lambda: calls.append(1) or "signature"), "signature")
+        self.assertEqual(len(calls), 1)
+        self.assertEqual(cache.get_statistics()["hits"], 2)
+
+    def test_lru_eviction_and_expiry(self):
+        cache = utils.cache.SignatureCache(max_size=2, ttl=None)
+        for key in (1, 2, 1, 3):  # 2 is the least recently used result when 3 is added
+            cache.get_or_sign(key, lambda: key)
+        self.assertEqual(cache.get_statistics()["evictions"], 1)
+        self.assertEqual(cache.get_or_sign(2, lambda: "signed again"), "signed again")
+
+        cache = utils.cache.SignatureCache(max_size=2, ttl=0.01)
+        cache.get_or_sign(1, lambda: "signature")
+        time.sleep(0.02)
+        self.assertEqual(cache.get_or_sign(1, lambda: "new signature"), "new signature")
+        self.assertEqual(cache.get_statistics()["expirations"], 1)
+
+    def test_concurrent_duplicates_are_signed_once(self):
+        cache = utils.cache.SignatureCache()
+        started = threading.Event()
+        release = threading.Event()
+        calls = []
+
+        def sign():
+            calls.append(1)
+            started.set()
+            release.wait()
+            return "signature"
+
+        results = []
+        threads = [threading.Thread(target=lambda: results.append(cache.get_or_sign("key", sign))) for i in range(4)]
+        threads[0].start()
+        started.wait()
+        for thread in threads[1:]:
+            thread.start()
+        while cache.get_statistics()["coalesced"] < 3:
+            time.sleep(0.001)
+        release.set()
+        for thread in threads:
+            thread.join()
+
+        self.assertEqual(results, ["signature"] * 4)
+        self.assertEqual(len(calls), 1)
+        self.assertEqual(cache.get_statistics()["in_flight"], 0)
+
+    def test_in_flight_result_after_clear(self):
+        cache = utils.cache.SignatureCache()
+        started = threading.Event()
+        release = threading.Event()
+
+        def sign():
+            started.set()
+            release.wait()
+            return "old signature"
+
+        results = []
+        thread = threading.Thread(target=lambda: results.append(cache.get_or_sign("key", sign)))
+        thread.start()
+        started.wait()
+        cache.clear()  # e.g. the master key is replaced while signing
+        self.assertEqual(cache.get_statistics()["in_flight"], 0)
+        release.set()
+        thread.join()
+
+        self.assertEqual(results, ["old signature"])
+        self.assertEqual(len(cache), 0)  # The result of the old generation is dropped
+        self.assertEqual(cache.get_or_sign("key", lambda: "new signature"), "new signature")
+
+    def test_errors_are_not_cached(self):
+        cache = utils.cache.SignatureCache()
+        with self.assertRaises(KeyError):
+            cache.get_or_sign("key", lambda: {}["missing"])
+        self.assertEqual(cache.get_or_sign("key", lambda: "signature"), "signature")
+
+
+class TestKeyStore(unittest.TestCase):
+    folder_location = "tests/fixture/testKeyStoreData/"
+    legacy_file_location = "tests/fixture/testKeyLoadingData/ColdWalletData/SecretKeyID.key"
+
+    def tearDown(self):
+        if os.path.exists(self.folder_location):
+            shutil.rmtree(self.folder_location)
+
+    def test_put_and_get(self):
+        store = utils.keystore.KeyStore(self.folder_location)
+        self.assertIsNone(store.get(1))
+        self.assertFalse(os.path.exists(self.folder_location))  # Nothing written yet
+
+        store.put(1, "123")
+        store.put(2, "456")
+        self.assertEqual(store.get(1), "123")
+        self.assertEqual(store.get(2), "456")
+        self.assertTrue(2 in store)
+        self.assertFalse(3 in store)
+
+    def test_sharding(self):
+        store = utils.keystore.KeyStore(self.folder_location)
+        far_id = 5 * utils.keystore.SHARD_SIZE + 3
+        store.put_many([(1, "one"), (far_id, "far")])
+
+        self.assertEqual(len(os.listdir(self.folder_location)), 2)
+        self.assertEqual(store.get(1), "one")
+        self.assertEqual(store.get(far_id), "far")
+
+    def test_id_prefix(self):
+        store = utils.keystore.KeyStore(self.folder_location)
+        store.put_many([(11, "eleven"), (1, "one")])
+        self.assertEqual(store.get(1), "one")
+        self.assertEqual(store.get(11), "eleven")
+
+    def test_iterate(self):
+        store = utils.keystore.KeyStore(self.folder_location)
+        far_id = 2 * utils.keystore.SHARD_SIZE
+        store.put_many([(far_id, "far"), (5, "five"), (2, "two"), (7, "seven")])
+        store.put(5, "FIVE")  # Supersedes the earlier entry
+
+        self.assertEqual(list(store.iterate()), [(2, "two"), (5, "FIVE"), (7, "seven"), (far_id, "far")])
+        self.assertEqual(list(store.iterate(start_id=6)), [(7, "seven"), (far_id, "far")])
+        self.assertEqual(list(store.iterate(start_id=far_id + 1)), [])
+
+    def test_legacy_iterate(self):
+        store = utils.keystore.KeyStore(self.folder_location, legacy_path=self.legacy_file_location)
+        store.put(2, "two")
+        self.assertEqual([id for id, _ in store.iterate()], [1, 2])
+
+    def test_torn_line(self):
+        store = utils.keystore.KeyStore(self.folder_location)
+        store.put(1, "one")
+        with open(store._get_shard_path(2), 'a') as shard_file:
+            shard_file.write("2:tw")  # Entry torn by a crash
+
+        self.assertIsNone(store.get(2))
+        store.put(2, "two")
+        self.assertEqual(store.get(2), "two")
+        self.assertEqual(list(store.iterate()), [(1, "one"), (2, "two")])
+
+    def test_legacy_fallback(self):
+        store = utils.keystore.KeyStore(self.folder_location, legacy_path=self.legacy_file_location)
+        self.assertEqual(store.get(1), "108840161921291671742706893810436544873997663066803744903035930819985652461750")
+        self.assertIsNone(store.get(2))
+
+
+class TestWriteAheadLog(unittest.TestCase):
+    folder_location = "tests/fixture/testWriteAheadLogData/"
+    file_location = folder_location + "wal.log"
+    records = [{"id": 1, "state": [1, -2, 3], "key": "1,2"}, {"id": 2, "state": [4, 5, -6], "key": "3,4"}]
+
+    def setUp(self):
+        if not os.path.exists(self.folder_location):
+            os.makedirs(self.folder_location)
+
+    def tearDown(self):
+        shutil.rmtree(self.folder_location)
+
+    def test_append_and_read(self):
+        wal = utils.wal.WriteAheadLog(self.file_location)
+        self.assertEqual(wal.read_records(), [])
+
+        wal.append(self.records)
+        self.assertEqual(wal.read_records(), self.records)
+        self.assertEqual(wal.get_record_count(), 2)
+        self.assertEqual(wal.sync_count, 1)  # Both records share one sync
+
+        wal.truncate()
+        self.assertEqual(wal.read_records(), [])
+        self.assertEqual(wal.get_record_count(), 0)
+
+    def test_directory_sync(self):
+        wal = utils.wal.WriteAheadLog(self.file_location)
+        wal.append(self.records[:1])
+        wal.append(self.records[1:])
+        self.assertEqual(wal.directory_sync_count, 1)  # Only the creation of the log changes the directory
+        wal.truncate()
+        self.assertEqual(wal.directory_sync_count, 2)
+
+        relaxed_wal = utils.wal.WriteAheadLog(self.folder_location + "relaxed.log",
+                                              durability=utils.wal.DURABILITY_RELAXED)
+        relaxed_wal.append(self.records)
+        self.assertEqual(relaxed_wal.directory_sync_count, 0)
+
+    def test_torn_record(self):
+        wal = utils.wal.WriteAheadLog(self.file_location)
+        wal.append(self.records)
+        with open(self.file_location, 'a') as log_file:
+            log_file.write('0badc0de {"id": 3')  # Record torn by a crash
+
+        self.assertEqual(utils.wal.WriteAheadLog(self.file_location).read_records(), self.records)
+
+    def test_group_commit(self):
+        wal = utils.wal.WriteAheadLog(self.file_location, durability=utils.wal.DURABILITY_GROUP,
+                                      group_commit_interval_ms=10000, group_commit_records=3)
+        wal.append(self.records[:1])
+        wal.append(self.records[1:])
+        self.assertEqual(wal.sync_count, 0)  # Neither interval nor record limit reached
+
+        wal.append(self.records[:1])
+        self.assertEqual(wal.sync_count, 1)  # Three pending records are synced together
+
+        wal.append(self.records[:1])
+        wal.close()
+        self.assertEqual(wal.sync_count, 2)
+
+    def test_group_commit_flusher(self):
+        other_threads = set(threading.enumerate())
+        wal = utils.wal.WriteAheadLog(self.file_location, durability=utils.wal.DURABILITY_GROUP,
+                                      group_commit_interval_ms=5, group_commit_records=1000)
+        for expected_syncs in range(1, 4):  # Several commit intervals
+            wal.append(self.records[:1])
+            deadline = time.monotonic() + 5
+            while wal.sync_count < expected_syncs and time.monotonic() < deadline:
+                time.sleep(0.001)
+            self.assertEqual(wal.sync_count, expected_syncs)  # Synced by the flusher once the interval has passed
+
+        flushers = [thread for thread in set(threading.enumerate()) - other_threads
+                    if thread.name == "tudwallet-wal-flusher"]
+        self.assertEqual(len(flushers), 1)  # One long-lived thread serves all intervals
+        wal.close()
+        self.assertFalse(flushers[0].is_alive())
+
+    def test_relaxed(self):
+        wal = utils.wal.WriteAheadLog(self.file_location, durability=utils.wal.DURABILITY_RELAXED)
+        wal.append(self.records)
+        wal.close()
+        self.assertEqual(wal.sync_count, 0)
+        self.assertEqual(wal.read_records(), self.records)
+
+    def test_unknown_durability(self):
+        with self.assertRaises(ValueError):
+            utils.wal.WriteAheadLog(self.file_location, durability="sometimes")
+
+
+class TestChangeLog(unittest.TestCase):
+    folder_location = "tests/fixture/testChangeLogData/"
+    key = str(utils.secp256k1.G[0]) + "," + str(utils.secp256k1.G[1])
+
+    def setUp(self):
+        os.makedirs(self.folder_location)
+
+    def tearDown(self):
+        shutil.rmtree(self.folder_location)
+
+    def test_append_and_read(self):
+        change_log = utils.changelog.ChangeLog(self.folder_location)
+        self.assertFalse(change_log.exists())
+        change_log.reset([{"id": 0, "state": [0], "key": None}])
+        self.assertEqual(change_log.append([{"id": id, "state": [id], "key": self.key} for id in range(1, 6)]), 6)
+
+        epoch, head, records = change_log.read(2, 3)
+        self.assertEqual((epoch, head), (change_log.get_epoch(), 6))
+        self.assertEqual([(record["seq"], record["id"]) for record in records], [(3, 2), (4, 3), (5, 4)])
+        self.assertEqual(records[0]["address"], utils.records.PublicKey(None, 2, *utils.secp256k1.G).address)
+        self.assertIsNone(change_log.read(0, 1)[2][0]["address"])  # No key pair, no address
+        self.assertEqual(change_log.read(6, 10)[2], [])
+        self.assertEqual(change_log.get_tail_ids(2), {4, 5})
+
+    def test_torn_record_and_reset(self):
+        change_log = utils.changelog.ChangeLog(self.folder_location)
+        change_log.reset()
+        change_log.append([{"id": 1, "state": [1], "key": None}])
+        with open(self.folder_location + utils.changelog.CHANGE_LOG_FILE_NAME, 'ab') as log_file:
+            log_file.write(b'0badc0de {"seq": 2')  # Record torn by a crash, its index entry is missing
+
+        reopened = utils.changelog.ChangeLog(self.folder_location)
+        self.assertEqual(reopened.append([{"id": 2, "state": [2], "key": None}]), 2)
+        self.assertEqual([record["id"] for record in reopened.read(0, 10)[2]], [1, 2])
+
+        epoch = reopened.get_epoch()
+        reopened.reset([{"id": 0, "state": [0], "key": None}])
+        self.assertNotEqual(reopened.get_epoch(), epoch)
+        self.assertEqual(reopened.get_head(), 1)
+
+
+class TestPythonDerivation(unittest.TestCase):
+    folder_location = "tests/fixture/testDataclassesData/HotWalletData/"
+
+    def test_point_arithmetic(self):
+        generator = utils.secp256k1.G
+        self.assertTrue(utils.secp256k1.is_on_curve(generator))
+        self.assertEqual(utils.secp256k1.multiply(generator, 2), utils.secp256k1.point_add(generator, generator))
+        self.assertIsNone(utils.secp256k1.multiply(generator, utils.secp256k1.N))
+
+        table = utils.secp256k1.FixedBaseTable(generator)
+        rng = random.Random(0)
+        for scalar in [1, 2, 15, 16, 2 ** 255] + [rng.randrange(1, utils.secp256k1.N) for i in range(20)]:
+            expected = keys.PrivateKey(scalar.to_bytes(32, "big")).public_key.to_bytes()
+            point = table.multiply(scalar)
+            self.assertEqual(point[0].to_bytes(32, "big") + point[1].to_bytes(32, "big"), expected)
+            self.assertEqual(utils.secp256k1.multiply(generator, scalar), point)
+        self.assertIsNone(table.multiply(0))
+
+        with self.assertRaises(ValueError):
+            utils.secp256k1.FixedBaseTable(generator, scalar_bits=128).multiply(2 ** 128)
+
+    def test_matches_java_fixture(self):
+        # Keys and states of the fixture have been derived by the java implementation
+        master_public_key = utils.support.get_public_key_coordinates_from_file(self.folder_location + "MPK.key")
+        states = utils.support.get_dict_from_file(self.folder_location + "state.txt")
+        stored_key = utils.support.get_dict_from_file(self.folder_location + "PublicKeyID.key")["1"]
+
+        engine = utils.derivation.PythonDerivationEngine(master_public_key)
+        public_key, next_state = engine.pk_derive(1, states["0"])
+        self.assertEqual(public_key, tuple(map(int, stored_key.split(","))))
+        self.assertEqual(next_state, states["1"])
+
+    def test_lane_state(self):
+        # The initial state of a lane is the state a derivation of its anchor id from state 0 results in
+        master_public_key = utils.support.get_public_key_coordinates_from_file(self.folder_location + "MPK.key")
+        states = utils.support.get_dict_from_file(self.folder_location + "state.txt")
+        engine = utils.derivation.PythonDerivationEngine(master_public_key)
+        self.assertEqual(utils.derivation.derive_lane_state(1, states["0"]), states["1"])
+        self.assertEqual(utils.derivation.derive_lane_state(1000, states["0"]), engine.pk_derive(1000, states["0"])[1])
+
+        chain = utils.derivation.derive_public_key_chain(master_public_key, states["0"], [1, 2])
+        self.assertEqual(chain[0][1:], engine.pk_derive(1, states["0"]))
+        self.assertEqual(chain[1][1:], engine.pk_derive(2, chain[0][2]))
+
+    def test_state_conversion(self):
+        state = [-128, -1, 0, 1, 127]
+        self.assertEqual(utils.derivation.state_to_bytes(state), bytes([128, 255, 0, 1, 127]))
+        self.assertEqual(utils.derivation.state_from_bytes(utils.derivation.state_to_bytes(state)), state)
+
+
+class TestNonceStore(unittest.TestCase):
+    folder_location = "tests/fixture/testNonceStoreData/"
+    file_location = folder_location + "nonces.txt"
+
+    def setUp(self):
+        if not os.path.exists(self.folder_location):
+            os.makedirs(self.folder_location)
+
+    def tearDown(self):
+        shutil.rmtree(self.folder_location)
+
+    def test_update_and_reload(self):
+        store = utils.nonces.NonceStore(self.file_location)
+        self.assertIsNone(store.get(1))
+        self.assertFalse(os.path.exists(self.file_location))  # Nothing written before the first update
+
+        store.update({1: 3, 2: 0})
+        store.update({1: 4})
+        self.assertEqual(store.get_all(), {1: 4, 2: 0})
+        self.assertEqual(utils.nonces.NonceStore(self.file_location).get_all(), {1: 4, 2: 0})
+
+    def test_invalid_nonces(self):
+        store = utils.nonces.NonceStore(self.file_location)
+        store.update({1: 3})
+        for nonce in (-1, "3", None):
+            with self.assertRaises(ValueError):
+                store.update({1: 5, 2: nonce})
+        self.assertEqual(store.get_all(), {1: 3})  # A rejected update changes nothing
+
+
+class TestIdSet(unittest.TestCase):
+    folder_location = "tests/fixture/testIdSetData/"
+
+    def tearDown(self):
+        if os.path.exists(self.folder_location):
+            shutil.rmtree(self.folder_location)
+
+    def test_runs(self):
+        id_set = utils.idset.IdSet(range(0, 1000))
+        self.assertEqual(id_set.get_run_count(), 1)
+        self.assertEqual(id_set.get_max(), 999)
+
+        id_set.add_many([5000, 1002, 1002])
+        self.assertEqual(id_set.get_run_count(), 3)
+        self.assertEqual(len(id_set), 1002)
+        self.assertTrue(1002 in id_set)
+        self.assertFalse(1001 in id_set)
+
+        id_set.add(1001)  # Extends the run of 1002
+        self.assertEqual(id_set.get_run_count(), 3)
+        id_set.add(1000)  # Closes the gap between two runs
+        self.assertEqual(id_set.get_run_count(), 2)
+        self.assertEqual(list(id_set)[-5:], [999, 1000, 1001, 1002, 5000])
+        self.assertEqual(id_set.get_max(), 5000)
+        self.assertIsNone(utils.idset.IdSet().get_max())
+        self.assertEqual(id_set.get_max_below(5000), 1002)
+        self.assertEqual(id_set.get_max_below(500), 499)
+        self.assertIsNone(id_set.get_max_below(0))
+
+        restored = utils.idset.IdSet.from_bytes(id_set.to_bytes())
+        self.assertEqual(list(restored), list(id_set))
+        self.assertEqual(len(restored), len(id_set))
+
+    def test_index(self):
+        os.makedirs(self.folder_location)
+        state_path = self.folder_location + "state.txt"
+        index_path = self.folder_location + "ids.bin"
+        utils.support.save_dict_to_file(state_path, {"0": [], "1": [], "7": []})
+
+        index = utils.idset.IdIndex(state_path, index_path)
+        self.assertEqual(list(index.get()), [0, 1, 7])
+        self.assertFalse(os.path.exists(index_path))  # Only written along with the state
+
+        index.get()
+        utils.support.save_dict_to_file(state_path, {"0": [], "1": [], "7": [], "8": []})
+        index.add_many([8])
+        self.assertEqual(list(utils.idset.IdIndex(state_path, index_path).get()), [0, 1, 7, 8])  # Loaded from index
+
+        utils.support.save_dict_to_file(state_path, {"0": [], "2": []})  # Changed without the index
+        self.assertEqual(list(index.get()), [0, 2])
+
+
+class TestTypedData(unittest.TestCase):
+    mail = {
+        "types": {
+            "EIP712Domain": [{"name": "name", "type": "string"}, {"name": "version", "type": "string"},
+                             {"name": "chainId", "type": "uint256"}, {"name": "verifyingContract", "type": "address"}],
+            "Person": [{"name": "name", "type": "string"}, {"name": "wallets", "type": "address[]"}],
+            "Mail": [{"name": "from", "type": "Person"}, {"name": "to", "type": "Person[]"},
+                     {"name": "contents", "type": "string"}, {"name": "tag", "type": "bytes4"},
+                     {"name": "delta", "type": "int8"}, {"name": "read", "type": "bool"},
+                     {"name": "attachment", "type": "bytes"}],
+        },
+        "primaryType": "Mail",
+        "domain": {"name": "Ether Mail", "version": "1", "chainId": 1,
+                   "verifyingContract": "0xCcCCccccCCCCcCCCCCCcCcCccCcCCCcCcccccccC"},
+        "message": {
+            "from": {"name": "Cow", "wallets": ["0xCD2a3d9F938E13CD947Ec05AbC7FE734Df8DD826",
+                                                "0xDeaDbeefdEAdbeefdEadbEEFdeadbeEFdEaDbeeF"]},
+            "to": [{"name": "Bob", "wallets": []}],
+            "contents": "Hello, Bob!",
+            "tag": "0x01020304",
+            "delta": -5,
+            "read": True,
+            "attachment": b"\xde\xad\xbe\xef",
+        },
+    }
+
+    def test_encoding_matches_eth_account(self):
+        encoder = utils.typeddata.TypedDataEncoder()
+        self.assertEqual(encoder.encode(self.mail), encode_typed_data(full_message=copy.deepcopy(self.mail)))
+        self.assertEqual(encoder.get_statistics()["misses"], 2)  # Schema and domain separator
+
+        for typed_data in tools.eip712.generate_messages(20, domains=3):
+            self.assertEqual(encoder.encode(typed_data), encode_typed_data(full_message=copy.deepcopy(typed_data)))
+        self.assertEqual(encoder.get_statistics()["schemas"], 3)
+        self.assertEqual(encoder.get_statistics()["domain_separators"], 4)
+
+        without_domain_type = copy.deepcopy(self.mail)
+        del without_domain_type["types"]["EIP712Domain"]  # Derived from the domain values
+        del without_domain_type["primaryType"]  # Unambiguous
+        self.assertEqual(encoder.encode(without_domain_type), encoder.encode(self.mail))
+
+    def test_schema(self):
+        schema = utils.typeddata.TypedDataSchema(self.mail["types"])
+        self.assertEqual(schema.get_encoded_type("Mail"), "Mail(Person from,Person[] to,string contents,bytes4 tag,"
+                                                          "int8 delta,bool read,bytes attachment)"
+                                                          "Person(string name,address[] wallets)")
+        self.assertEqual(schema.get_primary_type(), "Mail")
+
+        invalid_values = [("delta", 128), ("tag", "0x0102030405"), ("from", {"name": "Cow"})]
+        for field, value in invalid_values:
+            with self.assertRaises(ValueError):
+                schema.hash_struct("Mail", dict(self.mail["message"], **{field: value}))
+        with self.assertRaises(ValueError):
+            utils.typeddata.TypedDataSchema({"Order": [{"name": "price", "type": "float"}]}).hash_struct("Order", {
+                "price": 1.5})
+
+    def test_cache_eviction(self):
+        encoder = utils.typeddata.TypedDataEncoder(max_size=2)
+        for typed_data in tools.eip712.generate_messages(10, domains=5):
+            encoder.encode(typed_data)
+        self.assertEqual(encoder.get_statistics()["domain_separators"], 2)
+
+        report = tools.eip712.run_benchmark(count=20, domains=2)
+        self.assertEqual(set(report.keys()), {"eth_account", "uncached", "cached"})
+
+
+class TestJvmMetrics(unittest.TestCase):
+    folder_location = "tests/fixture/testJvmMetricsData/"
+
+    def tearDown(self):
+        if os.path.exists(self.folder_location):
+            shutil.rmtree(self.folder_location)
+
+    def test_call_site_counters(self):
+        counters = utils.jvmmetrics.CallSiteCounters()
+        counters.record("HotWallet.PKDerive", seconds=0.5)
+        with counters.measure("_recover_state_from_list", estimated_crossings=51):
+            pass
+        with counters.measure("_recover_state_from_list", estimated_crossings=51):
+            pass
+
+        snapshot = counters.get_snapshot()
+        self.assertEqual(list(snapshot.keys()), ["HotWallet.PKDerive", "_recover_state_from_list"])
+        self.assertEqual(snapshot["HotWallet.PKDerive"], {"calls": 1, "estimated_crossings": 1, "seconds": 0.5})
+        self.assertEqual(snapshot["_recover_state_from_list"]["calls"], 2)
+        self.assertEqual(snapshot["_recover_state_from_list"]["estimated_crossings"], 102)
+
+        counters.reset()
+        self.assertEqual(counters.get_snapshot(), {})
+
+    def test_call_site_decorator(self):
+        @utils.jvmmetrics.jni_call_site("test.decorated", estimated_crossings=3)
+        def decorated(value):
+            return value * 2
+
+        calls = utils.jvmmetrics.JNI_COUNTERS.get_snapshot().get("test.decorated", {"calls": 0})["calls"]
+        self.assertEqual(decorated(21), 42)
+        snapshot = utils.jvmmetrics.get_jvm_metrics()["jni"]["test.decorated"]
+        self.assertEqual(snapshot["calls"], calls + 1)
+        self.assertEqual(snapshot["estimated_crossings"], 3 * (calls + 1))
+
+    def test_metrics_dumper(self):
+        os.makedirs(self.folder_location)
+        path = self.folder_location + "metrics.jsonl"
+        samples = []
+
+        def metrics_function():
+            samples.append(len(samples))
+            return {"sample": samples[-1]}
+
+        dumper = utils.jvmmetrics.MetricsDumper(path, interval=0.01, metrics_function=metrics_function)
+        dumper.start()
+        time.sleep(0.1)
+        dumper.stop()
+        with open(path) as metrics_file:
+            lines = [json.loads(line) for line in metrics_file]
+        self.assertTrue(len(lines) >= 3)  # First dump, periodic dumps and the last dump
+        self.assertEqual(lines, [{"sample": sample} for sample in samples])
+
+        with self.assertRaises(ValueError):
+            utils.jvmmetrics.MetricsDumper(path, interval=0)
+
+
 if __name__ == '__main__':
     unittest.main()
@@ -0,0 +1,88 @@
+# Author: Leandro Rometsch, 2021
+# Email: leandro@rometsch.org
+# TU Darmstadt, Chair of Applied Cryptography
+
+import os
+import shutil
+import unittest
+import tools.verify_keystore
+import utils.derivation
+import utils.keystore
+import utils.secp256k1
+import utils.support
+import wallet as tudwallet
+
+
+class TestVerifyKeystore(unittest.TestCase):
+    folder_location = "tests/fixture/testVerifyKeystoreData/"
+    hot_wallet_location = folder_location + "HotWalletData/"
+    cold_wallet_location = folder_location + "ColdWalletData/"
+    master_secret_key = 0x1234567890abcdef
+
+    def setUp(self):
+        # A consistent wallet without JVM: keys derived by the python engine, secret keys computed as omega·msk
+        os.makedirs(self.hot_wallet_location)
+        os.makedirs(self.cold_wallet_location)
+        master_public_key = utils.secp256k1.multiply(utils.secp256k1.G, self.master_secret_key)
+        with open(self.hot_wallet_location + tudwallet.MPK_FILE_NAME, 'w') as key_file:
+            key_file.write(str(master_public_key[0]) + "\n" + str(master_public_key[1]) + "\n")
+        utils.support.save_dict_to_file(self.hot_wallet_location + tudwallet.STATE_FILE_NAME, {"0": [3] * 16})
+
+        hot_wallet = tudwallet._HotWallet(self.hot_wallet_location, derivation_engine=utils.derivation.ENGINE_PYTHON)
+        hot_wallet.create_lanes(1, lane_size=100)
+        hot_wallet.public_key_derive_many(list(range(1, 30)) + [101, 102])
+        hot_wallet.copy_state_to(self.cold_wallet_location + tudwallet.STATE_FILE_NAME)
+
+        states = utils.support.get_dict_from_file(self.hot_wallet_location + tudwallet.STATE_FILE_NAME)
+        state_ids = sorted(int(id) for id in states)
+        secret_keys = []
+        for id in list(range(1, 30)) + [101, 102]:
+            previous_state = states[str(utils.support.find_preceding_id(state_ids, id))]
+            omega, _ = utils.derivation.derive_omega_and_state(id, utils.derivation.state_to_bytes(previous_state))
+            secret_keys.append((id, str(omega * self.master_secret_key % utils.secp256k1.N)))
+        self.secret_store = utils.keystore.KeyStore(self.cold_wallet_location + tudwallet.SSK_DIRECTORY_NAME)
+        self.secret_store.put_many(secret_keys)
+
+    def tearDown(self):
+        shutil.rmtree(self.folder_location)
+
+    def verify(self, base_directory_cw=folder_location, **options):
+        return tools.verify_keystore.verify_keystore(self.folder_location, base_directory_cw, workers=1, chunk_size=8,
+                                                     **options)
+
+    def test_consistent_wallet(self):
+        report = self.verify(check_derivation=True)
+        self.assertEqual((report["ids"], report["public_keys"], report["secret_keys"]), (33, 31, 31))
+        self.assertEqual(report["mismatch_count"], 0)
+        self.assertGreater(report["ids_per_second"], 0)
+
+    def test_mismatches(self):
+        self.secret_store.put(5, "12345")  # Later entries supersede earlier ones
+        self.secret_store.put(200, "1")  # Secret key without state and public key
+        cold_states = utils.support.get_dict_from_file(self.cold_wallet_location + tudwallet.STATE_FILE_NAME)
+        cold_states["7"] = [0] * 16
+        utils.support.save_dict_to_file(self.cold_wallet_location + tudwallet.STATE_FILE_NAME, cold_states)
+
+        report = self.verify(max_mismatches=2)
+        self.assertEqual(report["mismatch_count"], 4)
+        self.assertEqual([(mismatch["id"], mismatch["type"]) for mismatch in report["mismatches"]],
+                         [(5, tools.verify_keystore.KEY_MISMATCH), (7, tools.verify_keystore.STATE_MISMATCH)])
+        self.assertIn("No mismatches", tools.verify_keystore.format_report(self.verify(base_directory_cw=None)))
+
+    def test_derivation_mismatch(self):
+        public_store = utils.keystore.KeyStore(self.hot_wallet_location + tudwallet.SPK_DIRECTORY_NAME)
+        public_store.put(3, public_store.get(4))
+        self.secret_store.put(3, self.secret_store.get(4))  # A consistent key pair, but derived for another id
+
+        self.assertEqual(self.verify()["mismatch_count"], 0)
+        report = self.verify(check_derivation=True)
+        self.assertEqual([(mismatch["id"], mismatch["type"]) for mismatch in report["mismatches"]],
+                         [(3, tools.verify_keystore.DERIVATION_MISMATCH)])
+
+    def test_worker_processes(self):
+        self.assertEqual(tools.verify_keystore.verify_keystore(self.folder_location, self.folder_location, workers=2,
+                                                               chunk_size=4)["mismatch_count"], 0)
+
+
+if __name__ == '__main__':
+    unittest.main()
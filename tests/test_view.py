@@ -0,0 +1,144 @@
+# Author: Leandro Rometsch, 2021
+# Email: leandro@rometsch.org
+# TU Darmstadt, Chair of Applied Cryptography
+
+import os
+import shutil
+import unittest
+import view as tudview
+import utils.compact
+import utils.derivation
+import utils.secp256k1
+import utils.support
+import wallet as tudwallet
+from wallet import SPK_VIEW_FILE_NAME
+
+
+class TestWalletView(unittest.TestCase):
+    folder_location = "tests/fixture/testViewData/"
+    hot_wallet_location = folder_location + "HotWalletData/"
+
+    def setUp(self):
+        os.makedirs(self.hot_wallet_location)
+        self.compact_file = utils.compact.CompactKeyFile(self.hot_wallet_location + SPK_VIEW_FILE_NAME)
+        self.compact_file.rebuild([(id, self.coordinates(id)) for id in range(1, 4)])
+
+    def tearDown(self):
+        shutil.rmtree(self.folder_location)
+
+    @staticmethod
+    def coordinates(id):
+        return bytes([id]) * 64
+
+    def test_lookup(self):
+        with tudview.WalletView(self.folder_location) as view:
+            self.assertEqual(len(view), 3)
+            self.assertEqual(view.get_max_id(), 3)
+            self.assertEqual(view.get_public_key(2).coordinates, self.coordinates(2))
+            self.assertEqual(view.get_address(2), view.get_public_key(2).address)
+            self.assertIsNone(view.get_public_key(4))
+            self.assertTrue(3 in view)
+            self.assertFalse(0 in view)
+            self.assertEqual([pk.id for pk in view.iter_public_keys(start_id=2)], [2, 3])
+
+    def test_sees_appended_keys(self):
+        with tudview.WalletView(self.folder_location) as view:
+            generation = view.get_generation()
+            self.assertFalse(view.refresh())
+
+            self.compact_file.append([(id, self.coordinates(id)) for id in range(4, 200)])  # Grows beyond the mapping
+            self.assertEqual(view.get_max_id(), 199)
+            self.assertEqual(view.get_generation(), generation + 1)
+            self.assertEqual(view.get_public_key(150).coordinates, self.coordinates(150))
+
+            with self.assertRaises(ValueError):
+                self.compact_file.append([(10, self.coordinates(10))])  # Ids must be ascending
+
+    def test_sees_rebuilt_file(self):
+        with tudview.WalletView(self.folder_location) as view:
+            self.compact_file.rebuild([(7, self.coordinates(7))])
+            self.assertEqual(len(view), 1)
+            self.assertEqual(view.get_max_id(), 7)
+            self.assertIsNone(view.get_public_key(1))
+
+    def test_refresh_during_rebuild(self):
+        with tudview.WalletView(self.folder_location) as view:
+            self.compact_file.retire()  # Marked, but not replaced yet
+            self.assertFalse(view.refresh())  # Reopens the retired file and keeps the current keys
+            self.assertEqual(len(view), 3)
+
+            self.compact_file.rebuild([(id, self.coordinates(id)) for id in range(1, 6)])
+            self.assertEqual(len(view), 5)
+            self.assertFalse(view.refresh())
+
+    def test_refresh_during_reset(self):
+        with tudview.WalletView(self.folder_location) as view:
+            self.compact_file.retire()
+            os.remove(self.compact_file.get_path())  # The wallet is reset (generate_master_key(overwrite=True))
+            self.assertFalse(view.refresh())
+            self.assertEqual(view.get_max_id(), 3)
+
+            self.compact_file.rebuild([])
+            self.assertEqual(len(view), 0)
+
+    def test_segments(self):
+        with tudview.WalletView(self.folder_location) as view:
+            segment = utils.compact.CompactKeyFile(utils.compact.get_segment_path(self.compact_file.get_path(), 1))
+            segment.rebuild([(101, self.coordinates(101))])
+            self.assertEqual(len(view), 3)  # Not published yet
+            self.compact_file.set_segment_count(2)
+            self.assertEqual(len(view), 4)
+
+            self.compact_file.append([(4, self.coordinates(4))])  # Both segments grow independently
+            segment.append([(102, self.coordinates(102))])
+            self.assertEqual([pk.id for pk in view.iter_public_keys()], [1, 2, 3, 4, 101, 102])
+            self.assertEqual(view.get_max_id(), 102)
+            self.assertEqual(view.get_public_key(4).coordinates, self.coordinates(4))
+            self.assertIsNone(view.get_public_key(100))
+
+            self.compact_file.rebuild([(1, self.coordinates(1))])  # One segment again
+            self.assertEqual([pk.id for pk in view.iter_public_keys()], [1])
+
+    def test_missing_file(self):
+        with self.assertRaises(Exception):
+            tudview.WalletView(self.folder_location + "missing/")
+
+
+class TestHotWalletView(unittest.TestCase):
+    folder_location = "tests/fixture/testHotWalletViewData/"
+    hot_wallet_location = folder_location + "HotWalletData/"
+
+    def setUp(self):
+        # A hot wallet without cold wallet (no JVM needed): the generator point serves as master public key
+        os.makedirs(self.hot_wallet_location)
+        with open(self.hot_wallet_location + tudwallet.MPK_FILE_NAME, 'w') as key_file:
+            key_file.write(str(utils.secp256k1.G[0]) + "\n" + str(utils.secp256k1.G[1]) + "\n")
+        utils.support.save_dict_to_file(self.hot_wallet_location + tudwallet.STATE_FILE_NAME, {"0": [7] * 16})
+        self.hot_wallet = tudwallet._HotWallet(self.hot_wallet_location,
+                                               derivation_engine=utils.derivation.ENGINE_PYTHON)
+        self.hot_wallet.public_key_derive_many([1, 2, 3])
+        self.hot_wallet.rebuild_view()
+
+    def tearDown(self):
+        shutil.rmtree(self.folder_location)
+
+    def test_lanes_append(self):
+        with tudview.WalletView(self.folder_location) as view:
+            self.hot_wallet.create_lanes(2, lane_size=100)
+            view_file_version = os.stat(self.hot_wallet_location + SPK_VIEW_FILE_NAME).st_ino
+
+            self.hot_wallet.public_key_derive_lanes({0: 2, 1: 2, 2: 2})
+            self.hot_wallet.public_key_derive_many([6, 103])
+            # Every lane has its own segment, so keys of lower lanes are appended instead of rebuilding the file
+            self.assertEqual(os.stat(self.hot_wallet_location + SPK_VIEW_FILE_NAME).st_ino, view_file_version)
+            self.assertEqual([pk.id for pk in view.iter_public_keys()], [1, 2, 3, 4, 5, 6, 101, 102, 103, 201, 202])
+            self.assertEqual(view.get_public_key(102).coordinates, self.hot_wallet.public_key_derive(102))
+            self.assertIsNone(view.get_public_key(100))  # Anchor
+
+            self.hot_wallet.reset()  # Retires all segments
+            self.assertFalse(view.refresh())
+            self.assertEqual(len(view), 11)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -2,13 +2,24 @@
 # Email: leandro@rometsch.org
 # TU Darmstadt, Chair of Applied Cryptography
 
+import copy
+import random
 import shutil
 import unittest
 import wallet as tudwallet
+import view as tudview
+import signer as tudsigner
+import pipeline as tudpipeline
+import tools.eip712
+import utils.bundle
+import utils.derivation
 import utils.support
+import utils.wal
+import utils.wrapper
 import os
 from eth_account import Account
-from eth_account.messages import encode_defunct
+from eth_account._utils.legacy_transactions import Transaction
+from eth_account.messages import encode_defunct, encode_typed_data
 
 
 class TestWalletInitialization(unittest.TestCase):
@@ -58,6 +69,8 @@ class TestWalletInitialization(unittest.TestCase):
         hw_session_key_store_path = self.hot_wallet_location + "PublicKeyID.key"
 
         self.assertFalse(os.path.exists(cw_session_key_store_path))  # Should not exist without any key derived
+        self.assertFalse(os.path.exists(self.cold_wallet_location + "SecretKeyID/"))
+        self.assertFalse(os.path.exists(self.hot_wallet_location + "PublicKeyID/"))
         self.assertFalse(os.path.exists(hw_session_key_store_path))
 
     def test_initial_ids(self):
@@ -158,6 +171,211 @@ class TestWalletSigning(unittest.TestCase):
         with self.assertRaises(Exception):
             self.wallet.sign_transaction("Not a transaction", 1)
 
+    def test_sign_typed_data(self):
+        typed_data = tools.eip712.generate_messages(6, domains=2)
+        expected_address = self.wallet.public_key_derive(1).address
+
+        sig = self.wallet.sign_typed_data(typed_data[0], 1)
+        calculated_address = Account.recover_message(encode_typed_data(full_message=copy.deepcopy(typed_data[0])),
+                                                     (sig.v, sig.r, sig.s))
+        self.assertEqual(expected_address, calculated_address)
+
+        items = [(id, message) for id in (1, 2, 3) for message in typed_data]
+        signatures = self.wallet.sign_typed_data_many(items)
+        self.assertEqual(signatures[0], sig)
+        for (id, message), signature in zip(items, signatures):
+            self.assertEqual(signature, self.wallet.sign_typed_data(message, id))
+        self.assertEqual(self.wallet.get_typed_data_cache_statistics()["domain_separators"], 2)
+
+        with self.assertRaises(Exception):
+            self.wallet.sign_typed_data_many([(10, typed_data[0])])
+        with self.assertRaises(TypeError):
+            self.wallet.sign_typed_data("Not typed data", 1)
+
+
+class TestWalletSecretKeyCache(unittest.TestCase):
+    wallet = None
+    folder_location = "tests/fixture/testWalletCacheData/"
+
+    def setUp(self):
+        self.wallet = tudwallet.Wallet(self.folder_location, self.folder_location, secret_key_cache_size=2)
+        self.wallet.generate_master_key(overwrite=True)
+        self.wallet.public_key_derive(1)
+        self.wallet.secret_key_derive(1)
+
+    def tearDown(self):
+        self.wallet.close()
+        shutil.rmtree(self.folder_location)
+
+    def test_repeated_signing(self):
+        expected_address = self.wallet.public_key_derive(1).address
+
+        for i in range(0, 3):
+            sig = self.wallet.sign_message("Test message", 1)
+            calculated_address = Account.recover_message(encode_defunct(text="Test message"), (sig.v, sig.r, sig.s))
+            self.assertEqual(expected_address, calculated_address)
+
+        statistics = self.wallet.get_secret_key_cache_statistics()
+        self.assertEqual(statistics["hits"], 3)
+        self.assertEqual(statistics["size"], 1)
+
+    def test_close_wipes_cache(self):
+        self.wallet.close()
+        self.assertEqual(self.wallet.get_secret_key_cache_statistics()["size"], 0)
+        self.wallet.sign_message("Test message", 1)  # Still possible, key is fetched from the cold wallet again
+
+    def test_cache_disabled_by_default(self):
+        wallet = tudwallet.Wallet(self.folder_location, self.folder_location)
+        self.assertIsNone(wallet.get_secret_key_cache_statistics())
+
+
+class TestWalletSignatureCache(unittest.TestCase):
+    wallet = None
+    folder_location = "tests/fixture/testWalletSignatureCacheData/"
+    transaction = {"nonce": 0, "chainId": 1, "to": "0xF0109fC8DF283027b6285cc889F5aA624EaC1F55", "value": 1000000000,
+                   "gas": 2000000, "gasPrice": 234567897654321, "data": b""}
+
+    def setUp(self):
+        self.wallet = tudwallet.Wallet(self.folder_location, self.folder_location, signature_cache_size=8)
+        self.wallet.generate_master_key(overwrite=True)
+        self.wallet.public_key_derive(1)
+
+    def tearDown(self):
+        self.wallet.close()
+        shutil.rmtree(self.folder_location)
+
+    def test_retries(self):
+        signed_transaction = self.wallet.sign_transaction(self.transaction, 1)
+        retried_transaction = dict(reversed(list(self.transaction.items())), value=hex(self.transaction["value"]))
+        self.assertIs(self.wallet.sign_transaction(retried_transaction, 1), signed_transaction)
+        self.assertNotEqual(self.wallet.sign_transaction(dict(self.transaction, nonce=1), 1), signed_transaction)
+
+        signed_message = self.wallet.sign_message("Test message", 1)
+        self.assertIs(self.wallet.sign_message(b"Test message", 1), signed_message)  # Same signable message
+
+        statistics = self.wallet.get_signature_cache_statistics()
+        self.assertEqual((statistics["hits"], statistics["misses"]), (2, 3))
+
+    def test_typed_data_is_encoded_once(self):
+        typed_data = tools.eip712.generate_messages(1)[0]
+        signed_message = self.wallet.sign_typed_data(typed_data, 1)
+        self.assertEqual(self.wallet.get_typed_data_cache_statistics()["hits"], 0)  # The miss signs the encoded data
+        self.assertIs(self.wallet.sign_typed_data(typed_data, 1), signed_message)
+
+    def test_cache_disabled_by_default(self):
+        wallet = tudwallet.Wallet(self.folder_location, self.folder_location)
+        self.assertIsNone(wallet.get_signature_cache_statistics())
+
+
+class TestTransactionPipeline(unittest.TestCase):
+    wallet = None
+    folder_location = "tests/fixture/testTransactionPipelineData/"
+    nonce_location = folder_location + "nonces.txt"
+    template = {"to": "0xF0109fC8DF283027b6285cc889F5aA624EaC1F55", "gas": 21000, "gasPrice": 1000000000}
+
+    def setUp(self):
+        self.wallet = tudwallet.Wallet(self.folder_location, self.folder_location)
+        self.wallet.generate_master_key(overwrite=True)
+        self.wallet.public_key_derive_many([1, 2, 3])
+
+    def tearDown(self):
+        self.wallet.close()
+        shutil.rmtree(self.folder_location)
+
+    def test_nonces(self):
+        pipeline = tudpipeline.TransactionPipeline(self.wallet, 1, self.nonce_location, self.template, batch_size=2)
+        items = [(1, {"value": 1}), (2, {"value": 2}), (1, {"value": 3})]
+        batches = list(pipeline.sign(items))
+        self.assertEqual([len(batch) for batch in batches], [2, 1])
+
+        signed_transactions = [signed_transaction for batch in batches for _, signed_transaction in batch]
+        nonces = [Transaction.from_bytes(signed_transaction.raw_transaction).nonce
+                  for signed_transaction in signed_transactions]
+        self.assertEqual(nonces, [0, 0, 1])
+
+        # Nonces survive a restart
+        pipeline = tudpipeline.TransactionPipeline(self.wallet, 1, self.nonce_location, self.template)
+        self.assertEqual((pipeline.get_nonce(1), pipeline.get_nonce(2), pipeline.get_nonce(3)), (2, 1, 0))
+
+    def test_resync(self):
+        chain_nonces = {self.wallet.get_public_key(1).address: 5}
+        pipeline = tudpipeline.TransactionPipeline(self.wallet, 1, self.nonce_location, self.template,
+                                                   nonce_source=lambda address: chain_nonces.get(address, 0))
+        self.assertEqual(pipeline.get_nonce(1), 5)  # Unknown accounts are fetched from the nonce source
+        pipeline.set_nonce(1, 2)
+        self.assertEqual(pipeline.resync(), {1: (2, 5)})
+        self.assertEqual(pipeline.get_nonce(1), 5)
+
+        with self.assertRaises(Exception):
+            tudpipeline.TransactionPipeline(self.wallet, 1, self.nonce_location).resync()
+
+    def test_sweep(self):
+        pipeline = tudpipeline.TransactionPipeline(self.wallet, 1, self.nonce_location, self.template)
+        fee = self.template["gas"] * self.template["gasPrice"]
+        self.assertEqual(pipeline.build_sweep({1: fee + 10, 2: fee, 3: fee * 2}),
+                         [(1, {"value": 10}), (3, {"value": fee})])  # The balance of 2 does not cover the fee
+
+        signed = [item for batch in pipeline.sign_sweep({1: fee + 10, 3: fee * 2}) for item in batch]
+        self.assertEqual([id for id, _ in signed], [1, 3])
+
+        with self.assertRaises(ValueError):
+            tudpipeline.TransactionPipeline(self.wallet, 1, self.nonce_location, {"to": "0x0"}).build_sweep({1: fee})
+
+
+class TestWalletRecovery(unittest.TestCase):
+    wallet = None
+    folder_location = "tests/fixture/testWalletRecoveryData/"
+    hot_wallet_location = folder_location + "HotWalletData/"
+
+    def setUp(self):
+        self.wallet = tudwallet.Wallet(self.folder_location, self.folder_location)
+        self.wallet.generate_master_key(overwrite=True)
+
+    def tearDown(self):
+        shutil.rmtree(self.folder_location)
+
+    def test_replay_after_crash(self):
+        self.wallet.public_key_derive_many(2)
+        public_key = self.wallet.public_key_derive(3)
+
+        # Simulate a crash after logging id = 3 but before the state file and the keystore were written
+        state_path = self.hot_wallet_location + "state.txt"
+        id_state_map = utils.support.get_dict_from_file(state_path)
+        state = id_state_map.pop("3")
+        utils.support.save_dict_to_file(state_path, id_state_map)
+
+        shard_path = self.hot_wallet_location + "PublicKeyID/0.key"
+        with open(shard_path, 'r') as shard_file:
+            lines = shard_file.readlines()
+        with open(shard_path, 'w') as shard_file:
+            shard_file.writelines(line for line in lines if not line.startswith("3:"))
+
+        wal = utils.wal.WriteAheadLog(self.hot_wallet_location + "wal.log")
+        wal.truncate()
+        stored_key = str(int(public_key.x, 16)) + "," + str(int(public_key.y, 16))
+        wal.append([{"id": 3, "state": state, "key": stored_key}])
+
+        recovered_wallet = tudwallet.Wallet(self.folder_location, self.folder_location)  # Replays the log
+        self.assertEqual(recovered_wallet.get_all_ids(), [1, 2, 3])
+        self.assertEqual(recovered_wallet.public_key_derive(3), public_key)
+        self.assertEqual(wal.read_records(), [])  # Log is truncated after recovery
+
+        recovered_wallet.secret_key_derive(3)
+        sig = recovered_wallet.sign_message("Test message", 3)
+        calculated_address = Account.recover_message(encode_defunct(text="Test message"), (sig.v, sig.r, sig.s))
+        self.assertEqual(public_key.address, calculated_address)
+
+    def test_durability_modes(self):
+        for durability in ["strict", "group", "relaxed"]:
+            wallet = tudwallet.Wallet(self.folder_location, self.folder_location, durability=durability)
+            public_key = wallet.public_key_derive()
+            wallet.close()
+            self.assertEqual(tudwallet.Wallet(self.folder_location, self.folder_location).public_key_derive(
+                public_key.id), public_key)
+
+        with self.assertRaises(ValueError):
+            tudwallet.Wallet(self.folder_location, self.folder_location, durability="sometimes")
+
 
 class TestWalletDerivation(unittest.TestCase):
     wallet = None
@@ -206,6 +424,293 @@ class TestWalletDerivation(unittest.TestCase):
         with self.assertRaises(Exception):
             self.wallet.secret_key_derive(150)  # Should not be possible because no matching public key derived
 
+    def test_secret_key_derive_many(self):
+        for i in range(1, 6):
+            self.wallet.public_key_derive()
+
+        secret_keys = self.wallet.secret_key_derive_many([3, 1, 5, 1])
+        self.assertEqual([sk.id for sk in secret_keys], [3, 1, 5])
+
+        for sk in secret_keys:  # Every secret key must belong to the public key derived with the same id
+            self.assertTrue(sk.key.startswith("0x"))
+            self.assertEqual(len(sk.key), 66)
+            self.assertEqual(Account.from_key(sk.key).address, self.wallet.public_key_derive(sk.id).address)
+            self.assertEqual(sk, self.wallet.secret_key_derive(sk.id))  # Now returned from keystore
+
+        with self.assertRaises(Exception):
+            self.wallet.secret_key_derive_many([2, 10])  # Should not be possible because id = 10 not derived
+
+    def test_public_key_derive_many(self):
+        self.wallet.public_key_derive()
+        public_keys = self.wallet.public_key_derive_many(3)
+        self.assertEqual([pk.id for pk in public_keys], [2, 3, 4])
+        self.assertEqual(self.wallet.get_all_ids(), [1, 2, 3, 4])
+
+        for pk in public_keys:
+            self.assertEqual(pk, self.wallet.public_key_derive(pk.id))
+            sk = self.wallet.secret_key_derive(pk.id)
+            self.assertEqual(Account.from_key(sk.key).address, pk.address)
+
+        with self.assertRaises(ValueError):
+            self.wallet.public_key_derive_many(0)
+
+    def test_iterate_public_keys(self):
+        self.assertEqual(list(self.wallet.iter_public_keys()), [])
+
+        derived = [self.wallet.public_key_derive() for i in range(1, 6)]
+        derived.append(self.wallet.public_key_derive(2000))  # Located in another keystore shard
+
+        self.assertEqual(list(self.wallet.iter_public_keys()), derived)
+        self.assertEqual(list(self.wallet.iter_public_keys(start_id=4)), derived[3:])
+        self.assertEqual(list(self.wallet.iter_addresses()), [(pk.id, pk.address) for pk in derived])
+
+        batches = list(self.wallet.iter_public_key_batches(batch_size=4))
+        self.assertEqual([len(batch) for batch in batches], [4, 2])
+        self.assertEqual(list(batches[0]) + list(batches[1]), derived)
+
+        # Resume from the cursor of the first batch
+        resumed = next(self.wallet.iter_public_key_batches(start_id=batches[0][-1].id + 1, batch_size=4))
+        self.assertEqual(list(resumed), list(batches[1]))
+
+    def test_jvm_metrics(self):
+        before = self.wallet.get_jvm_metrics()["jni"]
+        self.wallet.public_key_derive_many(3)
+        self.wallet.secret_key_derive(3)
+        metrics = self.wallet.get_jvm_metrics()
+        self.assertTrue(metrics["jvm"]["heap"]["committed"] >= metrics["jvm"]["heap"]["used"] > 0)
+        self.assertEqual(metrics["jni"]["HotWallet.PKDerive"]["calls"],
+                         before.get("HotWallet.PKDerive", {"calls": 0})["calls"] + 3)
+        self.assertTrue(metrics["jni"]["ColdWallet.SKDerive"]["seconds"] > 0)
+
+        path = self.folder_location + "metrics.jsonl"
+        self.wallet.start_metrics_dump(path, interval=0.01)
+        self.wallet.close()  # Stops dumping
+        with open(path) as metrics_file:
+            dumps = metrics_file.readlines()
+        self.assertTrue(len(dumps) >= 2)
+
+    def test_wallet_view(self):
+        with tudview.WalletView(self.folder_location) as view:
+            self.assertEqual(len(view), 0)
+
+            derived = [self.wallet.public_key_derive() for i in range(1, 4)]
+            self.assertEqual(list(view.iter_public_keys()), derived)
+            self.assertEqual(view.get_address(2), derived[1].address)
+
+            self.wallet.generate_master_key(overwrite=True)  # The view releases the old keys
+            self.assertEqual(len(view), 0)
+
+        # Views on wallets without a compact keystore file need it built once
+        os.remove(self.folder_location + "HotWalletData/" + tudwallet.SPK_VIEW_FILE_NAME)
+        self.wallet.public_key_derive()
+        with self.assertRaises(Exception):
+            tudview.WalletView(self.folder_location)
+        self.wallet.build_view()
+        with tudview.WalletView(self.folder_location) as view:
+            self.assertEqual(list(view.iter_public_keys()), list(self.wallet.iter_public_keys()))
+
+    def test_secret_key_derive_out_of_order(self):
+        for i in range(1, 4):
+            self.wallet.public_key_derive()
+
+        sk = self.wallet.secret_key_derive(1)  # Not the latest id
+        self.assertEqual(Account.from_key(sk.key).address, self.wallet.public_key_derive(1).address)
+
+
+class TestPythonDerivationEngine(unittest.TestCase):
+    wallet = None
+    folder_location = "tests/fixture/testPythonDerivationData/"
+
+    def setUp(self):
+        self.wallet = tudwallet.Wallet(self.folder_location, self.folder_location)
+        self.wallet.generate_master_key(overwrite=True)
+
+    def tearDown(self):
+        shutil.rmtree(self.folder_location)
+
+    def test_differential_against_java(self):
+        master_public_key_path = self.folder_location + "HotWalletData/" + tudwallet.MPK_FILE_NAME
+        java_master_public_key = utils.support.get_public_key_from_file(master_public_key_path)
+        java_engine = utils.wrapper.HotWalletWrapper()
+        python_engine = utils.derivation.PythonDerivationEngine(
+            utils.support.get_public_key_coordinates_from_file(master_public_key_path))
+
+        rng = random.Random(42)
+        for i in range(2000):
+            id = rng.randrange(1, 2 ** 63)
+            state = [rng.randrange(-128, 128) for j in range(utils.derivation.STATE_SIZE)]
+
+            pk = java_engine.pk_derive(java_master_public_key, str(id), state)
+            java_public_key = (int(str(pk.getPublicKey().getPointX())), int(str(pk.getPublicKey().getPointY())))
+            java_state = [int(value) for value in pk.getState()]
+
+            self.assertEqual(python_engine.pk_derive(id, state), (java_public_key, java_state))
+
+    def test_wallet_with_python_engine(self):
+        java_keys = [self.wallet.public_key_derive() for i in range(1, 4)]
+        python_wallet = tudwallet.Wallet(self.folder_location, self.folder_location,
+                                         derivation_engine=utils.derivation.ENGINE_PYTHON)
+        self.assertEqual(python_wallet.public_key_derive(2), java_keys[1])  # Stored keys are returned as before
+
+        python_keys = python_wallet.public_key_derive_many(5)
+        for public_key in python_keys:
+            sk = python_wallet.secret_key_derive(public_key.id)  # The cold wallet still derives with java
+            self.assertEqual(Account.from_key(sk.key).address, public_key.address)
+
+        with self.assertRaises(ValueError):
+            tudwallet.Wallet(self.folder_location, self.folder_location, derivation_engine="unknown")
+
+
+class TestWalletLanes(unittest.TestCase):
+    wallet = None
+    folder_location = "tests/fixture/testWalletLanesData/"
+
+    def setUp(self):
+        self.wallet = tudwallet.Wallet(self.folder_location, self.folder_location)
+        self.wallet.generate_master_key(overwrite=True)
+
+    def tearDown(self):
+        shutil.rmtree(self.folder_location)
+
+    def test_lanes(self):
+        self.wallet.public_key_derive_many(3)
+        self.assertEqual(self.wallet.get_lane_count(), 1)
+        self.assertEqual(self.wallet.create_lanes(2, lane_size=100), [1, 2])  # Anchored at ids 100 and 200
+
+        public_keys = self.wallet.public_key_derive_lanes(2)
+        self.assertEqual(list(public_keys.get_ids()), [4, 5, 101, 102, 201, 202])
+        self.assertEqual(self.wallet.get_all_ids(), [1, 2, 3, 4, 5, 101, 102, 201, 202])  # Anchors are hidden
+
+        self.assertEqual(self.wallet.public_key_derive(6).id, 6)  # Lane 0 continues below the other lanes
+        self.assertEqual(self.wallet.public_key_derive().id, 203)  # Continues the lane of the highest id
+        with self.assertRaises(Exception):
+            self.wallet.public_key_derive(100)  # Anchor of lane 1
+        with self.assertRaises(Exception):
+            self.wallet.secret_key_derive(100)  # Anchor
+
+        for public_key in self.wallet.public_key_derive_lanes(1, lanes=[0, 1]):
+            sk = self.wallet.secret_key_derive(public_key.id)  # The cold wallet follows the state chain of the lane
+            self.assertEqual(Account.from_key(sk.key).address, public_key.address)
+        self.assertEqual(self.wallet.secret_key_derive().id, 203)
+
+        with self.assertRaises(ValueError):
+            self.wallet.public_key_derive_lanes(1, processes=True)  # Java engine
+
+    def test_lanes_in_threads(self):
+        self.wallet.create_lanes(3, lane_size=100)
+        copy_location = self.folder_location + "copy/"
+        shutil.copytree(self.folder_location + "HotWalletData/", copy_location)
+
+        threaded = self.wallet.public_key_derive_lanes(20)  # One java hot wallet per worker thread
+        sequential = tudwallet._HotWallet(copy_location).public_key_derive_many(list(threaded.get_ids()))
+        self.assertEqual([threaded.get_coordinates(index) for index in range(len(threaded))], sequential)
+
+    def test_lanes_in_processes(self):
+        python_wallet = tudwallet.Wallet(self.folder_location, self.folder_location,
+                                         derivation_engine=utils.derivation.ENGINE_PYTHON)
+        python_wallet.create_lanes(2)
+        threads = python_wallet.public_key_derive_lanes(3)
+        processes = python_wallet.public_key_derive_lanes(3, processes=True)
+        self.assertEqual(len(threads) + len(processes), 18)
+
+        sks = self.wallet.secret_key_derive_many(list(processes.get_ids()))
+        self.assertEqual([Account.from_key(sk.key).address for sk in sks], [pk.address for pk in processes])
+
+
+    def test_lane_repair_at_open(self):
+        self.wallet.create_lanes(1, lane_size=100)
+        hot_wallet_location = self.folder_location + "HotWalletData/"
+        # Crash within create_lanes(): the lane is registered, but its state has not been written
+        utils.support.save_dict_to_file(hot_wallet_location + tudwallet.LANES_FILE_NAME, {"anchors": [100, 200]})
+        state_version = os.stat(hot_wallet_location + tudwallet.STATE_FILE_NAME).st_mtime_ns
+        self.assertEqual(self.wallet.get_lane_count(), 2)  # Anchors are read once at open
+        self.assertEqual(os.stat(hot_wallet_location + tudwallet.STATE_FILE_NAME).st_mtime_ns, state_version)
+
+        wallet = tudwallet.Wallet(self.folder_location, self.folder_location)
+        self.assertEqual(wallet.get_lane_count(), 3)
+        self.assertEqual(wallet.public_key_derive_lanes(1, lanes=[2]).get_ids()[0], 201)
+
+        wallet.generate_master_key(overwrite=True)
+        self.assertEqual(wallet.get_lane_count(), 1)
+
+
+class TestSigningBundle(unittest.TestCase):
+    folder_location = "tests/fixture/testSigningBundleData/"
+    hot_wallet_location = folder_location + "hot/"
+    cold_wallet_location = folder_location + "cold/"
+    test_transaction = {
+        'to': '0x82fc853256B05029b3759161B32E3460Fe4eaC77',
+        'value': 10000000000000000,
+        'gas': 2000000,
+        'gasPrice': 2500000008,
+        'nonce': 2,
+        'chainId': 3,
+    }
+
+    def setUp(self):
+        self.wallet = tudwallet.Wallet(self.hot_wallet_location, self.cold_wallet_location)
+        self.wallet.generate_master_key(overwrite=True)
+        self.wallet.public_key_derive_many(20)  # The cold wallet does not know these ids yet
+
+    def tearDown(self):
+        shutil.rmtree(self.folder_location)
+
+    def test_bundle_round_trip(self):
+        transactions = [(id, dict(self.test_transaction, nonce=id)) for id in range(1, 21)]
+        messages = [(5, "Test message"), (20, b'BytesTest')]
+        request_path = self.folder_location + "request.json"
+        result_path = self.folder_location + "result.json"
+
+        bundle_id = self.wallet.create_signing_bundle(request_path, transactions, messages)
+        self.assertEqual(self.wallet.get_pending_bundle_ids(), [bundle_id])
+        self.assertEqual(tudsigner.ColdSigner(self.cold_wallet_location).sign_bundle(request_path, result_path), 22)
+        signed = self.wallet.import_signed_bundle(result_path)
+        self.assertEqual(self.wallet.get_pending_bundle_ids(), [])
+
+        for (id, transaction), signed_tx in zip(transactions, signed["transactions"]):
+            self.assertEqual(Account.recover_transaction(signed_tx.rawTransaction),
+                             self.wallet.public_key_derive(id).address)
+            self.assertEqual(signed_tx, self.wallet.sign_transaction(transaction, id))  # Deterministic signatures
+        self.assertEqual(signed["messages"][1], self.wallet.sign_message(b'BytesTest', 20))
+
+        with self.assertRaises(Exception):
+            self.wallet.import_signed_bundle(result_path)  # Already imported
+
+    def test_invalid_bundles(self):
+        request_path = self.folder_location + "request.json"
+        result_path = self.folder_location + "result.json"
+        with self.assertRaises(Exception):
+            self.wallet.create_signing_bundle(request_path, [(21, self.test_transaction)])  # Not derived
+        with self.assertRaises(ValueError):
+            self.wallet.create_signing_bundle(request_path)
+        with self.assertRaises(Exception):
+            tudsigner.ColdSigner(self.folder_location + "nowhere/")
+
+        self.wallet.create_signing_bundle(request_path, [(1, self.test_transaction)], [(2, "Test message")])
+        with self.assertRaises(Exception):
+            tudsigner.ColdSigner(self.cold_wallet_location).sign_bundle(result_path, request_path)  # Wrong format
+        tudsigner.ColdSigner(self.cold_wallet_location).sign_bundle(request_path, result_path)
+
+        result = utils.bundle.load_bundle(result_path, utils.bundle.RESULT_BUNDLE_FORMAT)
+        signature = result["messages"][0]["signature"]
+        result["messages"][0]["signature"] = signature[:10] + ("0" if signature[10] != "0" else "1") + signature[11:]
+        utils.bundle.save_bundle(result_path, result)
+        with self.assertRaises(Exception):
+            self.wallet.import_signed_bundle(result_path)
+        self.assertEqual(len(self.wallet.get_pending_bundle_ids()), 1)  # Still pending
+
+        # Another transaction signed with the same key must not pass for the requested one
+        tudsigner.ColdSigner(self.cold_wallet_location).sign_bundle(request_path, result_path)
+        result = utils.bundle.load_bundle(result_path, utils.bundle.RESULT_BUNDLE_FORMAT)
+        other_transaction = Account.sign_transaction(dict(self.test_transaction, value=1),
+                                                     self.wallet.secret_key_derive(1).key)
+        result["transactions"][0]["raw_transaction"] = other_transaction.raw_transaction.hex()
+        result["transactions"][0]["hash"] = other_transaction.hash.hex()
+        utils.bundle.save_bundle(result_path, result)
+        with self.assertRaises(Exception):
+            self.wallet.import_signed_bundle(result_path)
+        self.assertEqual(len(self.wallet.get_pending_bundle_ids()), 1)
+
 
 if __name__ == '__main__':
     unittest.main()
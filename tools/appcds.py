@@ -0,0 +1,208 @@
+# Author: Leandro Rometsch, 2021
+# Email: leandro@rometsch.org
+# TU Darmstadt, Chair of Applied Cryptography
+
+import argparse
+import json
+import os
+import pathlib
+import shutil
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+
+from utils import wrapper
+
+REPOSITORY_DIRECTORY = str(pathlib.Path(__file__).parent.parent.resolve())
+WARM_UP_KEYS = 20  # Session keys derived (and signed with) during the warm-up
+TRANSACTION_TEMPLATE = {"to": "0xF0109fC8DF283027b6285cc889F5aA624EaC1F55", "value": 1000000000, "gas": 2000000,
+                        "gasPrice": 234567897654321, "chainId": 1}
+
+
+def find_java_executable():
+    """
+    Looks for the java executable of the JVM JPype starts (JAVA_HOME or the installation of the default JVM library).
+    The archive has to be created by the same java version it is used with.
+
+    :return: the path of the java executable
+    """
+    import jpype
+
+    candidates = []
+    if os.environ.get("JAVA_HOME"):
+        candidates.append(pathlib.Path(os.environ["JAVA_HOME"]))
+    candidates += pathlib.Path(jpype.getDefaultJVMPath()).resolve().parents
+    for directory in candidates:
+        executable = directory / "bin" / "java"
+        if executable.is_file():
+            return str(executable)
+    raise Exception("Java executable not found, please set JAVA_HOME.")
+
+
+def warm_up(class_list_path, class_path_path):
+    """
+    Starts the JVM with class list dumping and exercises the wallet (MasterGen, PKDerive, SKDerive and signing) on a
+    temporary directory, so all classes loaded on a typical run are recorded. Has to run in a fresh process, as the
+    JVM cannot be restarted.
+
+    :param class_list_path: the path of the class list to be written by the JVM
+    :param class_path_path: the path of the file the class path of the JVM is written to (the archive is only valid for
+        this class path)
+    """
+    wrapper.start_jvm(["-XX:DumpLoadedClassList=" + class_list_path])
+
+    import wallet as tudwallet
+
+    directory = tempfile.mkdtemp(prefix="tudwallet-appcds-")
+    try:
+        wallet = tudwallet.Wallet(directory, directory)
+        wallet.generate_master_key(overwrite=True)
+        for _ in range(WARM_UP_KEYS):
+            wallet.public_key_derive()
+        for nonce, id in enumerate(wallet.get_all_ids()):
+            wallet.sign_transaction(dict(TRANSACTION_TEMPLATE, nonce=nonce), id)
+        wallet.secret_key_derive()
+    finally:
+        shutil.rmtree(directory, ignore_errors=True)
+
+    import jpype
+    with open(class_path_path, 'w') as class_path_file:
+        class_path_file.write(str(jpype.java.lang.System.getProperty("java.class.path")))
+
+
+def build(archive_path=wrapper.CDS_ARCHIVE_PATH, java=None):
+    """
+    Creates the class data sharing archive: runs the warm-up in a subprocess (without any archive) and dumps the
+    recorded classes into the archive.
+
+    :param archive_path: the path of the archive to be created
+    :param java: the path of the java executable (found automatically if None)
+    :return: the number of classes recorded by the warm-up
+    """
+    java = java or find_java_executable()
+    directory = tempfile.mkdtemp(prefix="tudwallet-appcds-")
+    try:
+        class_list_path = os.path.join(directory, "classes.lst")
+        class_path_path = os.path.join(directory, "classpath.txt")
+        _run_tool(["warm-up", "--class-list", class_list_path, "--class-path", class_path_path], archive_path="")
+
+        with open(class_path_path) as class_path_file:
+            class_path = class_path_file.read()
+        temporary_path = archive_path + ".tmp"
+        subprocess.run([java, "-Xshare:dump", "-XX:SharedClassListFile=" + class_list_path,
+                        "-XX:SharedArchiveFile=" + temporary_path, "-cp", class_path],
+                       check=True, stdout=subprocess.DEVNULL)
+        os.replace(temporary_path, archive_path)
+
+        with open(class_list_path) as class_list_file:
+            return sum(1 for line in class_list_file if line.strip() and not line.startswith("#"))
+    finally:
+        shutil.rmtree(directory, ignore_errors=True)
+
+
+def measure_startup():
+    """
+    Measures the startup of the current process: JVM start (including the archive, if any) and the first calls of
+    MasterGen, PKDerive and SKDerive.
+
+    :return: dict of the durations in seconds
+    """
+    start = time.perf_counter()
+    wrapper.start_jvm()
+    jvm_started = time.perf_counter()
+
+    cold_wallet = wrapper.ColdWalletWrapper()
+    master_key = cold_wallet.master_gen()
+    wrapper.HotWalletWrapper().pk_derive(master_key.getKeyPub(), "0", master_key.getState())
+    cold_wallet.sk_derive(master_key.getKeySec(), "0", master_key.getState())
+    finished = time.perf_counter()
+    return {"jvm_start": jvm_started - start, "first_calls": finished - jvm_started, "total": finished - start}
+
+
+def benchmark(runs=5, archive_path=wrapper.CDS_ARCHIVE_PATH):
+    """
+    Compares the startup of fresh processes without and with the archive (alternating, to spread noise evenly).
+
+    :param runs: number of processes started per variant
+    :param archive_path: the path of the archive
+    :return: dict with the median durations in seconds ("process" is the wall time of the whole process) per variant
+    """
+    if not os.path.exists(archive_path):
+        raise Exception("Archive " + archive_path + " does not exist, please build it first.")
+
+    samples = {"without_archive": [], "with_archive": []}
+    for _ in range(runs):
+        for variant, path in (("without_archive", ""), ("with_archive", archive_path)):
+            start = time.perf_counter()
+            output = _run_tool(["measure"], archive_path=path)
+            sample = json.loads(output)
+            sample["process"] = time.perf_counter() - start
+            samples[variant].append(sample)
+
+    return {variant: {key: statistics.median(sample[key] for sample in variant_samples)
+                      for key in variant_samples[0]}
+            for variant, variant_samples in samples.items()}
+
+
+def format_report(report):
+    """
+    Formats a benchmark report as human readable table.
+
+    :param report: the report returned by benchmark()
+    :return: the table as str
+    """
+    lines = ["%-16s %10s %12s %10s %10s" % ("variant", "jvm start", "first calls", "total", "process")]
+    for variant, medians in report.items():
+        lines.append("%-16s %9.0fms %11.0fms %9.0fms %9.0fms" % (
+            variant, 1000 * medians["jvm_start"], 1000 * medians["first_calls"], 1000 * medians["total"],
+            1000 * medians["process"]))
+    return "\n".join(lines)
+
+
+def _run_tool(arguments, archive_path):
+    """
+    Runs this tool in a fresh process (a JVM can only be started once per process).
+
+    :param arguments: the command line arguments
+    :param archive_path: the archive the process should use ("" for none)
+    :return: the standard output of the process
+    """
+    environment = dict(os.environ)
+    environment[wrapper.CDS_ARCHIVE_ENVIRONMENT_VARIABLE] = archive_path
+    result = subprocess.run([sys.executable, "-m", "tools.appcds"] + arguments, cwd=REPOSITORY_DIRECTORY,
+                            env=environment, check=True, stdout=subprocess.PIPE, universal_newlines=True)
+    return result.stdout
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Create and benchmark the class data sharing archive of the jar.")
+    subparsers = parser.add_subparsers(dest="command", required=True)
+    build_parser = subparsers.add_parser("build", help="run the warm-up and create the archive")
+    build_parser.add_argument("--archive", default=wrapper.CDS_ARCHIVE_PATH, help="path of the archive")
+    build_parser.add_argument("--java", help="java executable (default: JAVA_HOME or the JVM used by JPype)")
+    benchmark_parser = subparsers.add_parser("benchmark", help="compare the startup without and with the archive")
+    benchmark_parser.add_argument("--archive", default=wrapper.CDS_ARCHIVE_PATH, help="path of the archive")
+    benchmark_parser.add_argument("--runs", type=int, default=5, help="processes started per variant")
+    benchmark_parser.add_argument("--json", action="store_true", help="print the report as JSON")
+    warm_up_parser = subparsers.add_parser("warm-up", help="(internal) exercise the wallet and record the classes")
+    warm_up_parser.add_argument("--class-list", required=True)
+    warm_up_parser.add_argument("--class-path", required=True)
+    subparsers.add_parser("measure", help="(internal) measure the startup of this process")
+    arguments = parser.parse_args(argv)
+
+    if arguments.command == "build":
+        class_count = build(arguments.archive, arguments.java)
+        print("Archived " + str(class_count) + " classes in " + arguments.archive)
+    elif arguments.command == "benchmark":
+        report = benchmark(arguments.runs, arguments.archive)
+        print(json.dumps(report, indent=2) if arguments.json else format_report(report))
+    elif arguments.command == "warm-up":
+        warm_up(arguments.class_list, arguments.class_path)
+    elif arguments.command == "measure":
+        print(json.dumps(measure_startup()))
+
+
+if __name__ == "__main__":
+    main()
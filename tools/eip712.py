@@ -0,0 +1,133 @@
+# Author: Leandro Rometsch, 2021
+# Email: leandro@rometsch.org
+# TU Darmstadt, Chair of Applied Cryptography
+
+import argparse
+import copy
+import json
+import random
+import time
+
+from eth_account import account
+from eth_account.messages import encode_typed_data
+
+from utils.typeddata import TypedDataEncoder
+
+DOMAIN_FIELDS = [{"name": "name", "type": "string"}, {"name": "version", "type": "string"},
+                 {"name": "chainId", "type": "uint256"}, {"name": "verifyingContract", "type": "address"}]
+PERMIT_TYPES = {
+    "EIP712Domain": DOMAIN_FIELDS,
+    "Permit": [{"name": "owner", "type": "address"}, {"name": "spender", "type": "address"},
+               {"name": "value", "type": "uint256"}, {"name": "nonce", "type": "uint256"},
+               {"name": "deadline", "type": "uint256"}],
+}
+ORDER_TYPES = {
+    "EIP712Domain": DOMAIN_FIELDS,
+    "Order": [{"name": "maker", "type": "address"}, {"name": "taker", "type": "address"},
+              {"name": "makerAsset", "type": "Asset"}, {"name": "takerAsset", "type": "Asset"},
+              {"name": "expiry", "type": "uint64"}, {"name": "salt", "type": "bytes32"}],
+    "Asset": [{"name": "token", "type": "address"}, {"name": "amount", "type": "uint256"}],
+}
+
+
+def generate_messages(count, domains=4, seed=0):
+    """
+    Generates typed data as signed by an exchange: permits and orders (with nested structs) of a few token contracts.
+
+    :param count: number of messages
+    :param domains: number of different domains (verifying contracts)
+    :param seed: seed of the random generator
+    :return: list of typed data dicts
+    """
+    generator = random.Random(seed)
+
+    def address():
+        return "0x" + generator.getrandbits(160).to_bytes(20, "big").hex()
+
+    contracts = [address() for _ in range(domains)]
+    messages = []
+    for index in range(count):
+        domain = {"name": "Token " + str(index % domains), "version": "1", "chainId": 1,
+                  "verifyingContract": contracts[index % domains]}
+        if index % 2 == 0:
+            message = {"owner": address(), "spender": address(), "value": generator.getrandbits(96), "nonce": index,
+                       "deadline": 2 ** 32 + index}
+            messages.append({"types": PERMIT_TYPES, "primaryType": "Permit", "domain": domain, "message": message})
+        else:
+            message = {"maker": address(), "taker": address(),
+                       "makerAsset": {"token": contracts[0], "amount": generator.getrandbits(96)},
+                       "takerAsset": {"token": contracts[-1], "amount": generator.getrandbits(96)},
+                       "expiry": 2 ** 32 + index, "salt": generator.getrandbits(256).to_bytes(32, "big")}
+            messages.append({"types": ORDER_TYPES, "primaryType": "Order", "domain": domain, "message": message})
+    return messages
+
+
+def run_benchmark(count=5000, domains=4, sign=False, seed=0):
+    """
+    Encodes the same messages with eth_account's encoder, an uncached TypedDataEncoder and a cached one.
+
+    :param count: number of messages
+    :param domains: number of different domains
+    :param sign: also measure signing the (cached) encoded messages
+    :param seed: seed of the random generator
+    :return: dict mapping the variants to dicts with the total seconds and microseconds per message
+    """
+    messages = generate_messages(count, domains, seed)
+    reference_messages = copy.deepcopy(messages)  # eth_account may normalize the given dicts
+    uncached_encoder = TypedDataEncoder(max_size=0)
+    cached_encoder = TypedDataEncoder()
+
+    for typed_data, reference in zip(messages[:10], reference_messages[:10]):
+        if cached_encoder.encode(typed_data) != encode_typed_data(full_message=copy.deepcopy(reference)):
+            raise Exception("Encoding differs from eth_account.")
+
+    variants = {
+        "eth_account": lambda: [encode_typed_data(full_message=typed_data) for typed_data in reference_messages],
+        "uncached": lambda: [uncached_encoder.encode(typed_data) for typed_data in messages],
+        "cached": lambda: [cached_encoder.encode(typed_data) for typed_data in messages],
+    }
+    if sign:
+        key = account.Account.create().key
+        variants["cached_and_signed"] = lambda: [account.Account.sign_message(cached_encoder.encode(typed_data), key)
+                                                 for typed_data in messages]
+
+    report = {}
+    for variant, run in variants.items():
+        start = time.perf_counter()
+        run()
+        duration = time.perf_counter() - start
+        report[variant] = {"seconds": duration, "us_per_message": 1e6 * duration / count}
+    report["cached"]["statistics"] = cached_encoder.get_statistics()
+    return report
+
+
+def format_report(report):
+    """
+    Formats a benchmark report as human readable table.
+
+    :param report: the report returned by run_benchmark()
+    :return: the table as str
+    """
+    baseline = report["eth_account"]["seconds"]
+    lines = ["%-18s %10s %12s %8s" % ("variant", "seconds", "us/message", "speedup")]
+    for variant, result in report.items():
+        lines.append("%-18s %10.3f %12.1f %7.1fx" % (variant, result["seconds"], result["us_per_message"],
+                                                      baseline / result["seconds"]))
+    return "\n".join(lines)
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Compare cached and uncached EIP-712 typed data encoding.")
+    parser.add_argument("--messages", type=int, default=5000, help="number of messages (permits and orders)")
+    parser.add_argument("--domains", type=int, default=4, help="number of different domains")
+    parser.add_argument("--sign", action="store_true", help="also measure signing")
+    parser.add_argument("--seed", type=int, default=0, help="seed of the generated messages")
+    parser.add_argument("--json", action="store_true", help="print the report as JSON")
+    arguments = parser.parse_args(argv)
+
+    report = run_benchmark(arguments.messages, arguments.domains, arguments.sign, arguments.seed)
+    print(json.dumps(report, indent=2) if arguments.json else format_report(report))
+
+
+if __name__ == "__main__":
+    main()
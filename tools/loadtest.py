@@ -0,0 +1,404 @@
+# Author: Leandro Rometsch, 2021
+# Email: leandro@rometsch.org
+# TU Darmstadt, Chair of Applied Cryptography
+
+import argparse
+import json
+import math
+import os
+import random
+import shutil
+import tempfile
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+import wallet as tudwallet
+
+OP_PUBLIC_KEY_DERIVE = "public_key_derive"  # A new user gets a deposit address
+OP_SIGN_TRANSACTION = "sign_transaction"  # A withdrawal
+OP_SECRET_KEY_DERIVE = "secret_key_derive"  # Derives the latest secret key, which forces a wallet synchronization
+OPERATIONS = (OP_PUBLIC_KEY_DERIVE, OP_SIGN_TRANSACTION, OP_SECRET_KEY_DERIVE)
+
+DEFAULT_MIX = {OP_PUBLIC_KEY_DERIVE: 0.2, OP_SIGN_TRANSACTION: 0.7, OP_SECRET_KEY_DERIVE: 0.1}
+TRANSACTION_TEMPLATE = {"to": "0xF0109fC8DF283027b6285cc889F5aA624EaC1F55", "value": 1000000000, "gas": 2000000,
+                        "gasPrice": 234567897654321, "chainId": 1}
+
+
+class LatencyHistogram:
+    """A histogram of latencies with logarithmic buckets (relative error below 1 %), so percentiles of millions of
+    samples can be computed with constant memory."""
+
+    def __init__(self, growth=1.02):
+        """
+        Instantiate an empty histogram.
+
+        :param growth: ratio between the upper bounds of two neighbouring buckets
+        """
+        self.__log_growth = math.log(growth)
+        self.__growth = growth
+        self.__buckets = {}  # bucket index -> count
+        self.count = 0
+        self.total = 0.0
+        self.max = 0.0
+
+    def record(self, seconds):
+        """
+        Add a latency sample.
+
+        :param seconds: the latency in seconds
+        """
+        microseconds = max(seconds * 1e6, 1.0)
+        index = int(math.log(microseconds) / self.__log_growth)
+        self.__buckets[index] = self.__buckets.get(index, 0) + 1
+        self.count += 1
+        self.total += seconds
+        self.max = max(self.max, seconds)
+
+    def percentile(self, percent):
+        """
+        Computes a percentile of all samples.
+
+        :param percent: the percentile (e.g. 99.9)
+        :return: the latency in seconds (upper bound of the bucket containing the percentile, at most the maximum)
+        """
+        if self.count == 0:
+            return 0.0
+        rank = math.ceil(self.count * percent / 100)
+        seen = 0
+        for index in sorted(self.__buckets):
+            seen += self.__buckets[index]
+            if seen >= rank:
+                return min(self.__growth ** (index + 1) / 1e6, self.max)
+        return self.max
+
+    def get_summary(self):
+        """
+        Getter: Get count, mean, p50, p99, p999 and max of all samples.
+
+        :return: dict of the statistics (latencies in seconds)
+        """
+        return {"count": self.count, "mean": self.total / self.count if self.count else 0.0,
+                "p50": self.percentile(50), "p99": self.percentile(99), "p999": self.percentile(99.9),
+                "max": self.max}
+
+
+def generate_workload(operations, mix=None, burst_every=500, burst_size=50, seed=0):
+    """
+    Generates a synthetic workload: operations drawn from the mix, interrupted by bursts of public key derivations
+    (e.g. a marketing campaign bringing in many new users at once).
+
+    :param operations: the total number of operations
+    :param mix: dict of operation name -> weight (DEFAULT_MIX if None)
+    :param burst_every: number of operations between two bursts (0 disables bursts)
+    :param burst_size: number of public key derivations per burst
+    :param seed: seed of the random generator, the same seed gives the same workload
+    :return: list of operations (dicts with key "op")
+    """
+    mix = DEFAULT_MIX if mix is None else mix
+    for name in mix:
+        if name not in OPERATIONS:
+            raise ValueError("Unknown operation " + str(name) + ". Use one of: " + ", ".join(OPERATIONS))
+
+    rng = random.Random(seed)
+    names = list(mix.keys())
+    weights = [mix[name] for name in names]
+    workload = []
+    while len(workload) < operations:
+        if burst_every and len(workload) % burst_every == 0 and len(workload) > 0:
+            workload.extend({"op": OP_PUBLIC_KEY_DERIVE} for i in range(burst_size))
+        else:
+            workload.append({"op": rng.choices(names, weights)[0]})
+    return workload[:operations]
+
+
+def load_workload(path):
+    """
+    Loads a recorded workload. Each line of the file is a JSON object with the key "op" (one of OPERATIONS).
+
+    :param path: the path of the workload file
+    :return: list of operations (dicts with key "op")
+    """
+    with open(path, 'r') as workload_file:
+        workload = [json.loads(line) for line in workload_file if line.strip()]
+    for operation in workload:
+        if operation.get("op") not in OPERATIONS:
+            raise ValueError("Unknown operation in workload file: " + str(operation))
+    return workload
+
+
+def save_workload(path, workload):
+    """
+    Records a workload, so it can be replayed later on (e.g. against another storage or caching option).
+
+    :param path: the path of the workload file
+    :param workload: list of operations (dicts with key "op")
+    """
+    with open(path, 'w') as workload_file:
+        for operation in workload:
+            workload_file.write(json.dumps(operation) + "\n")
+
+
+def get_process_bytes_written():
+    """
+    Getter: Get the number of bytes the process has caused to be written to storage so far (Linux only).
+
+    :return: the number of bytes or None if not available
+    """
+    try:
+        with open("/proc/self/io", 'r') as io_file:
+            for line in io_file:
+                if line.startswith("write_bytes:"):
+                    return int(line.split()[1])
+    except OSError:
+        pass
+    return None
+
+
+def get_directory_size(path):
+    """
+    Getter: Get the total size of all files below a directory.
+
+    :param path: the directory
+    :return: the size in bytes
+    """
+    size = 0
+    for root, dirs, files in os.walk(path):
+        for file in files:
+            try:
+                size += os.path.getsize(os.path.join(root, file))
+            except OSError:  # Replaced or deleted in the meantime
+                pass
+    return size
+
+
+class LoadTest:
+    """Replays a workload against a wallet in a temporary directory at a target rate with several worker threads.
+    Latencies are measured from the time an operation was scheduled (not when a worker picked it up), so queueing
+    caused by a saturated wallet is part of the latency instead of hiding it."""
+
+    def __init__(self, workload, rate=100.0, concurrency=4, sample_interval=1.0, directory=None, **wallet_options):
+        """
+        Prepare a load test.
+
+        :param workload: list of operations (see generate_workload() and load_workload())
+        :param rate: target rate in operations per second (None for as fast as possible)
+        :param concurrency: number of worker threads issuing operations
+        :param sample_interval: seconds between two samples of the timeline
+        :param directory: directory for the wallet (a temporary one is created and removed if None)
+        :param wallet_options: further keyword arguments passed to Wallet (e.g. durability, secret_key_cache_size)
+        """
+        if concurrency < 1:
+            raise ValueError("Concurrency must be at least 1.")
+
+        self.__workload = workload
+        self.__rate = rate
+        self.__concurrency = concurrency
+        self.__sample_interval = sample_interval
+        self.__directory = directory
+        self.__wallet_options = wallet_options
+
+        self.__lock = threading.Lock()
+        self.__free_workers = threading.Semaphore(concurrency)
+        self.__histograms = {}
+        self.__errors = {}
+        self.__first_errors = {}  # operation name -> message of its first error
+        self.__completed = 0
+        self.__nonce = 0
+        self.__ids = []
+        self.__wallet = None
+
+    def run(self):
+        """
+        Run the load test.
+
+        :return: the report as dict (see format_report())
+        """
+        directory = self.__directory
+        temporary = directory is None
+        if temporary:
+            directory = tempfile.mkdtemp(prefix="tudwallet-loadtest-") + "/"
+
+        try:
+            self.__wallet = tudwallet.Wallet(directory, directory, **self.__wallet_options)
+            self.__wallet.generate_master_key(overwrite=True)
+            self.__ids = [self.__wallet.public_key_derive().id]  # Signing needs at least one key
+
+            stop = threading.Event()
+            timeline = []
+            sampler = threading.Thread(target=self._sample, args=(directory, stop, timeline), daemon=True)
+
+            bytes_written = get_process_bytes_written()
+            start = time.perf_counter()
+            sampler.start()
+            with ThreadPoolExecutor(max_workers=self.__concurrency) as executor:
+                for index, operation in enumerate(self.__workload):
+                    if self.__rate:
+                        scheduled = start + index / self.__rate
+                        delay = scheduled - time.perf_counter()
+                        if delay > 0:
+                            time.sleep(delay)
+                    else:  # Closed loop: only issue an operation once a worker is free
+                        self.__free_workers.acquire()
+                        scheduled = time.perf_counter()
+                    executor.submit(self._execute, operation["op"], scheduled)
+            duration = time.perf_counter() - start
+            stop.set()
+            sampler.join()
+
+            if bytes_written is not None:
+                bytes_written = get_process_bytes_written() - bytes_written
+            return {
+                "duration": duration,
+                "throughput": self.__completed / duration if duration > 0 else 0.0,
+                "concurrency": self.__concurrency,
+                "target_rate": self.__rate,
+                "operations": {name: dict(histogram.get_summary(), errors=self.__errors.get(name, 0),
+                                          first_error=self.__first_errors.get(name))
+                               for name, histogram in self.__histograms.items()},
+                "bytes_written": bytes_written,
+                "wallet_bytes": get_directory_size(directory),
+                "timeline": timeline,
+            }
+        finally:
+            if self.__wallet is not None:
+                self.__wallet.close()
+            if temporary:
+                shutil.rmtree(directory, ignore_errors=True)
+
+    def _execute(self, name, scheduled):
+        """
+        Executes one operation and records its latency (or the error).
+
+        :param name: the operation name
+        :param scheduled: the time (time.perf_counter()) the operation was scheduled for
+        """
+        try:
+            if name == OP_PUBLIC_KEY_DERIVE:
+                public_key = self.__wallet.public_key_derive()
+                with self.__lock:
+                    self.__ids.append(public_key.id)
+            elif name == OP_SIGN_TRANSACTION:
+                with self.__lock:
+                    id = random.choice(self.__ids)
+                    transaction = dict(TRANSACTION_TEMPLATE, nonce=self.__nonce)
+                    self.__nonce += 1
+                self.__wallet.sign_transaction(transaction, id)
+            else:
+                self.__wallet.secret_key_derive()
+            error = None
+        except Exception as exception:
+            error = repr(exception)
+        latency = time.perf_counter() - scheduled
+
+        with self.__lock:
+            if error is not None:
+                self.__errors[name] = self.__errors.get(name, 0) + 1
+                self.__first_errors.setdefault(name, error)
+            if name not in self.__histograms:
+                self.__histograms[name] = LatencyHistogram()
+            self.__histograms[name].record(latency)
+            self.__completed += 1
+        if not self.__rate:
+            self.__free_workers.release()
+
+    def _sample(self, directory, stop, timeline):
+        """
+        Samples completed operations and I/O volume until stopped.
+
+        :param directory: the wallet directory
+        :param stop: event that ends sampling
+        :param timeline: list the samples are appended to
+        """
+        start = time.perf_counter()
+        initial_bytes_written = get_process_bytes_written()
+        while True:
+            stopped = stop.wait(self.__sample_interval)
+            bytes_written = get_process_bytes_written()
+            with self.__lock:
+                completed = self.__completed
+            timeline.append({"time": time.perf_counter() - start, "completed": completed,
+                             "bytes_written": None if bytes_written is None else bytes_written - initial_bytes_written,
+                             "wallet_bytes": get_directory_size(directory)})
+            if stopped:
+                return
+
+
+def format_report(report):
+    """
+    Formats a load test report for the terminal.
+
+    :param report: the report returned by LoadTest.run()
+    :return: the report as string
+    """
+    lines = ["duration %.2f s, throughput %.1f ops/s (target %s ops/s, concurrency %d)" %
+             (report["duration"], report["throughput"], report["target_rate"] or "max", report["concurrency"]),
+             "%-20s %8s %7s %10s %10s %10s %10s" % ("operation", "count", "errors", "p50 ms", "p99 ms", "p999 ms",
+                                                    "max ms")]
+    for name, summary in sorted(report["operations"].items()):
+        lines.append("%-20s %8d %7d %10.2f %10.2f %10.2f %10.2f" %
+                     (name, summary["count"], summary["errors"], summary["p50"] * 1e3, summary["p99"] * 1e3,
+                      summary["p999"] * 1e3, summary["max"] * 1e3))
+        if summary["first_error"] is not None:
+            lines.append("    first error: " + summary["first_error"])
+
+    lines.append("bytes written %s, wallet size %d bytes" % (report["bytes_written"], report["wallet_bytes"]))
+    lines.append("%10s %10s %14s %14s" % ("time s", "completed", "bytes written", "wallet bytes"))
+    for sample in report["timeline"]:
+        lines.append("%10.1f %10d %14s %14d" % (sample["time"], sample["completed"], sample["bytes_written"],
+                                                sample["wallet_bytes"]))
+    return "\n".join(lines)
+
+
+def parse_mix(text):
+    """
+    Parses an operation mix given as "name=weight,name=weight".
+
+    :param text: the mix
+    :return: dict of operation name -> weight
+    """
+    mix = {}
+    for part in text.split(","):
+        name, weight = part.split("=")
+        mix[name.strip()] = float(weight)
+    return mix
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Replay a synthetic or recorded workload against a temporary wallet.")
+    parser.add_argument("--operations", type=int, default=1000, help="number of operations (synthetic workload)")
+    parser.add_argument("--mix", type=parse_mix, default=None,
+                        help="operation mix, e.g. public_key_derive=0.2,sign_transaction=0.7,secret_key_derive=0.1")
+    parser.add_argument("--burst-every", type=int, default=500, help="operations between bursts of derivations")
+    parser.add_argument("--burst-size", type=int, default=50, help="public key derivations per burst")
+    parser.add_argument("--seed", type=int, default=0, help="seed of the synthetic workload")
+    parser.add_argument("--workload", help="replay a recorded workload file instead of a synthetic one")
+    parser.add_argument("--record", help="save the workload to this file")
+    parser.add_argument("--rate", type=float, default=100.0, help="target operations per second (0 for maximum)")
+    parser.add_argument("--concurrency", type=int, default=4, help="number of worker threads")
+    parser.add_argument("--sample-interval", type=float, default=1.0, help="seconds between timeline samples")
+    parser.add_argument("--directory", help="wallet directory (temporary if not given)")
+    parser.add_argument("--durability", default=tudwallet.DURABILITY_STRICT, help="strict, group or relaxed")
+    parser.add_argument("--secret-key-cache-size", type=int, default=0, help="session secret keys cached")
+    parser.add_argument("--derivation-engine", default="java", help="java or python")
+    parser.add_argument("--json", action="store_true", help="print the report as JSON")
+    arguments = parser.parse_args(argv)
+
+    if arguments.workload:
+        workload = load_workload(arguments.workload)
+    else:
+        workload = generate_workload(arguments.operations, arguments.mix, arguments.burst_every, arguments.burst_size,
+                                     arguments.seed)
+    if arguments.record:
+        save_workload(arguments.record, workload)
+
+    load_test = LoadTest(workload, rate=arguments.rate or None, concurrency=arguments.concurrency,
+                         sample_interval=arguments.sample_interval, directory=arguments.directory,
+                         durability=arguments.durability, secret_key_cache_size=arguments.secret_key_cache_size,
+                         derivation_engine=arguments.derivation_engine)
+    report = load_test.run()
+    print(json.dumps(report, indent=2) if arguments.json else format_report(report))
+
+
+if __name__ == "__main__":
+    main()
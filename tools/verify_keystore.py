@@ -0,0 +1,273 @@
+# Author: Leandro Rometsch, 2021
+# Email: leandro@rometsch.org
+# TU Darmstadt, Chair of Applied Cryptography
+
+import argparse
+import heapq
+import itertools
+import json
+import os
+import sys
+import time
+from concurrent.futures import ProcessPoolExecutor
+
+import wallet as tudwallet
+from utils.derivation import PythonDerivationEngine, STATE_SIZE
+from utils.keystore import KeyStore
+from utils.records import PublicKey
+from utils.secp256k1 import FixedBaseTable, G, N, is_on_curve
+from utils.support import get_dict_from_file, get_public_key_coordinates_from_file
+
+MISSING_STATE = "missing_state"  # A key without state in the hot wallet
+INVALID_STATE = "invalid_state"  # A state that is not a list of STATE_SIZE signed bytes
+STATE_MISMATCH = "state_mismatch"  # Hot and cold wallet store different states for an id
+MISSING_PUBLIC_KEY = "missing_public_key"  # A derived id (or a secret key) without session public key
+INVALID_PUBLIC_KEY = "invalid_public_key"  # A stored session public key that is no point on secp256k1
+INVALID_SECRET_KEY = "invalid_secret_key"  # A stored session secret key out of range
+KEY_MISMATCH = "key_mismatch"  # sk·G differs from the stored session public key (so do the addresses)
+DERIVATION_MISMATCH = "derivation_mismatch"  # Public key or state differ from a re-derivation from the previous state
+
+DEFAULT_CHUNK_SIZE = 2048  # Ids verified per task of a worker process
+DEFAULT_MAX_MISMATCHES = 10  # Mismatches listed in the report (all are counted)
+
+_process_tables = {}  # Per worker process: the generator table and the derivation engine of the master public key
+
+
+def verify_keystore(base_directory_hw="data/", base_directory_cw="data/", workers=None, check_derivation=False,
+                    max_mismatches=DEFAULT_MAX_MISMATCHES, chunk_size=DEFAULT_CHUNK_SIZE):
+    """
+    Verifies that the stores of a wallet agree: every id of a session key has a (well-formed) state, every session
+    secret key sk satisfies sk·G == its session public key (and therefore has the same address) and hot and cold wallet
+    store the same states. Optionally every session public key and state is re-derived from the previous state.
+    The keystores are streamed once in ascending id order, the checks run in parallel worker processes.
+
+    :param base_directory_hw: specifies the storage location of the hot wallet (as given to Wallet)
+    :param base_directory_cw: specifies the storage location of the cold wallet (None to skip the secret keys)
+    :param workers: number of worker processes (None for one per core, 1 to verify in this process)
+    :param check_derivation: also re-derive every session public key and state from the master public key
+    :param max_mismatches: number of mismatches (with the lowest ids) listed in the report
+    :param chunk_size: number of ids per task of a worker process
+    :return: dict containing the counts of checked ids and keys, the mismatch count, the first mismatches, the
+             duration and the throughput
+    """
+    hot_directory = base_directory_hw + "HotWalletData/"
+    if not os.path.exists(hot_directory + tudwallet.STATE_FILE_NAME):
+        raise Exception("tudwallet - No hot wallet found in " + base_directory_hw + ".")
+    workers = workers or os.cpu_count() or 1
+
+    start = time.perf_counter()
+    hot_states = get_dict_from_file(hot_directory + tudwallet.STATE_FILE_NAME)
+    anchors = {0}
+    if os.path.exists(hot_directory + tudwallet.LANES_FILE_NAME):
+        anchors.update(get_dict_from_file(hot_directory + tudwallet.LANES_FILE_NAME)["anchors"])
+    master_public_key = None
+    if check_derivation:
+        master_public_key = get_public_key_coordinates_from_file(hot_directory + tudwallet.MPK_FILE_NAME)
+
+    public_store = KeyStore(hot_directory + tudwallet.SPK_DIRECTORY_NAME,
+                            legacy_path=hot_directory + tudwallet.SPK_FILE_NAME)
+    secret_entries = iter(())
+    cold_states = {}
+    if base_directory_cw is not None:
+        cold_directory = base_directory_cw + "ColdWalletData/"
+        secret_entries = KeyStore(cold_directory + tudwallet.SSK_DIRECTORY_NAME,
+                                  legacy_path=cold_directory + tudwallet.SSK_FILE_NAME).iterate(0)
+        if os.path.exists(cold_directory + tudwallet.STATE_FILE_NAME):
+            cold_states = get_dict_from_file(cold_directory + tudwallet.STATE_FILE_NAME)
+
+    report = {"ids": 0, "public_keys": 0, "secret_keys": 0, "mismatch_count": 0, "mismatches": []}
+
+    def add_results(count, mismatches):
+        report["mismatch_count"] += count
+        report["mismatches"] = heapq.nsmallest(max_mismatches, report["mismatches"] + mismatches,
+                                               key=lambda mismatch: mismatch["id"])
+
+    def tasks():
+        previous_state = None
+        chunk = []
+        for id, public_key, secret_key in _join(sorted(int(id) for id in hot_states), public_store.iterate(0),
+                                                secret_entries):
+            report["ids"] += 1
+            report["public_keys"] += public_key is not None
+            report["secret_keys"] += secret_key is not None
+            state = hot_states.get(str(id))
+            mismatches = _check_entry(id, public_key, secret_key, state, cold_states.get(str(id)), id in anchors)
+            if mismatches:
+                add_results(len(mismatches), mismatches)
+
+            if id not in anchors and (public_key is not None or secret_key is not None):
+                chunk.append((id, public_key, secret_key, previous_state if check_derivation else None,
+                              state if check_derivation else None))
+                if len(chunk) >= chunk_size:
+                    yield chunk
+                    chunk = []
+            if state is not None:
+                previous_state = state
+        if chunk:
+            yield chunk
+
+    if workers == 1:
+        for chunk in tasks():
+            add_results(*verify_chunk(chunk, master_public_key, max_mismatches))
+    else:
+        with ProcessPoolExecutor(max_workers=workers) as executor:
+            pending = []
+            for chunk in tasks():
+                pending.append(executor.submit(verify_chunk, chunk, master_public_key, max_mismatches))
+                if len(pending) >= 2 * workers:  # Bounds the memory of chunks waiting for a worker
+                    add_results(*pending.pop(0).result())
+            for future in pending:
+                add_results(*future.result())
+
+    duration = time.perf_counter() - start
+    report.update({"workers": workers, "check_derivation": check_derivation, "seconds": duration,
+                   "ids_per_second": report["ids"] / duration if duration > 0 else 0.0})
+    return report
+
+
+def verify_chunk(chunk, master_public_key=None, max_mismatches=DEFAULT_MAX_MISMATCHES):
+    """
+    Verifies the key pairs of a chunk of ids (run in the worker processes).
+
+    :param chunk: list of (id, public key as stored or None, secret key as stored or None, previous state, state)
+                  tuples; the states are None unless the derivation is checked
+    :param master_public_key: the master public key as (x, y) tuple of ints (None to skip the derivation check)
+    :param max_mismatches: maximum number of mismatches returned
+    :return: tuple of the number of mismatches and the list of the first mismatches
+    """
+    generator_table, engine = _get_process_tables(master_public_key)
+    count = 0
+    mismatches = []
+
+    def report(id, kind, detail):
+        nonlocal count
+        count += 1
+        if len(mismatches) < max_mismatches:
+            mismatches.append({"id": id, "type": kind, "detail": detail})
+
+    for id, stored_public_key, stored_secret_key, previous_state, state in chunk:
+        public_key = None
+        if stored_public_key is not None:
+            public_key = tuple(int(coordinate) for coordinate in stored_public_key.split(","))
+            if not is_on_curve(public_key):
+                report(id, INVALID_PUBLIC_KEY, "not a point on secp256k1")
+                public_key = None
+
+        if stored_secret_key is not None:
+            secret_key = int(stored_secret_key)
+            if not 0 < secret_key < N:
+                report(id, INVALID_SECRET_KEY, "out of range")
+            elif public_key is not None:
+                secret_public_key = generator_table.multiply(secret_key)
+                if secret_public_key != public_key:
+                    report(id, KEY_MISMATCH, "secret key address " + PublicKey(None, id, *secret_public_key).address +
+                           ", public key address " + PublicKey(None, id, *public_key).address)
+
+        if engine is not None and public_key is not None and previous_state is not None:
+            derived_public_key, derived_state = engine.pk_derive(id, previous_state)
+            if derived_public_key != public_key:
+                report(id, DERIVATION_MISMATCH, "public key differs from the derivation from the previous state")
+            elif state is not None and derived_state != state:
+                report(id, DERIVATION_MISMATCH, "state differs from the derivation from the previous state")
+    return count, mismatches
+
+
+def format_report(report):
+    """
+    Formats a verification report as human readable text.
+
+    :param report: the report returned by verify_keystore()
+    :return: the text
+    """
+    lines = ["%d ids, %d public keys, %d secret keys verified in %.1f s (%.0f ids/s, %d workers)" % (
+        report["ids"], report["public_keys"], report["secret_keys"], report["seconds"], report["ids_per_second"],
+        report["workers"])]
+    lines.append("%d mismatches" % report["mismatch_count"] if report["mismatch_count"] else "No mismatches")
+    for mismatch in report["mismatches"]:
+        lines.append("  id %d: %s (%s)" % (mismatch["id"], mismatch["type"], mismatch["detail"]))
+    return "\n".join(lines)
+
+
+def _check_entry(id, public_key, secret_key, state, cold_state, anchor):
+    """
+    Checks the presence and the form of the stored data of an id (everything but the cryptographic checks).
+
+    :param id: the id
+    :param public_key: the stored session public key or None
+    :param secret_key: the stored session secret key or None
+    :param state: the state stored by the hot wallet or None
+    :param cold_state: the state stored by the cold wallet or None
+    :param anchor: whether the id is 0 or the anchor of a derivation lane (no key pair)
+    :return: list of mismatches
+    """
+    mismatches = []
+    if state is None:
+        if public_key is not None or secret_key is not None:
+            mismatches.append({"id": id, "type": MISSING_STATE, "detail": "key stored without state"})
+    elif not (isinstance(state, list) and len(state) == STATE_SIZE and
+              all(isinstance(value, int) and -128 <= value < 128 for value in state)):
+        mismatches.append({"id": id, "type": INVALID_STATE, "detail": "expected " + str(STATE_SIZE) + " signed bytes"})
+    elif cold_state is not None and cold_state != state:
+        mismatches.append({"id": id, "type": STATE_MISMATCH, "detail": "hot and cold wallet states differ"})
+
+    if public_key is None and not anchor and (state is not None or secret_key is not None):
+        mismatches.append({"id": id, "type": MISSING_PUBLIC_KEY, "detail": "derived id without session public key"})
+    return mismatches
+
+
+def _join(state_ids, public_entries, secret_entries):
+    """
+    Joins the ascending ids of the state file with the entries of both keystores.
+
+    :param state_ids: ascending ids (as int) of the state file
+    :param public_entries: (id, key) tuples of the public keystore in ascending id order
+    :param secret_entries: (id, key) tuples of the secret keystore in ascending id order
+    :return: generator of (id, public key or None, secret key or None) tuples in ascending id order
+    """
+    merged = heapq.merge(((id, 0, None) for id in state_ids), ((id, 1, key) for id, key in public_entries),
+                         ((id, 2, key) for id, key in secret_entries))
+    for id, entries in itertools.groupby(merged, key=lambda entry: entry[0]):
+        keys = [None, None, None]
+        for _, source, key in entries:
+            keys[source] = key
+        yield id, keys[1], keys[2]
+
+
+def _get_process_tables(master_public_key):
+    """
+    Getter: Get the precomputed generator table and the derivation engine of the current (worker) process.
+
+    :param master_public_key: the master public key as (x, y) tuple of ints or None
+    :return: tuple of the generator table and the engine (None if no master public key is given)
+    """
+    if "generator" not in _process_tables:
+        _process_tables["generator"] = FixedBaseTable(G, window=8)  # Half the additions of the default window
+    engine = None
+    if master_public_key is not None:
+        master_public_key = tuple(master_public_key)
+        engine = _process_tables.get(master_public_key)
+        if engine is None:
+            engine = _process_tables[master_public_key] = PythonDerivationEngine(master_public_key)
+    return _process_tables["generator"], engine
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Verify that the keystores and states of a wallet agree.")
+    parser.add_argument("--hot", default="data/", help="base directory of the hot wallet")
+    parser.add_argument("--cold", default="data/", help="base directory of the cold wallet")
+    parser.add_argument("--no-cold", action="store_true", help="skip the secret keys of the cold wallet")
+    parser.add_argument("--workers", type=int, default=None, help="number of worker processes (default: cores)")
+    parser.add_argument("--derivation", action="store_true", help="also re-derive every public key and state")
+    parser.add_argument("--max-mismatches", type=int, default=DEFAULT_MAX_MISMATCHES,
+                        help="number of mismatches listed")
+    parser.add_argument("--json", action="store_true", help="print the report as JSON")
+    arguments = parser.parse_args(argv)
+
+    report = verify_keystore(arguments.hot, None if arguments.no_cold else arguments.cold, arguments.workers,
+                             arguments.derivation, arguments.max_mismatches)
+    print(json.dumps(report, indent=2) if arguments.json else format_report(report))
+    return 1 if report["mismatch_count"] else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -1,2 +1,13 @@
 from .support import *
-from .wrapper import *
\ No newline at end of file
+from .wrapper import *
+from .cache import *
+from .keystore import *
+from .records import *
+from .compact import *
+from .derivation import *
+from .idset import *
+from .bundle import *
+from .typeddata import *
+from .jvmmetrics import *
+from .changelog import *
+from .nonces import *
@@ -0,0 +1,94 @@
+# Author: Leandro Rometsch, 2021
+# Email: leandro@rometsch.org
+# TU Darmstadt, Chair of Applied Cryptography
+
+import json
+import os
+
+BUNDLE_VERSION = 1
+REQUEST_BUNDLE_FORMAT = "tudwallet-signing-request"  # Written by the hot wallet, processed by the cold wallet
+RESULT_BUNDLE_FORMAT = "tudwallet-signing-result"  # Written by the cold wallet, imported by the hot wallet
+
+
+def create_bundle_id() -> str:
+    """
+    Creates a random id identifying a signing request and its result.
+
+    :return: the bundle id as hex string
+    """
+    return os.urandom(16).hex()
+
+
+def save_bundle(path, bundle: dict):
+    """
+    Stores a bundle as JSON file. The file is replaced atomically, so a bundle is never read partially written (e.g.
+    from a removable drive that is unplugged early).
+
+    :param path: the path of the bundle file
+    :param bundle: the bundle (request or result)
+    """
+    temporary_path = path + ".tmp"
+    with open(temporary_path, 'w') as bundle_file:
+        json.dump(bundle, bundle_file)
+        bundle_file.flush()
+        os.fsync(bundle_file.fileno())
+    os.replace(temporary_path, path)
+
+
+def load_bundle(path, bundle_format) -> dict:
+    """
+    Loads a bundle stored by save_bundle() and checks its format.
+
+    :param path: the path of the bundle file
+    :param bundle_format: the expected format (REQUEST_BUNDLE_FORMAT or RESULT_BUNDLE_FORMAT)
+    :return: the bundle
+    """
+    with open(path, 'r') as bundle_file:
+        bundle = json.load(bundle_file)
+
+    if not isinstance(bundle, dict) or bundle.get("format") != bundle_format:
+        raise Exception("File " + str(path) + " is not a bundle of format " + bundle_format + ".")
+    if bundle.get("version") != BUNDLE_VERSION:
+        raise Exception("Bundle version " + str(bundle.get("version")) + " is not supported.")
+    return bundle
+
+
+def encode_message(message) -> dict:
+    """
+    Encodes a message to be signed for a bundle.
+
+    :param message: the message given as string or bytes
+    :return: dict containing the message as "text" (string) or "hex" (bytes)
+    """
+    if type(message) is str:
+        return {"text": message}
+    elif type(message) is bytes:
+        return {"hex": message.hex()}
+    raise Exception("Message type not supported. Please provide as string or bytes.")
+
+
+def decode_message(entry: dict):
+    """
+    Decodes a message encoded by encode_message().
+
+    :param entry: the encoded message
+    :return: the message as string or bytes
+    """
+    if "text" in entry:
+        return entry["text"]
+    return bytes.fromhex(entry["hex"])
+
+
+def encode_transaction(transaction_dict: dict) -> dict:
+    """
+    Encodes a transaction to be signed for a bundle: raw bytes values (e.g. data) are converted to hex strings, which
+    eth_account accepts as well.
+
+    :param transaction_dict: the transaction
+    :return: the JSON serializable transaction
+    """
+    if not isinstance(transaction_dict, dict):
+        raise TypeError("tudwallet - Transaction given in unsupported format. Provide as dict with keys: nonce, "
+                        "chainId, to, data, value, gas, and gasPrice.")
+    return {key: "0x" + value.hex() if isinstance(value, (bytes, bytearray)) else value
+            for key, value in transaction_dict.items()}
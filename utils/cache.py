@@ -0,0 +1,256 @@
+# Author: Leandro Rometsch, 2021
+# Email: leandro@rometsch.org
+# TU Darmstadt, Chair of Applied Cryptography
+
+import threading
+import time
+from collections import OrderedDict
+
+
+class SecretKeyCache:
+    """A bounded in-memory cache for session secret keys with a time-to-live and least-recently-used eviction.
+    The keys are held as mutable bytes, so they can be wiped (overwritten with zeros) once they leave the cache."""
+
+    def __init__(self, max_size=1024, ttl=300.0):
+        """
+        Instantiate an empty secret key cache.
+
+        :param max_size: maximum number of secret keys held at the same time (least recently used ones are evicted)
+        :param ttl: time in seconds a secret key stays valid inside the cache (None for no expiry)
+        """
+        if max_size < 1:
+            raise ValueError("Secret key cache size must be at least 1.")
+
+        self.__max_size = max_size
+        self.__ttl = ttl
+        self.__entries = OrderedDict()  # id -> (expiry timestamp, bytearray)
+        self.__generation = 0  # Incremented by clear(), so keys derived before are not cached afterwards
+        self.__lock = threading.Lock()
+
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    def get(self, id):
+        """
+        Look up the secret key of the given id.
+        Expired entries are wiped and count as a miss.
+
+        :param id: the id of the session key pair
+        :return: a copy of the secret key as bytes or None if not cached
+        """
+        with self.__lock:
+            entry = self.__entries.get(id)
+            if entry is None:
+                self.misses += 1
+                return None
+
+            expiry, key = entry
+            if expiry is not None and expiry <= time.monotonic():
+                self._discard(id)
+                self.misses += 1
+                return None
+
+            self.__entries.move_to_end(id)
+            self.hits += 1
+            return bytes(key)
+
+    def put(self, id, key: bytes, generation=None):
+        """
+        Store a secret key in the cache. If the cache is full, the least recently used key is evicted.
+
+        :param id: the id of the session key pair
+        :param key: the secret key as bytes
+        :param generation: the generation (see get_generation()) taken before the key was derived; the key is dropped
+                           if the cache has been cleared since (None to store it anyway)
+        """
+        expiry = None if self.__ttl is None else time.monotonic() + self.__ttl
+
+        with self.__lock:
+            if generation is not None and generation != self.__generation:
+                return
+            if id in self.__entries:
+                self._discard(id)
+            self.__entries[id] = (expiry, bytearray(key))
+
+            while len(self.__entries) > self.__max_size:
+                oldest_id = next(iter(self.__entries))
+                self._discard(oldest_id)
+                self.evictions += 1
+
+    def remove(self, id):
+        """
+        Wipe and remove the secret key of the given id (if cached).
+
+        :param id: the id of the session key pair
+        """
+        with self.__lock:
+            if id in self.__entries:
+                self._discard(id)
+
+    def clear(self):
+        """
+        Wipe and remove all cached secret keys. Keys derived before but put afterwards are dropped as well.
+        The hit and miss counters are kept.
+        """
+        with self.__lock:
+            self.__generation += 1
+            for id in list(self.__entries.keys()):
+                self._discard(id)
+
+    def get_generation(self):
+        """
+        Getter: Get the generation of the cache, which changes with every clear().
+
+        :return: the generation
+        """
+        with self.__lock:
+            return self.__generation
+
+    def get_statistics(self):
+        """
+        Getter: Get the usage counters of the cache.
+
+        :return: dict containing hits, misses, evictions and the current size
+        """
+        with self.__lock:
+            return {"hits": self.hits, "misses": self.misses, "evictions": self.evictions,
+                    "size": len(self.__entries)}
+
+    def __len__(self):
+        return len(self.__entries)
+
+    def _discard(self, id):
+        """
+        Removes an entry and overwrites its key material with zeros. The caller must hold the lock.
+
+        :param id: the id of the entry to be removed
+        """
+        _, key = self.__entries.pop(id)
+        key[:] = bytes(len(key))
+
+
+class SignatureCache:
+    """A bounded in-memory cache for signing results with a time-to-live and least-recently-used eviction.
+    Signing is deterministic (RFC 6979), so the same key and payload always give the same signature and a retried
+    request can be answered from the cache. Identical requests arriving at the same time are signed only once: while a
+    result is being computed (in flight), further requests for it wait for that result instead of signing again."""
+
+    def __init__(self, max_size=4096, ttl=300.0):
+        """
+        Instantiate an empty signature cache.
+
+        :param max_size: maximum number of results held at the same time (least recently used ones are evicted)
+        :param ttl: time in seconds a result stays in the cache (None for no expiry)
+        """
+        if max_size < 1:
+            raise ValueError("Signature cache size must be at least 1.")
+
+        self.__max_size = max_size
+        self.__ttl = ttl
+        self.__entries = OrderedDict()  # key -> (expiry timestamp, result)
+        self.__in_flight = {}  # key -> _InFlightSignature
+        self.__generation = 0  # Incremented by clear(), so results in flight before are not cached afterwards
+        self.__lock = threading.Lock()
+
+        self.hits = 0
+        self.misses = 0
+        self.coalesced = 0
+        self.evictions = 0
+        self.expirations = 0
+
+    def get_or_sign(self, key, sign):
+        """
+        Look up the result for the given key or compute it. Failed signing is not cached, the error is raised to all
+        requests waiting for it.
+
+        :param key: hashable key identifying key pair and payload, e.g. (id, payload hash)
+        :param sign: function computing the result on a miss
+        :return: the (cached) result
+        """
+        with self.__lock:
+            entry = self.__entries.get(key)
+            if entry is not None:
+                expiry, result = entry
+                if expiry is None or expiry > time.monotonic():
+                    self.__entries.move_to_end(key)
+                    self.hits += 1
+                    return result
+                del self.__entries[key]
+                self.expirations += 1
+
+            in_flight = self.__in_flight.get(key)
+            leader = in_flight is None
+            if leader:
+                in_flight = self.__in_flight[key] = _InFlightSignature(self.__generation)
+                self.misses += 1
+            else:
+                self.coalesced += 1
+
+        if not leader:
+            in_flight.done.wait()
+            if in_flight.error is not None:
+                raise in_flight.error
+            return in_flight.result
+
+        try:
+            in_flight.result = sign()
+        except BaseException as error:
+            in_flight.error = error
+            raise
+        finally:
+            with self.__lock:
+                if self.__in_flight.get(key) is in_flight:
+                    del self.__in_flight[key]
+                if in_flight.error is None and in_flight.generation == self.__generation:
+                    self._put(key, in_flight.result)
+            in_flight.done.set()
+        return in_flight.result
+
+    def clear(self):
+        """
+        Remove all cached results (e.g. after the master key has been replaced). Results in flight are not cached
+        once they are done and later requests do not wait for them. The counters are kept.
+        """
+        with self.__lock:
+            self.__generation += 1
+            self.__entries.clear()
+            self.__in_flight.clear()
+
+    def get_statistics(self):
+        """
+        Getter: Get the usage counters of the cache.
+
+        :return: dict containing hits, misses, coalesced (requests that waited for an in-flight result), evictions,
+                 expirations, the current size and the number of results in flight
+        """
+        with self.__lock:
+            return {"hits": self.hits, "misses": self.misses, "coalesced": self.coalesced,
+                    "evictions": self.evictions, "expirations": self.expirations, "size": len(self.__entries),
+                    "in_flight": len(self.__in_flight)}
+
+    def __len__(self):
+        return len(self.__entries)
+
+    def _put(self, key, result):
+        """
+        Stores a result and evicts the least recently used ones if the cache is full. The caller must hold the lock.
+
+        :param key: the key of the result
+        :param result: the result
+        """
+        self.__entries[key] = (None if self.__ttl is None else time.monotonic() + self.__ttl, result)
+        self.__entries.move_to_end(key)
+        while len(self.__entries) > self.__max_size:
+            self.__entries.popitem(last=False)
+            self.evictions += 1
+
+
+class _InFlightSignature:
+    __slots__ = ("done", "result", "error", "generation")
+
+    def __init__(self, generation):
+        self.done = threading.Event()
+        self.result = None
+        self.error = None
+        self.generation = generation
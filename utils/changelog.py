@@ -0,0 +1,241 @@
+# Author: Leandro Rometsch, 2021
+# Email: leandro@rometsch.org
+# TU Darmstadt, Chair of Applied Cryptography
+
+import os
+import random
+import struct
+import threading
+import time
+
+from .records import PublicKey
+from .wal import decode_log_line, encode_log_line, fsync_path
+
+CHANGE_LOG_FILE_NAME = "changes.log"  # Ordered change stream of the hot wallet (for read replicas)
+CHANGE_INDEX_FILE_NAME = "changes.idx"  # End offsets of the records of the change stream
+CHANGE_INDEX_MAGIC = b"TUDWCL01"
+CHANGE_INDEX_HEADER = struct.Struct(">8sQ")  # magic, epoch
+CHANGE_INDEX_ENTRY = struct.Struct(">Q")  # end offset of a record in the change log
+
+
+class ChangeLog:
+    """The change stream of a hot wallet: every new id is appended as one record with its state, its session public
+    key and address (both None for ids without key pair, e.g. lane anchors) in the order the ids were applied.
+    A record's position is its 1-based sequence number. The index file holds the end offset of every record, so
+    readers seek to any position directly; records are written before their index entries, so readers only see
+    complete records. A new epoch starts whenever the stream is reset (e.g. the master key is overwritten), which tells
+    replicas to start over."""
+
+    def __init__(self, directory):
+        """
+        Instantiate a change log. The files are created by reset().
+
+        :param directory: the directory the change log files are stored in
+        """
+        self.__log_path = directory + CHANGE_LOG_FILE_NAME
+        self.__index_path = directory + CHANGE_INDEX_FILE_NAME
+        self.__lock = threading.Lock()
+        self.__epoch = None  # Loaded on first use
+        self.__head = 0
+        self.__end_offset = 0
+
+    def exists(self):
+        """
+        Check if the change log has been created.
+
+        :return: True if the change log exists, False if not
+        """
+        return os.path.exists(self.__index_path) and os.path.exists(self.__log_path)
+
+    def reset(self, entries=()):
+        """
+        Starts a new epoch: the change log is replaced by one containing the given entries (e.g. a snapshot of the
+        whole hot wallet).
+
+        :param entries: iterable of dicts with id, state and key (None for ids without key pair) in applying order
+        """
+        with self.__lock:
+            epoch = random.getrandbits(63)
+            head = 0
+            end_offset = 0
+            with open(self.__log_path + ".tmp", 'wb') as log_file, open(self.__index_path + ".tmp", 'wb') as index_file:
+                index_file.write(CHANGE_INDEX_HEADER.pack(CHANGE_INDEX_MAGIC, epoch))
+                for sequence, entry in enumerate(entries, start=1):
+                    line = self._encode(sequence, entry)
+                    log_file.write(line)
+                    end_offset += len(line)
+                    index_file.write(CHANGE_INDEX_ENTRY.pack(end_offset))
+                    head = sequence
+
+            os.replace(self.__log_path + ".tmp", self.__log_path)  # Readers detect the mismatch until both are replaced
+            os.replace(self.__index_path + ".tmp", self.__index_path)
+            self.__epoch = epoch
+            self.__head = head
+            self.__end_offset = end_offset
+
+    def append(self, entries):
+        """
+        Appends new ids to the change stream.
+
+        :param entries: list of dicts with id, state and key (None for ids without key pair) in applying order
+        :return: the position (sequence number) of the last record
+        """
+        with self.__lock:
+            self._load()
+            lines = [self._encode(self.__head + number, entry) for number, entry in enumerate(entries, start=1)]
+            if not lines:
+                return self.__head
+
+            offsets = []
+            end_offset = self.__end_offset
+            for line in lines:
+                end_offset += len(line)
+                offsets.append(CHANGE_INDEX_ENTRY.pack(end_offset))
+
+            with open(self.__log_path, 'r+b') as log_file:
+                log_file.truncate(self.__end_offset)  # Drop records torn by a crash, which have no index entry
+                log_file.seek(self.__end_offset)
+                log_file.write(b"".join(lines))
+            with open(self.__index_path, 'r+b') as index_file:
+                index_position = CHANGE_INDEX_HEADER.size + self.__head * CHANGE_INDEX_ENTRY.size
+                index_file.truncate(index_position)
+                index_file.seek(index_position)
+                index_file.write(b"".join(offsets))
+
+            self.__head += len(lines)
+            self.__end_offset = end_offset
+            return self.__head
+
+    def read(self, position, limit):
+        """
+        Reads records following a position. Works on files that are appended to concurrently (by another process).
+
+        :param position: the number of records already consumed (0 to read from the beginning)
+        :param limit: the maximum number of records to read
+        :return: tuple of the epoch, the head position and the list of records (dicts with seq, id, state, key,
+                 address and time); the list is empty if the change log is being reset at the moment
+        """
+        with open(self.__index_path, 'rb') as index_file:
+            magic, epoch = CHANGE_INDEX_HEADER.unpack(index_file.read(CHANGE_INDEX_HEADER.size))
+            if magic != CHANGE_INDEX_MAGIC:
+                raise Exception("Invalid change log index: " + self.__index_path)
+            index_file.seek(0, os.SEEK_END)
+            head = (index_file.tell() - CHANGE_INDEX_HEADER.size) // CHANGE_INDEX_ENTRY.size
+
+            count = max(0, min(limit, head - position))
+            if count == 0:
+                return epoch, head, []
+            first_entry = max(0, position - 1)  # The entry preceding the position holds the start offset
+            index_file.seek(CHANGE_INDEX_HEADER.size + first_entry * CHANGE_INDEX_ENTRY.size)
+            offsets = [CHANGE_INDEX_ENTRY.unpack(entry)[0]
+                       for entry in _split(index_file.read((position + count - first_entry) * CHANGE_INDEX_ENTRY.size))]
+        start_offset = offsets.pop(0) if position > 0 else 0
+
+        with open(self.__log_path, 'rb') as log_file:
+            log_file.seek(start_offset)
+            data = log_file.read(offsets[-1] - start_offset)
+        return epoch, head, self._parse(data, start_offset, offsets, position)
+
+    def get_epoch(self):
+        """
+        Getter: Get the epoch of the change stream.
+
+        :return: the epoch (as int)
+        """
+        with self.__lock:
+            self._load()
+            return self.__epoch
+
+    def get_head(self):
+        """
+        Getter: Get the position of the last record (the number of records).
+
+        :return: the head position
+        """
+        with self.__lock:
+            self._load()
+            return self.__head
+
+    def get_tail_ids(self, count):
+        """
+        Getter: Get the ids of the last records, e.g. to find ids whose changes were lost by a crash.
+
+        :param count: the maximum number of records
+        :return: set of ids
+        """
+        head = self.get_head()
+        _, _, records = self.read(max(0, head - count), count)
+        return {record["id"] for record in records}
+
+    def sync(self):
+        """
+        Flushes the change log to disk.
+        """
+        with self.__lock:
+            if self.exists():
+                fsync_path(self.__log_path)
+                fsync_path(self.__index_path)
+
+    def _load(self):
+        """
+        Reads the epoch, the head position and the end offset from the index. The caller must hold the lock.
+        Index entries of records that did not reach the log (torn by a crash) are ignored.
+        """
+        if self.__epoch is not None:
+            return
+
+        with open(self.__index_path, 'rb') as index_file:
+            magic, epoch = CHANGE_INDEX_HEADER.unpack(index_file.read(CHANGE_INDEX_HEADER.size))
+            if magic != CHANGE_INDEX_MAGIC:
+                raise Exception("Invalid change log index: " + self.__index_path)
+            offsets = [CHANGE_INDEX_ENTRY.unpack(entry)[0] for entry in _split(index_file.read())]
+
+        log_size = os.path.getsize(self.__log_path)
+        while offsets and offsets[-1] > log_size:
+            offsets.pop()
+        self.__epoch = epoch
+        self.__head = len(offsets)
+        self.__end_offset = offsets[-1] if offsets else 0
+
+    @staticmethod
+    def _encode(sequence, entry):
+        """
+        Converts an entry to a log line of the change stream.
+
+        :param sequence: the sequence number of the record
+        :param entry: dict with id, state and key
+        :return: the log line as bytes
+        """
+        address = None
+        if entry["key"] is not None:
+            x, y = entry["key"].split(",")
+            address = PublicKey(None, entry["id"], int(x), int(y)).address
+        return encode_log_line({"seq": sequence, "id": entry["id"], "state": entry["state"], "key": entry["key"],
+                                "address": address, "time": time.time()}).encode()
+
+    @staticmethod
+    def _parse(data, start_offset, offsets, position):
+        """
+        Splits read log data into records.
+
+        :param data: the log data starting at start_offset
+        :param start_offset: the offset of the data in the log
+        :param offsets: the end offsets of the records
+        :param position: the position preceding the first record
+        :return: list of records, cut at the first one that is torn or out of sequence (log being reset)
+        """
+        records = []
+        begin = 0
+        for sequence, end_offset in enumerate(offsets, start=position + 1):
+            end = end_offset - start_offset
+            record = decode_log_line(data[begin:end].decode())
+            if record is None or record["seq"] != sequence:
+                return []
+            records.append(record)
+            begin = end
+        return records
+
+
+def _split(data):
+    return [data[index:index + CHANGE_INDEX_ENTRY.size]
+            for index in range(0, len(data) - len(data) % CHANGE_INDEX_ENTRY.size, CHANGE_INDEX_ENTRY.size)]
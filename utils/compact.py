@@ -0,0 +1,206 @@
+# Author: Leandro Rometsch, 2021
+# Email: leandro@rometsch.org
+# TU Darmstadt, Chair of Applied Cryptography
+
+import os
+import struct
+
+COMPACT_MAGIC = b"TUDWKS01"
+COMPACT_HEADER = struct.Struct(">8sQQQ")  # magic, generation, record count, segment count (first segment only)
+COMPACT_RECORD = struct.Struct(">Q64s")  # id, x and y coordinate (32 bytes each)
+RETIRED_GENERATION = 2 ** 64 - 1  # Marks a file that has been replaced by a rebuilt one
+
+
+def get_segment_path(path, segment):
+    """
+    Getter: Get the path of a segment of a compact keystore. The first segment is the compact keystore file itself.
+
+    :param path: the path of the compact keystore file
+    :param segment: the segment number
+    :return: the file path of the segment
+    """
+    return path if segment == 0 else path + "." + str(segment)
+
+
+class CompactKeyFile:
+    """Writer of the compact public keystore file, which is intended to be memory-mapped by read-only wallet views.
+    The file starts with a header (magic, generation, record count) followed by fixed size records (id, x, y) in
+    ascending id order. Records are written before the header is updated, so readers only ever see complete records.
+    Every change increments the generation, which allows readers to notice new derivations cheaply.
+    A keystore may be split into segments (e.g. one per derivation lane), each a compact keystore file of its own
+    covering a range of ids above the ones of the previous segment; the first file publishes the segment count.
+    The file only mirrors the keystore and can always be rebuilt from it, therefore it is not synced to disk."""
+
+    def __init__(self, path):
+        """
+        Instantiate the writer. The file itself is created by rebuild().
+
+        :param path: the path of the compact keystore file
+        """
+        self.__path = path
+
+    def exists(self):
+        """
+        Check if the compact keystore file exists.
+
+        :return: True if the file exists, False if not
+        """
+        return os.path.exists(self.__path)
+
+    def get_path(self):
+        """
+        Getter: Get the path of the compact keystore file.
+
+        :return: the file path
+        """
+        return self.__path
+
+    def rebuild(self, entries, segment_count=1):
+        """
+        Writes a new compact keystore file containing the given entries and atomically replaces the existing one.
+        The replaced file is marked as retired afterwards, so readers that mapped it switch to the new file.
+
+        :param entries: iterable of (id, coordinates as 64 raw bytes) tuples in ascending id order
+        :param segment_count: the number of segments of the keystore (only stored by the first segment)
+        """
+        generation = 0
+        old_header = self._read_header()
+        if old_header is not None and old_header[1] != RETIRED_GENERATION:
+            generation = old_header[1] + 1
+
+        temporary_path = self.__path + ".tmp"
+        count = 0
+        last_id = -1
+        with open(temporary_path, 'wb') as compact_file:
+            compact_file.write(COMPACT_HEADER.pack(COMPACT_MAGIC, generation, 0, segment_count))
+            for id, coordinates in entries:
+                if id <= last_id:
+                    raise ValueError("Compact keystore entries must be in ascending id order.")
+                compact_file.write(COMPACT_RECORD.pack(id, coordinates))
+                last_id = id
+                count += 1
+            compact_file.seek(0)
+            compact_file.write(COMPACT_HEADER.pack(COMPACT_MAGIC, generation, count, segment_count))
+
+        # The replaced file is retired through a handle opened before the replace: readers that notice the mark
+        # already find the new file at the path
+        old_file = open(self.__path, 'r+b') if old_header is not None else None
+        try:
+            os.replace(temporary_path, self.__path)
+            if old_file is not None:
+                self._retire_file(old_file)
+        finally:
+            if old_file is not None:
+                old_file.close()
+
+    def retire(self):
+        """
+        Marks the compact keystore file as retired (before it is deleted), so readers release it once it is gone.
+        """
+        if self._read_header() is not None:
+            with open(self.__path, 'r+b') as compact_file:
+                self._retire_file(compact_file)
+
+    def append(self, entries):
+        """
+        Appends entries to the compact keystore file and publishes them by updating the header.
+
+        :param entries: list of (id, coordinates as 64 raw bytes) tuples with ids higher than all present ones
+        """
+        if not entries:
+            return
+
+        with open(self.__path, 'r+b') as compact_file:
+            magic, generation, count, segment_count = COMPACT_HEADER.unpack(compact_file.read(COMPACT_HEADER.size))
+            if magic != COMPACT_MAGIC:
+                raise Exception("Invalid compact keystore file: " + self.__path)
+
+            last_id = self._get_last_id(compact_file, count)
+            records = bytearray()
+            for id, coordinates in entries:
+                if id <= last_id:
+                    raise ValueError("Compact keystore entries must be in ascending id order.")
+                records += COMPACT_RECORD.pack(id, coordinates)
+                last_id = id
+
+            # Overwrite everything behind the last published record (e.g. leftovers of a crash)
+            compact_file.seek(COMPACT_HEADER.size + count * COMPACT_RECORD.size)
+            compact_file.write(records)
+            compact_file.flush()
+
+            compact_file.seek(0)
+            compact_file.write(COMPACT_HEADER.pack(COMPACT_MAGIC, generation + 1, count + len(entries), segment_count))
+
+    def get_segment_count(self):
+        """
+        Getter: Get the number of segments of the keystore (stored by the first segment).
+
+        :return: the segment count (1 for files written before keystores were split into segments)
+        """
+        header = self._read_header()
+        return 1 if header is None else max(header[3], 1)
+
+    def set_segment_count(self, segment_count):
+        """
+        Publishes a new number of segments (first segment only). Readers open the added segments, so their files have
+        to be written before.
+
+        :param segment_count: the number of segments of the keystore
+        """
+        with open(self.__path, 'r+b') as compact_file:
+            magic, generation, count, _ = COMPACT_HEADER.unpack(compact_file.read(COMPACT_HEADER.size))
+            if magic != COMPACT_MAGIC:
+                raise Exception("Invalid compact keystore file: " + self.__path)
+            compact_file.seek(0)
+            compact_file.write(COMPACT_HEADER.pack(COMPACT_MAGIC, generation + 1, count, segment_count))
+
+    def get_last_id(self):
+        """
+        Getter: Get the highest id present in the compact keystore file.
+
+        :return: the highest id (-1 if the file is empty or does not exist)
+        """
+        if not self.exists():
+            return -1
+        with open(self.__path, 'rb') as compact_file:
+            _, _, count, _ = COMPACT_HEADER.unpack(compact_file.read(COMPACT_HEADER.size))
+            return self._get_last_id(compact_file, count)
+
+    def _read_header(self):
+        """
+        Reads the header of the compact keystore file.
+
+        :return: tuple of magic, generation, record count and segment count (None if there is no valid file)
+        """
+        if not self.exists():
+            return None
+        with open(self.__path, 'rb') as compact_file:
+            data = compact_file.read(COMPACT_HEADER.size)
+        if len(data) < COMPACT_HEADER.size or data[:len(COMPACT_MAGIC)] != COMPACT_MAGIC:
+            return None
+        return COMPACT_HEADER.unpack(data)
+
+    @staticmethod
+    def _retire_file(compact_file):
+        """
+        Overwrites the generation in the header of an opened compact keystore file with the retired mark.
+
+        :param compact_file: the opened compact keystore file
+        """
+        magic, _, count, segment_count = COMPACT_HEADER.unpack(compact_file.read(COMPACT_HEADER.size))
+        compact_file.seek(0)
+        compact_file.write(COMPACT_HEADER.pack(magic, RETIRED_GENERATION, count, segment_count))
+
+    @staticmethod
+    def _get_last_id(compact_file, count):
+        """
+        Reads the id of the last published record.
+
+        :param compact_file: the opened compact keystore file
+        :param count: the number of published records
+        :return: the highest id (-1 if there are no records)
+        """
+        if count == 0:
+            return -1
+        compact_file.seek(COMPACT_HEADER.size + (count - 1) * COMPACT_RECORD.size)
+        return COMPACT_RECORD.unpack(compact_file.read(COMPACT_RECORD.size))[0]
@@ -0,0 +1,120 @@
+# Author: Leandro Rometsch, 2021
+# Email: leandro@rometsch.org
+# TU Darmstadt, Chair of Applied Cryptography
+
+import hashlib
+
+from .secp256k1 import FixedBaseTable
+
+ENGINE_JAVA = "java"  # Derive session public keys with the java implementation (via JPype)
+ENGINE_PYTHON = "python"  # Derive session public keys in Python, no JVM needed
+DERIVATION_ENGINES = (ENGINE_JAVA, ENGINE_PYTHON)
+
+OMEGA_SIZE = 16  # Bytes of the rerandomization factor taken from the hash
+STATE_SIZE = 16  # Bytes of a state
+
+_process_engines = {}  # master public key -> PythonDerivationEngine (used by derive_public_key_chain())
+
+
+def state_to_bytes(state) -> bytes:
+    """
+    Converts a state as stored in the state file (list of signed java bytes) to raw bytes.
+
+    :param state: the state as list of ints (-128 to 127)
+    :return: the state as raw bytes
+    """
+    return bytes(value & 0xFF for value in state)
+
+
+def state_from_bytes(state: bytes):
+    """
+    Converts raw state bytes to the representation stored in the state file (list of signed java bytes).
+
+    :param state: the state as raw bytes
+    :return: the state as list of ints (-128 to 127)
+    """
+    return [value - 256 if value > 127 else value for value in state]
+
+
+def derive_omega_and_state(id, state: bytes):
+    """
+    Computes the rerandomization factor and the next state for an id, identical to the java implementation:
+    SHA-256(id as decimal string || state) is split into omega (first half) and the next state (second half).
+
+    :param id: the id (as int or str)
+    :param state: the current state as raw bytes
+    :return: tuple of omega (as int) and the next state as raw bytes
+    """
+    digest = hashlib.sha256(str(id).encode() + state).digest()
+    return int.from_bytes(digest[:OMEGA_SIZE], "big"), digest[OMEGA_SIZE:OMEGA_SIZE + STATE_SIZE]
+
+
+def derive_lane_state(anchor_id, master_state):
+    """
+    Computes the initial state of a derivation lane: the state a derivation of the lane's anchor id from the master
+    state (state of id 0) results in. As the state of the anchor id is stored like any other state, the cold wallet
+    derives the secret keys of a lane without knowing about lanes.
+
+    :param anchor_id: the anchor id of the lane (as int)
+    :param master_state: the state of id 0 (as stored in the state file)
+    :return: the initial state of the lane (as stored in the state file)
+    """
+    return state_from_bytes(derive_omega_and_state(anchor_id, state_to_bytes(master_state))[1])
+
+
+def derive_public_key_chain(master_public_key, state, ids):
+    """
+    Derives a chain of session public keys with the Python engine, each state chained from the previous id.
+    Intended to be run in worker processes (one per derivation lane); the engine is kept per process and master key.
+
+    :param master_public_key: the master public key as (x, y) tuple of ints
+    :param state: the state of the id preceding the first id (as stored in the state file)
+    :param ids: the ascending ids (as int)
+    :return: list of (id, session public key as (x, y) tuple of ints, next state) tuples
+    """
+    master_public_key = tuple(master_public_key)
+    engine = _process_engines.get(master_public_key)
+    if engine is None:
+        engine = PythonDerivationEngine(master_public_key)
+        _process_engines.clear()
+        _process_engines[master_public_key] = engine
+
+    chain = []
+    for id in ids:
+        public_key, state = engine.pk_derive(id, state)
+        chain.append((id, public_key, state))
+    return chain
+
+
+class PythonDerivationEngine:
+    """Session public key derivation in pure Python, giving the same keys and states as the java implementation.
+    Session public keys are multiples (by omega) of the master public key, so all multiples of the master public key
+    needed for the 128 bit omegas are precomputed once per engine."""
+
+    def __init__(self, master_public_key):
+        """
+        Instantiate the engine for a master public key. Precomputing its multiples takes a few milliseconds.
+
+        :param master_public_key: the master public key as (x, y) tuple of ints
+        """
+        self.__master_public_key = tuple(master_public_key)
+        self.__table = FixedBaseTable(self.__master_public_key, scalar_bits=8 * OMEGA_SIZE)
+
+    def get_master_public_key(self):
+        """
+        Getter: Get the master public key the engine derives from.
+
+        :return: the master public key as (x, y) tuple of ints
+        """
+        return self.__master_public_key
+
+    def pk_derive(self, id, state):
+        """
+        Derives a new session public key based on the given parameters.
+
+        :param id: specifies the id (as int or str)
+        :param state: specifies the current state (as stored in the state file)
+        :return: tuple of the session public key as (x, y) tuple of ints and the next state (as in the state file)
+        """
+        omega, next_state = derive_omega_and_state(id, state_to_bytes(state))
+        return self.__table.multiply(omega), state_from_bytes(next_state)
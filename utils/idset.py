@@ -0,0 +1,255 @@
+# Author: Leandro Rometsch, 2021
+# Email: leandro@rometsch.org
+# TU Darmstadt, Chair of Applied Cryptography
+
+import bisect
+import os
+import struct
+import sys
+import threading
+from array import array
+
+from .support import get_dict_from_file
+
+ID_INDEX_MAGIC = b"TUDWIDS1"
+ID_INDEX_HEADER = struct.Struct(">8sQQQQ")  # magic, state file inode, mtime (ns) and size, run count
+
+
+class IdSet:
+    """A run-length encoded set of ids. Consecutive ids are stored as one run [start, end), so a wallet that derives
+    its ids one after another needs a single run no matter how many keys exist, while sparse (user chosen) ids cost
+    16 bytes each. Membership is a binary search over the runs, the maximum is the end of the last run."""
+    __slots__ = ("_starts", "_ends", "_count")
+
+    def __init__(self, ids=()):
+        """
+        Instantiate an id set.
+
+        :param ids: iterable of ids (as int) the set initially contains
+        """
+        self._starts = array('Q')
+        self._ends = array('Q')
+        self._count = 0
+        self.add_many(ids)
+
+    def add(self, id: int):
+        """
+        Add an id to the set.
+
+        :param id: the id (as int)
+        """
+        index = bisect.bisect_right(self._starts, id) - 1  # Run starting at or before the id
+        if index >= 0 and id < self._ends[index]:
+            return  # Already present
+
+        joins_left = index >= 0 and self._ends[index] == id
+        joins_right = index + 1 < len(self._starts) and self._starts[index + 1] == id + 1
+        if joins_left and joins_right:  # Closes the gap between two runs
+            self._ends[index] = self._ends[index + 1]
+            del self._starts[index + 1]
+            del self._ends[index + 1]
+        elif joins_left:
+            self._ends[index] = id + 1
+        elif joins_right:
+            self._starts[index + 1] = id
+        else:
+            self._starts.insert(index + 1, id)
+            self._ends.insert(index + 1, id + 1)
+        self._count += 1
+
+    def add_many(self, ids):
+        """
+        Add several ids to the set.
+
+        :param ids: iterable of ids (as int)
+        """
+        for id in ids:
+            self.add(id)
+
+    def get_max(self):
+        """
+        Getter: Get the highest id of the set.
+
+        :return: the highest id or None if the set is empty
+        """
+        return self._ends[-1] - 1 if self._ends else None
+
+    def get_max_below(self, bound: int):
+        """
+        Getter: Get the highest id of the set that is lower than the given bound.
+
+        :param bound: the (exclusive) upper bound
+        :return: the highest id below the bound or None if there is none
+        """
+        index = bisect.bisect_left(self._starts, bound) - 1  # Last run starting below the bound
+        if index < 0:
+            return None
+        return min(self._ends[index], bound) - 1
+
+    def get_run_count(self):
+        """
+        Getter: Get the number of runs (ranges of consecutive ids) the set consists of.
+
+        :return: the number of runs
+        """
+        return len(self._starts)
+
+    def to_bytes(self) -> bytes:
+        """
+        Serializes the runs of the set.
+
+        :return: the runs as raw bytes (start and end of every run as big endian 64 bit integers)
+        """
+        runs = array('Q', (value for run in zip(self._starts, self._ends) for value in run))
+        if sys.byteorder == "little":
+            runs.byteswap()
+        return runs.tobytes()
+
+    @classmethod
+    def from_bytes(cls, data: bytes):
+        """
+        Deserializes an id set created by to_bytes().
+
+        :param data: the runs as raw bytes
+        :return: the id set
+        """
+        runs = array('Q')
+        runs.frombytes(data)
+        if sys.byteorder == "little":
+            runs.byteswap()
+
+        id_set = cls()
+        id_set._starts = runs[0::2]
+        id_set._ends = runs[1::2]
+        id_set._count = sum(end - start for start, end in zip(id_set._starts, id_set._ends))
+        return id_set
+
+    def __contains__(self, id):
+        index = bisect.bisect_right(self._starts, id) - 1
+        return index >= 0 and id < self._ends[index]
+
+    def __len__(self):
+        return self._count
+
+    def __iter__(self):
+        for start, end in zip(self._starts, self._ends):
+            yield from range(start, end)
+
+    def __repr__(self):
+        return "IdSet(%d ids in %d runs)" % (self._count, len(self._starts))
+
+
+class IdIndex:
+    """Persistent id set of a state file (the ids are the keys of the state file).
+    The index file records which version of the state file (inode, modification time and size) it belongs to. As the
+    state file is always replaced atomically, a changed state file is detected by one stat() call and the index is
+    rebuilt from it. Otherwise the id set is loaded from the index file (or kept in memory) without parsing the
+    state. The index file is only written along with the state file, so read-only wallets are never modified."""
+
+    def __init__(self, state_path, index_path):
+        """
+        Instantiate the index. Nothing is read until the first query.
+
+        :param state_path: the path of the state file
+        :param index_path: the path of the index file
+        """
+        self.__state_path = state_path
+        self.__index_path = index_path
+        self.__id_set = None
+        self.__signature = None  # Version of the state file the in-memory id set belongs to
+        self.__lock = threading.RLock()
+
+    def get(self) -> IdSet:
+        """
+        Getter: Get the id set of the current state file.
+
+        :return: the id set (empty if there is no state file)
+        """
+        with self.__lock:
+            signature = self._get_state_signature()
+            if signature is None:
+                return IdSet()
+            if signature != self.__signature:
+                self.__id_set = self._load(signature)
+                if self.__id_set is None:  # Index missing or outdated: rebuild from the state file (in memory only)
+                    self.__id_set = IdSet(int(id) for id in get_dict_from_file(self.__state_path).keys())
+                self.__signature = signature
+            return self.__id_set
+
+    def add_many(self, ids):
+        """
+        Adds ids after they have been written to the state file. get() must have been called before the state file was
+        replaced (so the in-memory id set belongs to the previous version of the state file).
+
+        :param ids: the new ids (as int)
+        """
+        with self.__lock:
+            if self.__id_set is None:
+                self.get()
+                return
+            self.__id_set.add_many(ids)
+            self.__signature = self._get_state_signature()
+            self._save(self.__id_set, self.__signature, self.__index_path)
+
+    def save_for(self, state_path, index_path):
+        """
+        Writes the id set as index of a copy of the state file (e.g. the state transferred to the cold wallet).
+
+        :param state_path: the path of the copied state file
+        :param index_path: the path of the index file to be written
+        """
+        with self.__lock:
+            self._save(self.get(), self._get_state_signature(state_path), index_path)
+
+    def _get_state_signature(self, state_path=None):
+        """
+        Identifies the version of a state file.
+
+        :param state_path: the path of the state file (own state file if None)
+        :return: tuple of inode, modification time (ns) and size or None if the file does not exist
+        """
+        try:
+            stat = os.stat(self.__state_path if state_path is None else state_path)
+        except FileNotFoundError:
+            return None
+        return stat.st_ino, stat.st_mtime_ns, stat.st_size
+
+    def _load(self, signature):
+        """
+        Loads the id set from the index file if it belongs to the given version of the state file.
+
+        :param signature: the version of the state file
+        :return: the id set or None if the index file is missing or outdated
+        """
+        try:
+            with open(self.__index_path, 'rb') as index_file:
+                data = index_file.read()
+        except FileNotFoundError:
+            return None
+
+        if len(data) < ID_INDEX_HEADER.size:
+            return None
+        magic, inode, mtime, size, run_count = ID_INDEX_HEADER.unpack_from(data)
+        if magic != ID_INDEX_MAGIC or (inode, mtime, size) != signature:
+            return None
+        runs = data[ID_INDEX_HEADER.size:]
+        if len(runs) != run_count * 16:
+            return None
+        return IdSet.from_bytes(runs)
+
+    @staticmethod
+    def _save(id_set, signature, index_path):
+        """
+        Atomically writes an index file.
+
+        :param id_set: the id set
+        :param signature: the version of the state file the id set belongs to
+        :param index_path: the path of the index file
+        """
+        if signature is None:
+            return
+        temporary_path = index_path + "." + str(threading.get_ident()) + ".tmp"
+        with open(temporary_path, 'wb') as index_file:
+            index_file.write(ID_INDEX_HEADER.pack(ID_INDEX_MAGIC, *signature, id_set.get_run_count()))
+            index_file.write(id_set.to_bytes())
+        os.replace(temporary_path, index_path)
@@ -0,0 +1,227 @@
+# Author: Leandro Rometsch, 2021
+# Email: leandro@rometsch.org
+# TU Darmstadt, Chair of Applied Cryptography
+
+import functools
+import json
+import threading
+import time
+
+import jpype
+
+
+class CallSiteCounters:
+    """Counts the calls of the call sites that enter the JVM (via JPype) and their cumulative time, together with an
+    estimate of the Python to Java crossings. A call site is a place in the wrapper that calls into the JVM. The
+    crossings per call are not measured: every call site declares how many calls, constructions and conversions its
+    code performs (e.g. one Byte.decode per state byte), so the estimate is only as accurate as that declaration."""
+
+    def __init__(self):
+        """
+        Instantiate empty counters.
+        """
+        self.__sites = {}  # site -> [calls, estimated crossings, seconds]
+        self.__lock = threading.Lock()
+
+    def record(self, site, estimated_crossings=1, seconds=0.0):
+        """
+        Record one call of a call site.
+
+        :param site: the name of the call site
+        :param estimated_crossings: the number of Python to Java crossings the call site performs (declared, not
+                                    measured)
+        :param seconds: the duration of the call
+        """
+        with self.__lock:
+            counters = self.__sites.get(site)
+            if counters is None:
+                counters = self.__sites[site] = [0, 0, 0.0]
+            counters[0] += 1
+            counters[1] += estimated_crossings
+            counters[2] += seconds
+
+    def measure(self, site, estimated_crossings=1):
+        """
+        Measures the time of a block of code as one call of a call site:
+        `with counters.measure("site", estimated_crossings=3): ...`
+
+        :param site: the name of the call site
+        :param estimated_crossings: the number of Python to Java crossings the block performs (declared, not measured)
+        :return: the context manager
+        """
+        return _Measurement(self, site, estimated_crossings)
+
+    def get_snapshot(self):
+        """
+        Getter: Get the current counters of all call sites.
+
+        :return: dict mapping call sites to dicts with calls, estimated_crossings and seconds
+        """
+        with self.__lock:
+            return {site: {"calls": calls, "estimated_crossings": crossings, "seconds": seconds}
+                    for site, (calls, crossings, seconds) in sorted(self.__sites.items())}
+
+    def reset(self):
+        """
+        Reset all counters to zero.
+        """
+        with self.__lock:
+            self.__sites.clear()
+
+
+class _Measurement:
+    __slots__ = ("_counters", "_site", "_crossings", "_start")
+
+    def __init__(self, counters, site, crossings):
+        self._counters = counters
+        self._site = site
+        self._crossings = crossings
+
+    def __enter__(self):
+        self._start = time.perf_counter()
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self._counters.record(self._site, self._crossings, time.perf_counter() - self._start)
+
+
+JNI_COUNTERS = CallSiteCounters()  # Shared by all wallets of the process (there is only one JVM per process)
+
+
+def jni_call_site(site, estimated_crossings=1):
+    """
+    Decorator counting every call of a function as one call of a call site (see CallSiteCounters).
+
+    :param site: the name of the call site
+    :param estimated_crossings: the number of Python to Java crossings per call (declared, not measured)
+    :return: the decorator
+    """
+    def decorator(function):
+        @functools.wraps(function)
+        def wrapper(*args, **kwargs):
+            with JNI_COUNTERS.measure(site, estimated_crossings):
+                return function(*args, **kwargs)
+        return wrapper
+    return decorator
+
+
+def get_jvm_statistics():
+    """
+    Reads heap, garbage collection, class loading and thread statistics of the JVM from its JMX MXBeans.
+
+    :return: dict of the statistics or None if the JVM has not been started
+    """
+    if not jpype.isJVMStarted():
+        return None
+
+    management = jpype.JPackage("java").lang.management.ManagementFactory
+    memory = management.getMemoryMXBean()
+    statistics = {
+        "uptime_ms": int(management.getRuntimeMXBean().getUptime()),
+        "heap": _get_memory_usage(memory.getHeapMemoryUsage()),
+        "non_heap": _get_memory_usage(memory.getNonHeapMemoryUsage()),
+        "memory_pools": {},
+        "garbage_collectors": {},
+        "loaded_classes": int(management.getClassLoadingMXBean().getLoadedClassCount()),
+        "threads": int(management.getThreadMXBean().getThreadCount()),
+    }
+
+    for pool in management.getMemoryPoolMXBeans():
+        statistics["memory_pools"][str(pool.getName())] = dict(_get_memory_usage(pool.getUsage()),
+                                                               type=str(pool.getType().toString()))
+
+    for collector in management.getGarbageCollectorMXBeans():
+        collector_statistics = {"collections": int(collector.getCollectionCount()),
+                                "time_ms": int(collector.getCollectionTime())}  # Cumulative pause/collection time
+        try:  # HotSpot specific: duration of the last collection
+            last_collection = collector.getLastGcInfo()
+            if last_collection is not None:
+                collector_statistics["last_duration_ms"] = int(last_collection.getDuration())
+        except (AttributeError, jpype.JException):
+            pass
+        statistics["garbage_collectors"][str(collector.getName())] = collector_statistics
+    return statistics
+
+
+def get_jvm_metrics():
+    """
+    Collects the JVM statistics and the call site counters (incl. the estimated JNI crossings) of this process.
+
+    :return: dict containing a timestamp, "jvm" (None if the JVM has not been started) and "jni" (per call site)
+    """
+    return {"timestamp": time.time(), "jvm": get_jvm_statistics(), "jni": JNI_COUNTERS.get_snapshot()}
+
+
+class MetricsDumper:
+    """Appends the JVM metrics to a file periodically (one JSON object per line), e.g. to size the heap of a
+    long-running signer or to compare the call site counters of releases."""
+
+    def __init__(self, path, interval=60.0, metrics_function=get_jvm_metrics):
+        """
+        Instantiate a dumper. Nothing is written before start() is called.
+
+        :param path: the path of the file the metrics are appended to
+        :param interval: seconds between two dumps
+        :param metrics_function: function returning the metrics (JSON serializable) to be dumped
+        """
+        if interval <= 0:
+            raise ValueError("Metrics dump interval must be positive.")
+
+        self.__path = path
+        self.__interval = interval
+        self.__metrics_function = metrics_function
+        self.__stopped = threading.Event()
+        self.__thread = None
+
+    def start(self):
+        """
+        Start dumping in a background (daemon) thread. The first dump happens immediately.
+        """
+        if self.__thread is not None:
+            return
+        self.__stopped.clear()
+        self.__thread = threading.Thread(target=self._run, name="tudwallet-metrics", daemon=True)
+        self.__thread.start()
+
+    def stop(self):
+        """
+        Stop dumping. A last dump is written, so the file covers the whole runtime.
+        """
+        if self.__thread is None:
+            return
+        self.__stopped.set()
+        self.__thread.join()
+        self.__thread = None
+        self.dump()
+
+    def dump(self):
+        """
+        Append the current metrics to the file.
+        """
+        line = json.dumps(self.__metrics_function()) + "\n"
+        with open(self.__path, 'a') as metrics_file:
+            metrics_file.write(line)
+
+    def get_path(self):
+        """
+        Getter: Get the path of the file the metrics are appended to.
+
+        :return: the path
+        """
+        return self.__path
+
+    def _run(self):
+        self.dump()
+        while not self.__stopped.wait(self.__interval):
+            self.dump()
+
+
+def _get_memory_usage(usage):
+    """
+    Converts a java MemoryUsage.
+
+    :param usage: the MemoryUsage (java type/class)
+    :return: dict with init, used, committed and max in bytes (max is -1 if undefined)
+    """
+    return {"init": int(usage.getInit()), "used": int(usage.getUsed()), "committed": int(usage.getCommitted()),
+            "max": int(usage.getMax())}
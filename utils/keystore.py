@@ -0,0 +1,188 @@
+# Author: Leandro Rometsch, 2021
+# Email: leandro@rometsch.org
+# TU Darmstadt, Chair of Applied Cryptography
+
+import heapq
+import json
+import os
+
+from .wal import fsync_path
+
+SHARD_SIZE = 1024  # Number of consecutive ids that share one shard file
+SHARD_FILE_SUFFIX = ".key"
+ENTRY_SEPARATOR = ":"
+
+
+class KeyStore:
+    """An append-only keystore mapping ids to (string) keys.
+    The entries are spread over shard files holding SHARD_SIZE consecutive ids each. A lookup only reads the shard of
+    the requested id and only decodes the matching entry, a write appends a single line. Therefore, memory usage and
+    per-call latency do not grow with the number of stored keys."""
+
+    def __init__(self, directory, legacy_path=None):
+        """
+        Instantiate a keystore. The directory is created on the first write.
+
+        :param directory: the directory the shard files are stored in
+        :param legacy_path: optional path of a keystore written by save_dict_to_file(), which is used read-only for ids
+                            that are not present in the shards
+        """
+        self.__directory = directory
+        self.__legacy_path = legacy_path
+        self.__legacy_data = None
+        self.__legacy_signature = None
+        self.__unsynced_shards = set()
+
+    def get(self, id):
+        """
+        Look up the key stored for the given id.
+
+        :param id: the id (as int)
+        :return: the stored key as string or None if there is no key for this id
+        """
+        shard_path = self._get_shard_path(id)
+        prefix = str(id) + ENTRY_SEPARATOR
+
+        value = None
+        if os.path.exists(shard_path):
+            with open(shard_path, 'r') as shard_file:
+                for line in shard_file:
+                    # A later entry supersedes an earlier one. A line without line break was torn by a crash
+                    if line.startswith(prefix) and line.endswith('\n'):
+                        value = line[len(prefix):-1]
+
+        if value is None:
+            value = self._get_legacy_data().get(str(id))
+        return value
+
+    def put(self, id, value):
+        """
+        Append a key for the given id to the keystore.
+
+        :param id: the id (as int)
+        :param value: the key as string (must not contain line breaks)
+        """
+        self.put_many([(id, value)])
+
+    def put_many(self, entries):
+        """
+        Append several keys to the keystore at once. Each affected shard file is opened only once.
+
+        :param entries: iterable of (id, key) tuples
+        """
+        lines_by_shard = {}
+        for id, value in entries:
+            lines_by_shard.setdefault(self._get_shard_path(id), []).append(
+                str(id) + ENTRY_SEPARATOR + str(value) + '\n')
+
+        if not lines_by_shard:
+            return
+
+        if not os.path.exists(self.__directory):
+            os.makedirs(self.__directory)
+
+        for shard_path, lines in lines_by_shard.items():
+            with open(shard_path, 'ab+') as shard_file:
+                if shard_file.tell() > 0:
+                    shard_file.seek(-1, os.SEEK_END)
+                    if shard_file.read(1) != b'\n':  # Terminate a line torn by a crash, so it stays separated
+                        lines.insert(0, '\n')
+                shard_file.write(''.join(lines).encode())
+            self.__unsynced_shards.add(shard_path)
+
+    def sync(self):
+        """
+        Flushes all shard files written since the last sync to disk.
+        """
+        for shard_path in self.__unsynced_shards:
+            if os.path.exists(shard_path):
+                fsync_path(shard_path)
+        if self.__unsynced_shards and os.path.exists(self.__directory):
+            fsync_path(self.__directory)
+        self.__unsynced_shards = set()
+
+    def iterate(self, start_id=0):
+        """
+        Streams all stored entries in ascending id order, starting at the given id.
+        Only one shard is held in memory at a time.
+
+        :param start_id: the lowest id to be returned
+        :return: generator of (id, key) tuples
+        """
+        legacy_entries = sorted((int(id), value) for id, value in self._get_legacy_data().items()
+                                if int(id) >= start_id)
+
+        previous_id = None
+        for id, _, value in heapq.merge(((id, 0, value) for id, value in self._iterate_shards(start_id)),
+                                        ((id, 1, value) for id, value in legacy_entries)):
+            if id != previous_id:  # Shard entries (0) are merged before and supersede legacy entries (1)
+                yield id, value
+            previous_id = id
+
+    def __contains__(self, id):
+        return self.get(id) is not None
+
+    def get_directory(self):
+        """
+        Getter: Get the directory where the shard files are stored.
+
+        :return: the keystore directory
+        """
+        return self.__directory
+
+    def _get_shard_path(self, id):
+        """
+        Maps an id to the shard file responsible for it.
+
+        :param id: the id (as int)
+        :return: the path of the shard file
+        """
+        return os.path.join(self.__directory, str(int(id) // SHARD_SIZE) + SHARD_FILE_SUFFIX)
+
+    def _iterate_shards(self, start_id):
+        """
+        Streams the entries of all shard files in ascending id order, starting at the given id.
+
+        :param start_id: the lowest id to be returned
+        :return: generator of (id, key) tuples
+        """
+        if not os.path.exists(self.__directory):
+            return
+
+        shard_numbers = sorted(int(name[:-len(SHARD_FILE_SUFFIX)]) for name in os.listdir(self.__directory)
+                               if name.endswith(SHARD_FILE_SUFFIX))
+        for shard_number in shard_numbers:
+            if (shard_number + 1) * SHARD_SIZE <= start_id:
+                continue
+
+            shard = {}
+            with open(os.path.join(self.__directory, str(shard_number) + SHARD_FILE_SUFFIX), 'r') as shard_file:
+                for line in shard_file:
+                    if not line.endswith('\n'):  # Torn by a crash
+                        continue
+                    id, _, value = line[:-1].partition(ENTRY_SEPARATOR)
+                    if id:
+                        shard[int(id)] = value  # A later entry supersedes an earlier one
+
+            for id in sorted(shard.keys()):
+                if id >= start_id:
+                    yield id, shard[id]
+
+    def _get_legacy_data(self):
+        """
+        Loads the legacy keystore (if configured and present). The file is only parsed again if it has changed.
+
+        :return: the legacy keystore as dict (empty if not present)
+        """
+        if self.__legacy_path is None or not os.path.exists(self.__legacy_path):
+            self.__legacy_data = None
+            self.__legacy_signature = None
+            return {}
+
+        stat = os.stat(self.__legacy_path)
+        signature = (stat.st_mtime_ns, stat.st_size)
+        if signature != self.__legacy_signature:
+            with open(self.__legacy_path, 'r') as legacy_file:
+                self.__legacy_data = json.loads(legacy_file.readlines()[0])
+            self.__legacy_signature = signature
+        return self.__legacy_data
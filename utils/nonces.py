@@ -0,0 +1,73 @@
+# Author: Leandro Rometsch, 2021
+# Email: leandro@rometsch.org
+# TU Darmstadt, Chair of Applied Cryptography
+
+import os
+import threading
+
+from .support import get_dict_from_file, save_dict_to_file
+
+
+class NonceStore:
+    """Persistent next nonces of the accounts (keyed by id) of one chain. The nonces are held in memory; every update
+    replaces the file atomically and syncs it, so a crash leaves either the old or the new nonces behind."""
+
+    def __init__(self, path):
+        """
+        Instantiate a nonce store. The file is created on the first update.
+
+        :param path: the path of the nonce file
+        """
+        self.__path = path
+        self.__nonces = {}
+        if os.path.exists(path):
+            self.__nonces = {int(id): nonce for id, nonce in get_dict_from_file(path).items()}
+        self.__lock = threading.Lock()
+
+    def get(self, id):
+        """
+        Getter: Get the next nonce of an account.
+
+        :param id: the id (as int) of the account
+        :return: the next nonce or None if the account is unknown
+        """
+        with self.__lock:
+            return self.__nonces.get(id)
+
+    def get_all(self):
+        """
+        Getter: Get the next nonces of all known accounts.
+
+        :return: dict mapping ids to their next nonces
+        """
+        with self.__lock:
+            return dict(self.__nonces)
+
+    def update(self, nonces: dict):
+        """
+        Set the next nonces of accounts and persist them.
+
+        :param nonces: dict mapping ids (as int) to their next nonces
+        """
+        if not nonces:
+            return
+        for nonce in nonces.values():
+            if not isinstance(nonce, int) or nonce < 0:
+                raise ValueError("Nonces must be non-negative integers.")
+
+        with self.__lock:
+            updated_nonces = dict(self.__nonces)
+            updated_nonces.update(nonces)
+            save_dict_to_file(self.__path, {str(id): nonce for id, nonce in updated_nonces.items()}, fsync=True)
+            self.__nonces = updated_nonces
+
+    def get_path(self):
+        """
+        Getter: Get the path of the nonce file.
+
+        :return: the path
+        """
+        return self.__path
+
+    def __len__(self):
+        return len(self.__nonces)
@@ -0,0 +1,227 @@
+# Author: Leandro Rometsch, 2021
+# Email: leandro@rometsch.org
+# TU Darmstadt, Chair of Applied Cryptography
+
+from array import array
+
+import eth_utils
+from eth_utils import keccak
+
+KEY_SIZE = 32  # Bytes of a secret key or a public key coordinate
+ADDRESS_SIZE = 20  # Bytes of an ethereum address
+
+
+def to_key_bytes(value) -> bytes:
+    """
+    Converts a key or coordinate given as int, hex string or bytes to its raw 32 byte (big endian) representation.
+
+    :param value: the key or coordinate
+    :return: the raw 32 bytes
+    """
+    if isinstance(value, (bytes, bytearray)):
+        if len(value) != KEY_SIZE:
+            raise ValueError("Raw keys must be exactly " + str(KEY_SIZE) + " bytes long.")
+        return bytes(value)
+    if isinstance(value, str):
+        value = int(value, 16)
+    return value.to_bytes(KEY_SIZE, "big")
+
+
+def public_key_to_address(coordinates: bytes) -> bytes:
+    """
+    Generates the raw Ethereum address from the raw public key coordinates.
+
+    :param coordinates: the x and y coordinate as 64 raw bytes
+    :return: the address as 20 raw bytes
+    """
+    return keccak(coordinates)[-ADDRESS_SIZE:]
+
+
+class PublicKey:
+    """This record wraps all information regarding a derived public key.
+    It includes its ethereum address, its id and the public key coordinates.
+    The coordinates are held as raw bytes; the address and the hex strings are computed on access."""
+    __slots__ = ("id", "_coordinates", "_address")
+
+    def __init__(self, address, id: int, x, y):
+        """
+        Instantiate a public key record.
+
+        :param address: the ethereum address (checksum string or raw bytes) or None to derive it from the coordinates
+        :param id: the id used for deriving
+        :param x: x coordinate (int, hex string or 32 raw bytes)
+        :param y: y coordinate (int, hex string or 32 raw bytes)
+        """
+        self.id = id
+        self._coordinates = to_key_bytes(x) + to_key_bytes(y)
+        if isinstance(address, str):
+            address = bytes.fromhex(address[2:])
+        self._address = address
+
+    @classmethod
+    def from_coordinates(cls, id: int, coordinates: bytes):
+        """
+        Instantiate a public key record from raw coordinates.
+
+        :param id: the id used for deriving
+        :param coordinates: the x and y coordinate as 64 raw bytes
+        :return: the public key record
+        """
+        public_key = cls.__new__(cls)
+        public_key.id = id
+        public_key._coordinates = bytes(coordinates)
+        public_key._address = None
+        return public_key
+
+    @property
+    def x(self) -> str:
+        return hex(int.from_bytes(self._coordinates[:KEY_SIZE], "big"))
+
+    @property
+    def y(self) -> str:
+        return hex(int.from_bytes(self._coordinates[KEY_SIZE:], "big"))
+
+    @property
+    def address(self) -> str:
+        return eth_utils.to_checksum_address(self.address_bytes)
+
+    @property
+    def address_bytes(self) -> bytes:
+        if self._address is None:
+            self._address = public_key_to_address(self._coordinates)
+        return self._address
+
+    @property
+    def coordinates(self) -> bytes:
+        return self._coordinates
+
+    def __eq__(self, other):
+        if not isinstance(other, PublicKey):
+            return NotImplemented
+        return self.id == other.id and self._coordinates == other._coordinates
+
+    def __hash__(self):
+        return hash((self.id, self._coordinates))
+
+    def __repr__(self):
+        return "PublicKey(address=%r, id=%r, x=%r, y=%r)" % (self.address, self.id, self.x, self.y)
+
+
+class PrivateKey:
+    """This record wraps all information regarding a derived private key.
+    It includes the private key and the id used for deriving.
+    The key is held as raw bytes; its hex string (always 32 bytes long) is computed on access."""
+    __slots__ = ("id", "_key")
+
+    def __init__(self, key, id: int):
+        """
+        Instantiate a private key record.
+
+        :param key: the private key (int, hex string or 32 raw bytes)
+        :param id: the id used for deriving
+        """
+        self.id = id
+        self._key = to_key_bytes(key)
+
+    @property
+    def key(self) -> str:
+        return "0x" + self._key.hex()
+
+    @property
+    def key_bytes(self) -> bytes:
+        return self._key
+
+    def __eq__(self, other):
+        if not isinstance(other, PrivateKey):
+            return NotImplemented
+        return self.id == other.id and self._key == other._key
+
+    def __hash__(self):
+        return hash((self.id, self._key))
+
+    def __repr__(self):
+        return "PrivateKey(key=%r, id=%r)" % (self.key, self.id)
+
+
+class KeyTable:
+    """An array-backed table of public keys intended for bulk results.
+    Ids are stored in an array of unsigned 64 bit integers and the coordinates in one contiguous byte buffer, so a
+    table needs 72 bytes per key instead of several Python objects. Records are created on access only."""
+    __slots__ = ("_ids", "_coordinates")
+
+    RECORD_SIZE = 2 * KEY_SIZE
+
+    def __init__(self):
+        """
+        Instantiate an empty key table.
+        """
+        self._ids = array('Q')
+        self._coordinates = bytearray()
+
+    def append(self, id: int, x, y):
+        """
+        Append a public key to the table.
+
+        :param id: the id used for deriving
+        :param x: x coordinate (int, hex string or 32 raw bytes)
+        :param y: y coordinate (int, hex string or 32 raw bytes)
+        """
+        self._ids.append(id)
+        self._coordinates += to_key_bytes(x)
+        self._coordinates += to_key_bytes(y)
+
+    def append_coordinates(self, id: int, coordinates: bytes):
+        """
+        Append a public key given by its raw coordinates to the table.
+
+        :param id: the id used for deriving
+        :param coordinates: the x and y coordinate as 64 raw bytes
+        """
+        if len(coordinates) != self.RECORD_SIZE:
+            raise ValueError("Raw coordinates must be exactly " + str(self.RECORD_SIZE) + " bytes long.")
+        self._ids.append(id)
+        self._coordinates += coordinates
+
+    def get_ids(self):
+        """
+        Getter: Get the ids of all public keys in the table.
+
+        :return: the ids as array
+        """
+        return self._ids
+
+    def get_coordinates(self, index) -> bytes:
+        """
+        Getter: Get the raw coordinates of the public key at the given index.
+
+        :param index: position inside the table
+        :return: the x and y coordinate as 64 raw bytes
+        """
+        offset = index * self.RECORD_SIZE
+        return bytes(self._coordinates[offset:offset + self.RECORD_SIZE])
+
+    def addresses(self):
+        """
+        Computes the ethereum addresses of all public keys in the table.
+
+        :return: generator of (id, address) tuples
+        """
+        for index, id in enumerate(self._ids):
+            yield id, eth_utils.to_checksum_address(public_key_to_address(self.get_coordinates(index)))
+
+    def __len__(self):
+        return len(self._ids)
+
+    def __getitem__(self, index) -> PublicKey:
+        if index < 0:
+            index += len(self._ids)
+        if not 0 <= index < len(self._ids):
+            raise IndexError("KeyTable index out of range")
+        return PublicKey.from_coordinates(self._ids[index], self.get_coordinates(index))
+
+    def __iter__(self):
+        for index in range(len(self._ids)):
+            yield self[index]
+
+    def __repr__(self):
+        return "KeyTable(%d keys)" % len(self._ids)
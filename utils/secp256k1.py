@@ -0,0 +1,228 @@
+# Author: Leandro Rometsch, 2021
+# Email: leandro@rometsch.org
+# TU Darmstadt, Chair of Applied Cryptography
+
+# Curve parameters of secp256k1
+P = 0xFFFFFFFFFFFFFFFFFFFFFFFFFFFFFFFFFFFFFFFFFFFFFFFFFFFFFFFEFFFFFC2F
+N = 0xFFFFFFFFFFFFFFFFFFFFFFFFFFFFFFFEBAAEDCE6AF48A03BBFD25E8CD0364141
+G = (0x79BE667EF9DCBBAC55A06295CE870B07029BFCDB2DCE28D959F2815B16F81798,
+     0x483ADA7726A3C4655DA4FBFC0E1108A8FD17B448A68554199C47D08FFB10D4B8)
+
+INFINITY = None  # The point at infinity (affine representation)
+_JACOBIAN_INFINITY = (1, 1, 0)
+
+
+def is_on_curve(point) -> bool:
+    """
+    Check if a point lies on secp256k1.
+
+    :param point: the point as (x, y) tuple of ints
+    :return: True if the point is on the curve, False if not
+    """
+    if point is INFINITY:
+        return True
+    x, y = point
+    return (y * y - x * x * x - 7) % P == 0
+
+
+def point_add(first, second):
+    """
+    Adds two points.
+
+    :param first: the first point as (x, y) tuple of ints (or INFINITY)
+    :param second: the second point as (x, y) tuple of ints (or INFINITY)
+    :return: the sum as (x, y) tuple of ints (or INFINITY)
+    """
+    if first is INFINITY:
+        return second
+    return _to_affine(_add_mixed(_to_jacobian(first), second))
+
+
+def multiply(point, scalar: int):
+    """
+    Multiplies a point with a scalar (double and add). Use FixedBaseTable for repeated multiplications of one point.
+
+    :param point: the point as (x, y) tuple of ints
+    :param scalar: the scalar
+    :return: the product as (x, y) tuple of ints (or INFINITY)
+    """
+    scalar %= N
+    result = _JACOBIAN_INFINITY
+    for bit in bin(scalar)[2:]:
+        result = _double(result)
+        if bit == "1":
+            result = _add_mixed(result, point)
+    return _to_affine(result)
+
+
+class FixedBaseTable:
+    """Precomputed multiples of one fixed point for fast scalar multiplications (fixed-base comb).
+    The scalar is split into windows of `window` bits; for every window all multiples 1..2^window-1 of the point
+    (shifted to the window's position) are stored in affine coordinates. A multiplication then needs one addition
+    per window and no doublings at all."""
+
+    def __init__(self, point, scalar_bits=256, window=4):
+        """
+        Precompute the multiples of a point.
+
+        :param point: the fixed point as (x, y) tuple of ints
+        :param scalar_bits: maximum bit length of the scalars to be multiplied
+        :param window: number of scalar bits handled per table lookup
+        """
+        if not is_on_curve(point) or point is INFINITY:
+            raise ValueError("The fixed base point must be a point on secp256k1.")
+
+        self.__point = point
+        self.__scalar_bits = scalar_bits
+        self.__window = window
+        self.__mask = (1 << window) - 1
+
+        windows = (scalar_bits + window - 1) // window
+        jacobian_points = []
+        base = _to_jacobian(point)
+        for _ in range(windows):
+            multiple = base
+            jacobian_points.append(multiple)
+            for _ in range(self.__mask - 1):
+                multiple = _add(multiple, base)
+                jacobian_points.append(multiple)
+            for _ in range(window):
+                base = _double(base)
+
+        affine_points = _to_affine_many(jacobian_points)
+        self.__table = [[INFINITY] + affine_points[index * self.__mask:(index + 1) * self.__mask]
+                        for index in range(windows)]
+
+    def get_point(self):
+        """
+        Getter: Get the fixed point the table was built for.
+
+        :return: the point as (x, y) tuple of ints
+        """
+        return self.__point
+
+    def multiply(self, scalar: int):
+        """
+        Multiplies the fixed point with a scalar.
+
+        :param scalar: the scalar (0 <= scalar < 2^scalar_bits)
+        :return: the product as (x, y) tuple of ints (or INFINITY)
+        """
+        if not 0 <= scalar < 1 << self.__scalar_bits:
+            raise ValueError("Scalar must be between 0 and 2^" + str(self.__scalar_bits) + ".")
+
+        result = _JACOBIAN_INFINITY
+        window = 0
+        while scalar:
+            digit = scalar & self.__mask
+            if digit:
+                result = _add_mixed(result, self.__table[window][digit])
+            scalar >>= self.__window
+            window += 1
+        return _to_affine(result)
+
+
+def _to_jacobian(point):
+    return point[0], point[1], 1
+
+
+def _to_affine(point):
+    x, y, z = point
+    if z == 0:
+        return INFINITY
+    z_inverse = pow(z, P - 2, P)
+    z_inverse_squared = z_inverse * z_inverse % P
+    return x * z_inverse_squared % P, y * z_inverse_squared * z_inverse % P
+
+
+def _to_affine_many(points):
+    """
+    Converts many jacobian points (none at infinity) to affine coordinates with a single inversion (Montgomery's trick).
+
+    :param points: list of jacobian points
+    :return: list of affine points
+    """
+    products = []
+    product = 1
+    for _, _, z in points:
+        product = product * z % P
+        products.append(product)
+
+    inverse = pow(product, P - 2, P)
+    affine_points = [INFINITY] * len(points)
+    for index in range(len(points) - 1, -1, -1):
+        x, y, z = points[index]
+        z_inverse = inverse * products[index - 1] % P if index > 0 else inverse
+        inverse = inverse * z % P
+        z_inverse_squared = z_inverse * z_inverse % P
+        affine_points[index] = (x * z_inverse_squared % P, y * z_inverse_squared * z_inverse % P)
+    return affine_points
+
+
+def _double(point):
+    x, y, z = point
+    if y == 0 or z == 0:
+        return _JACOBIAN_INFINITY
+    y_squared = y * y % P
+    s = 4 * x * y_squared % P
+    m = 3 * x * x % P
+    new_x = (m * m - 2 * s) % P
+    new_y = (m * (s - new_x) - 8 * y_squared * y_squared) % P
+    return new_x, new_y, 2 * y * z % P
+
+
+def _add(first, second):
+    """
+    Adds two jacobian points.
+    """
+    x1, y1, z1 = first
+    x2, y2, z2 = second
+    if z1 == 0:
+        return second
+    if z2 == 0:
+        return first
+
+    z1_squared = z1 * z1 % P
+    z2_squared = z2 * z2 % P
+    u1 = x1 * z2_squared % P
+    u2 = x2 * z1_squared % P
+    s1 = y1 * z2_squared * z2 % P
+    s2 = y2 * z1_squared * z1 % P
+    if u1 == u2:
+        return _double(first) if s1 == s2 else _JACOBIAN_INFINITY
+
+    h = (u2 - u1) % P
+    r = (s2 - s1) % P
+    h_squared = h * h % P
+    h_cubed = h_squared * h % P
+    u1_h_squared = u1 * h_squared % P
+    new_x = (r * r - h_cubed - 2 * u1_h_squared) % P
+    new_y = (r * (u1_h_squared - new_x) - s1 * h_cubed) % P
+    return new_x, new_y, h * z1 * z2 % P
+
+
+def _add_mixed(first, second):
+    """
+    Adds a jacobian point and an affine point (cheaper than two jacobian points).
+    """
+    if second is INFINITY:
+        return first
+    x1, y1, z1 = first
+    x2, y2 = second
+    if z1 == 0:
+        return x2, y2, 1
+
+    z1_squared = z1 * z1 % P
+    u2 = x2 * z1_squared % P
+    s2 = y2 * z1_squared * z1 % P
+    if x1 == u2:
+        return _double(first) if y1 == s2 else _JACOBIAN_INFINITY
+
+    h = (u2 - x1) % P
+    r = (s2 - y1) % P
+    h_squared = h * h % P
+    h_cubed = h_squared * h % P
+    x1_h_squared = x1 * h_squared % P
+    new_x = (r * r - h_cubed - 2 * x1_h_squared) % P
+    new_y = (r * (x1_h_squared - new_x) - y1 * h_cubed) % P
+    return new_x, new_y, h * z1 % P
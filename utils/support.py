@@ -2,49 +2,72 @@
 # Email: leandro@rometsch.org
 # TU Darmstadt, Chair of Applied Cryptography
 
+import bisect
+import heapq
 import os
-from dataclasses import dataclass
+import threading
 
 import jpype
 import json
+from shutil import copyfile
 
-from .wrapper import create_elliptic_curve_point
+from .jvmmetrics import JNI_COUNTERS
+from .records import KeyTable, PrivateKey, PublicKey
+from .wrapper import create_elliptic_curve_point, start_jvm
 
 
-@dataclass
-class PublicKey:
-    """This dataclass wraps all information regarding a derived public key.
-    It includes its ethereum address, its id and the public key coordinates. """
-    address: str
-    id: int
-    x: str
-    y: str
-
-
-@dataclass
-class PrivateKey:
-    """This dataclass wraps all information regarding a derived private key.
-        It includes the private key and the id used for deriving."""
-    key: str
-    id: int
-
-
-def save_dict_to_file(path, data: dict):
+def save_dict_to_file(path, data: dict, fsync=False):
     """
     Allows to store any dictionary in a file under the given path.
     Note that all values are represented as string. E.g. if a key was 1, it is not "1"
+    The file is replaced atomically, so a crashing process never leaves a partially written file behind. After a power
+    failure the replaced file may be empty or partial unless fsync is set.
 
     :param path: the path where the dictionary should be stored at
     :param dict data: the state to be stored
+    :param fsync: flush the file to disk before replacing the old one
     """
-    with open(path, 'w') as txt_file:
+    temporary_path = path + ".tmp"
+    with open(temporary_path, 'w') as txt_file:
         json.dump(data, txt_file)
-        txt_file.close()
+        txt_file.flush()
+        if fsync:
+            os.fsync(txt_file.fileno())
+    os.replace(temporary_path, path)
+
+
+def append_dict_to_file(path, data: dict, fsync=False):
+    """
+    Appends updates to a dictionary stored via save_dict_to_file(), without rewriting the stored dictionary.
+    get_dict_from_file() applies the updates in order. An update torn by a crash is ignored when reading.
+
+    :param path: the path of the file (created by save_dict_to_file())
+    :param dict data: the entries to be added or replaced
+    :param fsync: flush the file to disk before returning
+    """
+    with open(path, 'a') as txt_file:
+        txt_file.write("\n" + json.dumps(data) + "\n")  # Starts on a new line even behind a torn update
+        txt_file.flush()
+        if fsync:
+            os.fsync(txt_file.fileno())
+
+
+def copy_file_atomically(source, destination):
+    """
+    Copies a file, so that readers of the destination see either the old or the new file but never a partial copy.
+
+    :param source: the path of the file to be copied
+    :param destination: the path the file should be copied to
+    """
+    temporary_path = destination + "." + str(threading.get_ident()) + ".tmp"  # Unique per (concurrent) copying thread
+    copyfile(source, temporary_path)
+    os.replace(temporary_path, destination)
 
 
 def get_dict_from_file(path) -> dict:
     """
     Allows to load any dictionary (that has been stored via save_dict_to_file()) from a file under the given path.
+    Updates appended by append_dict_to_file() are applied in order.
     Note that all values are represented as string. E.g. if a key was 1, it is not "1"
 
     :param path: the path where the file is located
@@ -52,7 +75,15 @@ def get_dict_from_file(path) -> dict:
     """
     with open(path, 'r') as txt_file:
         data = txt_file.readlines()
-        return json.loads(data[0])
+    result = json.loads(data[0])
+    for line in data[1:]:  # Updates appended by append_dict_to_file()
+        if not line.endswith("\n") or not line.strip():
+            continue
+        try:
+            result.update(json.loads(line))
+        except ValueError:  # Torn by a crash
+            continue
+    return result
 
 
 def get_private_key_from_file(path):
@@ -66,7 +97,9 @@ def get_private_key_from_file(path):
         data = key_file.readlines()[0]
         key_file.close()
 
-    data = jpype.java.math.BigInteger(data)
+    start_jvm()
+    with JNI_COUNTERS.measure("get_private_key_from_file"):  # BigInteger parsing
+        data = jpype.java.math.BigInteger(data)
     return data
 
 
@@ -85,6 +118,19 @@ def get_public_key_from_file(path):
     return data
 
 
+def get_public_key_coordinates_from_file(path):
+    """
+    Allows to load a public key from a file under the given path without the JVM.
+
+    :param path: the path where the public key is located
+    :return: the public key as (x, y) tuple of ints
+    """
+    with open(path, 'r') as key_file:
+        data = key_file.readlines()
+
+    return int(data[0]), int(data[1])
+
+
 def delete_files_in_folder(path):
     """
     Deletes everything inside a certain directory given as a path.
@@ -115,6 +161,23 @@ def find_second_highest_key_in_dict(data) -> str:
     if len(keys) <= 1:
         raise Exception("Only one or less keys in dictionary. There cannot be a second highest value.")
 
-    keys = [int(key) for key in keys]  # we expect the key to be in string format (due to dict loading/storing)
-    keys.sort(reverse=True)  # sort in reverse and take
-    return str(keys[1])  # and take second (highest) element. Convert back to string
+    # we expect the key to be in string format (due to dict loading/storing). No full sort needed for two elements
+    keys = heapq.nlargest(2, (int(key) for key in keys))
+    return str(keys[1])  # take second (highest) element. Convert back to string
+
+
+def find_preceding_id(sorted_ids, id) -> int:
+    """
+    Finds the highest id of a sorted list that is lower than the given id.
+    Intended to be used to find the state a session key has been derived from, which is the state of the id that was
+    the latest one when the session public key was derived.
+    Raises an exception if there is no lower id
+
+    :param sorted_ids: ascending list of ids (as int)
+    :param id: the id (as int)
+    :return: the preceding id
+    """
+    position = bisect.bisect_left(sorted_ids, id)
+    if position == 0:
+        raise Exception("There is no id lower than " + str(id) + ".")
+    return sorted_ids[position - 1]
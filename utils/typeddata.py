@@ -0,0 +1,314 @@
+# Author: Leandro Rometsch, 2021
+# Email: leandro@rometsch.org
+# TU Darmstadt, Chair of Applied Cryptography
+
+import re
+import threading
+from collections import OrderedDict
+
+from eth_account.messages import SignableMessage
+from eth_utils import keccak
+
+EIP712_DOMAIN_TYPE = "EIP712Domain"
+EIP712_DOMAIN_FIELDS = (("name", "string"), ("version", "string"), ("chainId", "uint256"),
+                        ("verifyingContract", "address"), ("salt", "bytes32"))  # Canonical order of domain fields
+
+_ARRAY_TYPE = re.compile(r"^(.+)\[(\d*)\]$")
+_INTEGER_TYPE = re.compile(r"^(u?)int(\d*)$")
+_FIXED_BYTES_TYPE = re.compile(r"^bytes(\d+)$")
+
+
+class TypedDataSchema:
+    """The structural part of EIP-712 typed data (the struct types), prepared once: the encoded type string and type
+    hash of every struct and an encoder for every field. Hashing a message with a prepared schema only encodes the
+    values."""
+
+    def __init__(self, types: dict):
+        """
+        Prepare a schema.
+
+        :param types: the struct types as in typed data: dict mapping struct names to lists of {"name", "type"} dicts
+        """
+        self.__fields = {name: [(field["name"], field["type"]) for field in fields] for name, fields in types.items()}
+        self.__type_hashes = {name: keccak(text=self.get_encoded_type(name)) for name in self.__fields}
+        self.__field_encoders = {}  # Filled on first use of a struct
+
+    def get_encoded_type(self, name):
+        """
+        Getter: Get the encoded type of a struct (the struct followed by all structs it references, sorted by name).
+
+        :param name: the name of the struct
+        :return: the encoded type, e.g. "Mail(Person from,Person to,string contents)Person(string name,address wallet)"
+        """
+        dependencies = set()
+        self._collect_dependencies(name, dependencies)
+        dependencies.discard(name)
+        return "".join(name + "(" + ",".join(field_type + " " + field_name
+                                             for field_name, field_type in self.__fields[name]) + ")"
+                       for name in [name] + sorted(dependencies))
+
+    def get_type_hash(self, name) -> bytes:
+        """
+        Getter: Get the type hash of a struct.
+
+        :param name: the name of the struct
+        :return: keccak256 of the encoded type
+        """
+        if name not in self.__type_hashes:
+            raise ValueError("Unknown struct type " + str(name) + ".")
+        return self.__type_hashes[name]
+
+    def get_primary_type(self):
+        """
+        Getter: Get the struct that is not referenced by any other struct (EIP712Domain excluded).
+
+        :return: the name of the primary type
+        """
+        referenced = {_get_base_type(field_type) for name, fields in self.__fields.items()
+                      for _, field_type in fields if name != EIP712_DOMAIN_TYPE}
+        candidates = [name for name in self.__fields if name != EIP712_DOMAIN_TYPE and name not in referenced]
+        if len(candidates) != 1:
+            raise ValueError("Primary type is ambiguous, please specify primaryType.")
+        return candidates[0]
+
+    def hash_struct(self, name, value: dict) -> bytes:
+        """
+        Computes the EIP-712 hashStruct of a value.
+
+        :param name: the name of the struct
+        :param value: the value as dict mapping field names to their values
+        :return: keccak256(typeHash || encodeData(value))
+        """
+        encoders = self.__field_encoders.get(name)
+        if encoders is None:
+            if name not in self.__fields:
+                raise ValueError("Unknown struct type " + str(name) + ".")
+            encoders = [(field_name, self._create_encoder(field_type))
+                        for field_name, field_type in self.__fields[name]]
+            self.__field_encoders[name] = encoders
+
+        try:
+            data = b"".join(encoder(value[field_name]) for field_name, encoder in encoders)
+        except KeyError as error:
+            raise ValueError("Field " + str(error) + " of struct " + name + " is missing.")
+        return keccak(self.__type_hashes[name] + data)
+
+    def _collect_dependencies(self, name, dependencies):
+        """
+        Collects all structs (recursively) referenced by a struct, including the struct itself.
+
+        :param name: the name of the struct
+        :param dependencies: set the names are added to
+        """
+        if name in dependencies:
+            return
+        if name not in self.__fields:
+            raise ValueError("Unknown struct type " + str(name) + ".")
+        dependencies.add(name)
+        for _, field_type in self.__fields[name]:
+            base_type = _get_base_type(field_type)
+            if base_type in self.__fields:
+                self._collect_dependencies(base_type, dependencies)
+
+    def _create_encoder(self, field_type):
+        """
+        Creates the function encoding values of a field type to 32 bytes (encodeData of EIP-712).
+
+        :param field_type: the type of the field, e.g. "uint256", "Person" or "bytes32[]"
+        :return: the encoder function
+        """
+        array = _ARRAY_TYPE.match(field_type)
+        if array is not None:
+            element_encoder = self._create_encoder(array.group(1))
+            length = int(array.group(2)) if array.group(2) else None
+
+            def encode_array(value):
+                if length is not None and len(value) != length:
+                    raise ValueError("Array of type " + field_type + " must have " + str(length) + " elements.")
+                return keccak(b"".join(element_encoder(element) for element in value))
+            return encode_array
+
+        if field_type in self.__fields:
+            return lambda value: self.hash_struct(field_type, value)
+        if field_type == "string":
+            return lambda value: keccak(text=value)
+        if field_type == "bytes":
+            return lambda value: keccak(_to_bytes(value))
+        if field_type == "bool":
+            return lambda value: (1 if value else 0).to_bytes(32, "big")
+        if field_type == "address":
+            return _encode_address
+
+        integer = _INTEGER_TYPE.match(field_type)
+        if integer is not None:
+            bits = int(integer.group(2) or 256)
+            if integer.group(1):
+                return lambda value: _encode_integer(value, 0, 1 << bits)
+            return lambda value: _encode_integer(value, -(1 << (bits - 1)), 1 << (bits - 1))
+
+        fixed_bytes = _FIXED_BYTES_TYPE.match(field_type)
+        if fixed_bytes is not None and 1 <= int(fixed_bytes.group(1)) <= 32:
+            size = int(fixed_bytes.group(1))
+            return lambda value: _encode_fixed_bytes(value, size)
+
+        raise ValueError("Unsupported type " + field_type + ".")
+
+
+class TypedDataEncoder:
+    """Encodes EIP-712 typed data to signable messages. Typed data of the same schema (struct types) and domain shares
+    its structural hashing, so prepared schemas and domain separators are kept in bounded caches (least recently used
+    ones are evicted)."""
+
+    def __init__(self, max_size=256):
+        """
+        Instantiate an encoder.
+
+        :param max_size: maximum number of schemas and domain separators cached each (0 disables the caches)
+        """
+        if max_size < 0:
+            raise ValueError("Typed data cache size must not be negative.")
+
+        self.__max_size = max_size
+        self.__schemas = OrderedDict()  # Struct types (as tuple) -> TypedDataSchema
+        self.__domain_separators = OrderedDict()  # (Struct types of the domain, domain values) -> domain separator
+        self.__lock = threading.Lock()
+
+        self.hits = 0
+        self.misses = 0
+
+    def encode(self, typed_data: dict) -> SignableMessage:
+        """
+        Encodes typed data to a signable message (EIP-191 version 0x01).
+
+        :param typed_data: dict containing "types", "primaryType" (optional if unambiguous), "domain" and "message"
+        :return: the signable message
+        """
+        types = typed_data["types"]
+        domain = typed_data["domain"]
+        schema = self.get_schema(types)
+        primary_type = typed_data.get("primaryType") or schema.get_primary_type()
+        if primary_type == EIP712_DOMAIN_TYPE:
+            raise ValueError("The domain cannot be the primary type.")
+
+        return SignableMessage(b"\x01", self.get_domain_separator(domain, types.get(EIP712_DOMAIN_TYPE)),
+                               schema.hash_struct(primary_type, typed_data["message"]))
+
+    def get_schema(self, types: dict) -> TypedDataSchema:
+        """
+        Getter: Get the prepared schema of the given struct types (from cache if possible).
+
+        :param types: the struct types as in typed data
+        :return: the schema
+        """
+        key = tuple((name, tuple((field["name"], field["type"]) for field in fields))
+                    for name, fields in types.items() if name != EIP712_DOMAIN_TYPE)
+        return self._get_cached(self.__schemas, key, lambda: TypedDataSchema(dict(_key_to_types(key))))
+
+    def get_domain_separator(self, domain: dict, domain_fields=None) -> bytes:
+        """
+        Getter: Get the domain separator (hashStruct of the domain) from cache if possible.
+
+        :param domain: the domain values, e.g. name, version, chainId and verifyingContract
+        :param domain_fields: the EIP712Domain struct type (derived from the domain values in canonical order if None)
+        :return: the domain separator
+        """
+        if domain_fields is None:
+            domain_fields = [{"name": name, "type": field_type} for name, field_type in EIP712_DOMAIN_FIELDS
+                             if name in domain]
+        fields = tuple((field["name"], field["type"]) for field in domain_fields)
+        try:
+            key = (fields, tuple((name, domain[name]) for name, _ in fields))
+            hash(key)
+        except (KeyError, TypeError):  # Missing or unhashable domain values, encoded uncached to report the error
+            key = None
+
+        def compute():
+            types = {EIP712_DOMAIN_TYPE: [{"name": name, "type": field_type} for name, field_type in fields]}
+            return TypedDataSchema(types).hash_struct(EIP712_DOMAIN_TYPE, domain)
+        if key is None:
+            return compute()
+        return self._get_cached(self.__domain_separators, key, compute)
+
+    def get_statistics(self):
+        """
+        Learn how well the caches perform.
+
+        :return: dict containing hits, misses and the numbers of cached schemas and domain separators
+        """
+        with self.__lock:
+            return {"hits": self.hits, "misses": self.misses, "schemas": len(self.__schemas),
+                    "domain_separators": len(self.__domain_separators)}
+
+    def _get_cached(self, cache, key, compute):
+        """
+        Looks up a cache entry or computes (and caches) it.
+
+        :param cache: the cache (OrderedDict)
+        :param key: the key of the entry
+        :param compute: function computing the value on a miss
+        :return: the cached or computed value
+        """
+        with self.__lock:
+            value = cache.get(key)
+            if value is not None:
+                cache.move_to_end(key)
+                self.hits += 1
+                return value
+            self.misses += 1
+
+        value = compute()
+        if self.__max_size > 0:
+            with self.__lock:
+                cache[key] = value
+                while len(cache) > self.__max_size:
+                    cache.popitem(last=False)
+        return value
+
+
+def _key_to_types(key):
+    """
+    Converts struct types given as tuple (cache key of TypedDataEncoder) back to the typed data representation.
+
+    :param key: tuple of (name, tuple of (field name, field type)) tuples
+    :return: generator of (name, list of {"name", "type"} dicts) tuples
+    """
+    for name, fields in key:
+        yield name, [{"name": field_name, "type": field_type} for field_name, field_type in fields]
+
+
+def _get_base_type(field_type):
+    while True:
+        array = _ARRAY_TYPE.match(field_type)
+        if array is None:
+            return field_type
+        field_type = array.group(1)
+
+
+def _to_bytes(value) -> bytes:
+    if isinstance(value, (bytes, bytearray)):
+        return bytes(value)
+    if isinstance(value, str):
+        return bytes.fromhex(value[2:] if value.startswith(("0x", "0X")) else value)
+    raise ValueError("Value " + repr(value) + " cannot be encoded as bytes.")
+
+
+def _encode_integer(value, minimum, limit) -> bytes:
+    if isinstance(value, str):
+        value = int(value, 16) if value.startswith(("0x", "0X")) else int(value)
+    if isinstance(value, bool) or not isinstance(value, int) or not minimum <= value < limit:
+        raise ValueError("Value " + repr(value) + " is out of range.")
+    return (value % (1 << 256)).to_bytes(32, "big")
+
+
+def _encode_fixed_bytes(value, size) -> bytes:
+    data = _to_bytes(value)
+    if len(data) > size:
+        raise ValueError("Value " + repr(value) + " is longer than " + str(size) + " bytes.")
+    return data.ljust(32, b"\x00")
+
+
+def _encode_address(value) -> bytes:
+    data = _to_bytes(value)
+    if len(data) != 20:
+        raise ValueError("Value " + repr(value) + " is not an address.")
+    return data.rjust(32, b"\x00")
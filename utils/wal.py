@@ -0,0 +1,256 @@
+# Author: Leandro Rometsch, 2021
+# Email: leandro@rometsch.org
+# TU Darmstadt, Chair of Applied Cryptography
+
+import json
+import os
+import threading
+import time
+import zlib
+
+DURABILITY_STRICT = "strict"  # Every append is fsynced before it returns
+DURABILITY_GROUP = "group"  # Appends are fsynced together after an interval or a number of records
+DURABILITY_RELAXED = "relaxed"  # Appends are never fsynced, flushing is left to the operating system
+DURABILITY_MODES = (DURABILITY_STRICT, DURABILITY_GROUP, DURABILITY_RELAXED)
+
+
+def fsync_path(path):
+    """
+    Flushes a file (or directory) under the given path to disk.
+
+    :param path: the path of the file or directory
+    """
+    fd = os.open(path, os.O_RDONLY)
+    try:
+        os.fsync(fd)
+    finally:
+        os.close(fd)
+
+
+class WriteAheadLog:
+    """An append-only log of records (dicts) that are written before the actual keystore files are changed.
+    Each record is stored as one line with a checksum, so a record that was torn by a crash is recognized and ignored.
+    How and when the log is flushed to disk is chosen by the durability mode."""
+
+    def __init__(self, path, durability=DURABILITY_STRICT, group_commit_interval_ms=5, group_commit_records=64):
+        """
+        Instantiate a write-ahead log. The file is created on the first append.
+
+        :param path: the path of the log file
+        :param durability: one of DURABILITY_STRICT, DURABILITY_GROUP or DURABILITY_RELAXED
+        :param group_commit_interval_ms: (group mode) maximum time in ms an append stays unsynced
+        :param group_commit_records: (group mode) number of unsynced records that trigger a sync immediately
+        """
+        if durability not in DURABILITY_MODES:
+            raise ValueError("Unknown durability mode " + str(durability) + ". Use one of: " +
+                             ", ".join(DURABILITY_MODES))
+
+        self.__path = path
+        self.__durability = durability
+        self.__group_commit_interval = group_commit_interval_ms / 1000
+        self.__group_commit_records = group_commit_records
+
+        self.__lock = threading.RLock()
+        self.__condition = threading.Condition(self.__lock)  # Wakes the flusher thread
+        self.__pending_records = 0
+        self.__sync_deadline = None  # Time (monotonic) the oldest unsynced record has to be synced by
+        self.__flusher = None  # (thread, stop event) of the group commit flusher, started on first use
+        self.__record_count = None  # Determined on first use
+        self.sync_count = 0
+        self.directory_sync_count = 0
+
+    def append(self, records):
+        """
+        Append records to the log. All given records are written at once and share one sync.
+
+        :param records: list of JSON serializable dicts
+        """
+        lines = [self._encode(record) for record in records]
+        if not lines:
+            return
+
+        with self.__lock:
+            record_count = self.get_record_count()
+            created = not os.path.exists(self.__path)
+            with open(self.__path, 'a') as log_file:
+                log_file.writelines(lines)
+                log_file.flush()
+                if self.__durability == DURABILITY_STRICT:
+                    os.fsync(log_file.fileno())
+                    self.sync_count += 1
+            if created and self.__durability != DURABILITY_RELAXED:
+                self._sync_directory()  # Syncing the file does not persist its directory entry
+            self.__record_count = record_count + len(lines)
+
+            if self.__durability == DURABILITY_GROUP:
+                self.__pending_records += len(lines)
+                if self.__pending_records >= self.__group_commit_records:
+                    self._sync()
+                elif self.__sync_deadline is None:
+                    self.__sync_deadline = time.monotonic() + self.__group_commit_interval
+                    self._start_flusher()
+                    self.__condition.notify()
+
+    def flush(self):
+        """
+        Sync all records appended so far to disk (no-op in relaxed mode).
+        """
+        with self.__lock:
+            self._sync()
+
+    def read_records(self):
+        """
+        Read all intact records of the log. Reading stops at the first torn or corrupted record.
+
+        :return: list of the records (dicts) in order of appending
+        """
+        records = []
+        if not os.path.exists(self.__path):
+            return records
+
+        with open(self.__path, 'r') as log_file:
+            for line in log_file:
+                record = self._decode(line)
+                if record is None:
+                    break
+                records.append(record)
+        return records
+
+    def get_record_count(self):
+        """
+        Getter: Get the number of records currently in the log.
+
+        :return: the number of records
+        """
+        with self.__lock:
+            if self.__record_count is None:
+                self.__record_count = len(self.read_records())
+            return self.__record_count
+
+    def truncate(self):
+        """
+        Remove all records from the log. Intended to be used once all records are applied (and synced) elsewhere.
+        """
+        with self.__lock:
+            self.__sync_deadline = None
+            self.__pending_records = 0
+            self.__record_count = 0
+            if not os.path.exists(self.__path):
+                return
+
+            with open(self.__path, 'w') as log_file:
+                log_file.flush()
+                if self.__durability != DURABILITY_RELAXED:
+                    os.fsync(log_file.fileno())
+            if self.__durability != DURABILITY_RELAXED:
+                self._sync_directory()
+
+    def close(self):
+        """
+        Sync all pending records and stop the group commit flusher thread. Appending afterwards starts a new one.
+        """
+        with self.__lock:
+            self._sync()
+            flusher = self.__flusher
+            self.__flusher = None
+            if flusher is not None:
+                flusher[1].set()
+                self.__condition.notify_all()
+        if flusher is not None:
+            flusher[0].join()
+
+    def get_durability(self):
+        """
+        Getter: Get the durability mode of the log.
+
+        :return: the durability mode
+        """
+        return self.__durability
+
+    def _sync(self):
+        """
+        Syncs the log file if there are unsynced records. The caller must hold the lock.
+        """
+        self.__sync_deadline = None
+        if self.__pending_records == 0:
+            return
+
+        self.__pending_records = 0
+        if os.path.exists(self.__path):  # The log might have been deleted in the meantime (e.g. by an overwrite)
+            fsync_path(self.__path)
+            self.sync_count += 1
+
+    def _sync_directory(self):
+        """
+        Syncs the directory of the log file, so the directory entry of a (re-)created log survives a power failure.
+        """
+        fsync_path(os.path.dirname(os.path.abspath(self.__path)))
+        self.directory_sync_count += 1
+
+    def _start_flusher(self):
+        """
+        Starts the group commit flusher thread unless it is running. The caller must hold the lock.
+        """
+        if self.__flusher is not None:
+            return
+        stopped = threading.Event()
+        thread = threading.Thread(target=self._run_flusher, args=(stopped,), name="tudwallet-wal-flusher",
+                                  daemon=True)
+        self.__flusher = (thread, stopped)
+        thread.start()
+
+    def _run_flusher(self, stopped):
+        """
+        Group commit flusher: sleeps until the oldest unsynced record reaches its deadline and syncs the log.
+        One long-lived thread serves all commit intervals.
+
+        :param stopped: event telling the thread to exit
+        """
+        with self.__condition:
+            while not stopped.is_set():
+                if self.__sync_deadline is None:
+                    self.__condition.wait()
+                    continue
+                remaining = self.__sync_deadline - time.monotonic()
+                if remaining > 0:
+                    self.__condition.wait(remaining)
+                else:
+                    self._sync()
+
+    @staticmethod
+    def _encode(record):
+        return encode_log_line(record)
+
+    @staticmethod
+    def _decode(line):
+        return decode_log_line(line)
+
+
+def encode_log_line(record):
+    """
+    Converts a record to a log line consisting of a crc32 checksum and the JSON serialized record.
+
+    :param record: the record as dict
+    :return: the log line
+    """
+    payload = json.dumps(record, separators=(',', ':'))
+    return "%08x %s\n" % (zlib.crc32(payload.encode()), payload)
+
+
+def decode_log_line(line):
+    """
+    Converts a log line back to a record if it is intact.
+
+    :param line: the log line
+    :return: the record as dict or None if the line is torn or corrupted
+    """
+    if not line.endswith('\n') or len(line) < 10:
+        return None
+
+    checksum, payload = line[:8], line[9:-1]
+    try:
+        if int(checksum, 16) != zlib.crc32(payload.encode()):
+            return None
+        return json.loads(payload)
+    except ValueError:
+        return None
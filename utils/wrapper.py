@@ -6,34 +6,109 @@
 import jpype.imports
 from jpype import JString, JPackage, JArray
 
+from .jvmmetrics import JNI_COUNTERS, jni_call_site
+
 # Look for (relative path to) libs folder
+import os
 import pathlib
-libs = str(pathlib.Path(__file__).parent.resolve()).replace("tudwallet/utils", "tudwallet/libs/*")
+import threading
+libs_directory = str(pathlib.Path(__file__).parent.resolve()).replace("tudwallet/utils", "tudwallet/libs")
+libs = libs_directory + "/*"
+
+# Class data sharing archive of the jar (see tools/appcds.py), used by start_jvm() if present
+CDS_ARCHIVE_PATH = libs_directory + "/crypto-core.jsa"
+CDS_ARCHIVE_ENVIRONMENT_VARIABLE = "TUDWALLET_CDS_ARCHIVE"  # Overrides the archive path, empty to disable the archive
 
-# Start JVM with Java types on return
-jpype.startJVM("-ea", classpath=[libs], convertStrings=False)
+# The Java modules (imported by start_jvm())
+ColdWallet = None
+HotWallet = None
+SECP = None
+EllipticCurvePoint = None
+PublicKey = None
+FiniteFieldElementFactory = None
 
-# import the Java modules
-from com.ewallet.field import ColdWallet
-from com.ewallet.field import HotWallet
-from com.ewallet.field.util import SECP
-from com.ewallet.field.util import EllipticCurvePoint
-from com.ewallet.field.util import PublicKey
-from com.trident.crypto.field.element import FiniteFieldElementFactory
+
+def get_cds_archive_path():
+    """
+    Getter: Get the path of the class data sharing archive to be used when starting the JVM.
+
+    :return: the path or None if there is no archive (or it is disabled)
+    """
+    path = os.environ.get(CDS_ARCHIVE_ENVIRONMENT_VARIABLE, CDS_ARCHIVE_PATH)
+    if not path or not os.path.exists(path):
+        return None
+    return path
+
+
+def start_jvm(jvm_options=()):
+    """
+    Starts the JVM (with Java types on return) and imports the Java modules.
+    The JVM is only started on first use, so wallet components that do not need it (e.g. WalletView) never start it.
+    If a class data sharing archive exists (see tools/appcds.py), the JVM maps the pre-parsed classes from it instead
+    of loading them from the jar, which shortens the startup. An unusable archive (e.g. created by another java
+    version) is ignored. Calling this function again has no effect.
+
+    :param jvm_options: additional options passed to the JVM
+    """
+    global ColdWallet, HotWallet, SECP, EllipticCurvePoint, PublicKey, FiniteFieldElementFactory
+    if ColdWallet is not None:
+        return
+
+    if not jpype.isJVMStarted():
+        options = ["-ea"]
+        archive_path = get_cds_archive_path()
+        if archive_path is not None:
+            options += ["-XX:SharedArchiveFile=" + archive_path, "-Xshare:auto", "-Xlog:cds=off"]
+        jpype.startJVM(*options, *jvm_options, classpath=[libs], convertStrings=False)
+
+    # import the Java modules
+    from com.ewallet.field import ColdWallet
+    from com.ewallet.field import HotWallet
+    from com.ewallet.field.util import SECP
+    from com.ewallet.field.util import EllipticCurvePoint
+    from com.ewallet.field.util import PublicKey
+    from com.trident.crypto.field.element import FiniteFieldElementFactory
+
+
+class SynchronizedWrapper:
+    """Serializes all calls to a (java) cold or hot wallet wrapper, as the java wallet objects are not thread-safe.
+    Used to share one wrapper between wallets that may be used from different threads (e.g. by a WalletManager)."""
+
+    def __init__(self, wrapper):
+        """
+        Instantiate the synchronized wrapper.
+
+        :param wrapper: the ColdWalletWrapper or HotWalletWrapper whose calls are serialized
+        """
+        self.__wrapper = wrapper
+        self.__lock = threading.Lock()
+
+    def __getattr__(self, name):
+        attribute = getattr(self.__wrapper, name)
+        if not callable(attribute):
+            return attribute
+
+        def synchronized(*args, **kwargs):
+            with self.__lock:
+                return attribute(*args, **kwargs)
+        return synchronized
 
 
 class ColdWalletWrapper:
     """Wraps the underlying (java) cold wallet into python"""
 
-    def __init__(self, spec=SECP.SECP256K1, hash_algorithm="SHA-256"):
+    def __init__(self, spec=None, hash_algorithm="SHA-256"):
         """
         Instantiate an java cold wallet object.
 
-        :param spec: specifies the elliptic curve (SECP256K1 for Ethereum)
+        :param spec: specifies the elliptic curve (None for SECP256K1, used by Ethereum)
         :param hash_algorithm: specifies the hash function (SHA-256 for Ethereum)
         """
-        self.cold_wallet = ColdWallet(spec, hash_algorithm)
+        start_jvm()
+        with JNI_COUNTERS.measure("ColdWallet.<init>", estimated_crossings=2):  # SECP256K1 lookup and construction
+            self.cold_wallet = ColdWallet(SECP.SECP256K1 if spec is None else spec, hash_algorithm)
 
+    @jni_call_site("ColdWallet.MasterGen")
     def master_gen(self):
         """
         Generate a master key pair
@@ -42,6 +117,7 @@ class ColdWalletWrapper:
         """
         return self.cold_wallet.MasterGen()
 
+    @jni_call_site("ColdWallet.SKDerive")
     def sk_derive(self, master_sk, id, state):
         """
         Derives a new session secret key based on the given parameters
@@ -53,6 +129,7 @@ class ColdWalletWrapper:
         """
         return self.cold_wallet.SKDerive(master_sk, id, state)
 
+    @jni_call_site("ColdWallet.PKDerive")
     def pk_derive(self, master_pk, id, state):
         """
         Derives a new session public key based on the given parameters
@@ -64,6 +141,7 @@ class ColdWalletWrapper:
         """
         return self.cold_wallet.PKDerive(master_pk, id, state)
 
+    @jni_call_site("ColdWallet.Sign")
     def sign(self, msg, secret_key, public_key):
         """
         Generates a ECDSA signature for the given message based on the given key pair
@@ -79,15 +157,18 @@ class ColdWalletWrapper:
 class HotWalletWrapper:
     """Wraps the underlying (java) hot wallet into python"""
 
-    def __init__(self, spec=SECP.SECP256K1, hash_algorithm="SHA-256"):
+    def __init__(self, spec=None, hash_algorithm="SHA-256"):
         """
         Instantiate an java hot wallet object.
 
-        :param spec: specifies the elliptic curve (SECP256K1 for Ethereum)
+        :param spec: specifies the elliptic curve (None for SECP256K1, used by Ethereum)
         :param hash_algorithm: specifies the hash function (SHA-256 for Ethereum)
         """
-        self.hot_wallet = HotWallet(spec, hash_algorithm)
+        start_jvm()
+        with JNI_COUNTERS.measure("HotWallet.<init>", estimated_crossings=2):  # SECP256K1 lookup and construction
+            self.hot_wallet = HotWallet(SECP.SECP256K1 if spec is None else spec, hash_algorithm)
 
+    @jni_call_site("HotWallet.PKDerive")
     def pk_derive(self, master_pk, id, state):
         """
         Derives a new session public key based on the given parameters
@@ -99,6 +180,7 @@ class HotWalletWrapper:
         """
         return self.hot_wallet.PKDerive(master_pk, id, state)
 
+    @jni_call_site("HotWallet.verify")
     def verify(self, msg, public_key, signature):
         """
         Verifies a ECDSA signature for the given message and public key
@@ -120,11 +202,13 @@ def create_elliptic_curve_point(x, y):
     :param y: y coordinate (python type)
     :return: the coordinates as EllipticCurvePoint (java type/class)
     """
-    factory = FiniteFieldElementFactory()
-    converted_x = factory.createFrom(jpype.java.math.BigInteger(x))
-    converted_y = factory.createFrom(jpype.java.math.BigInteger(y))
-
-    return EllipticCurvePoint.create(converted_x, converted_y)
+    start_jvm()
+    # Factory construction, two BigInteger parsings, two field elements and the point
+    with JNI_COUNTERS.measure("create_elliptic_curve_point", estimated_crossings=6):
+        factory = FiniteFieldElementFactory()
+        converted_x = factory.createFrom(jpype.java.math.BigInteger(x))
+        converted_y = factory.createFrom(jpype.java.math.BigInteger(y))
+        return EllipticCurvePoint.create(converted_x, converted_y)
 
 
 def hex_to_java_biginteger(hex_string):
@@ -134,7 +218,9 @@ def hex_to_java_biginteger(hex_string):
     :param hex_string: hexadecimal string
     :return: the hex_string as BigInteger (java type/class)
     """
-    return jpype.java.math.BigInteger(str(int(hex_string, 0)))
+    start_jvm()
+    with JNI_COUNTERS.measure("hex_to_java_biginteger"):
+        return jpype.java.math.BigInteger(str(int(hex_string, 0)))
 
 
 def to_jstring_in_bytes(msg: str):
@@ -144,7 +230,9 @@ def to_jstring_in_bytes(msg: str):
     :param msg: message
     :return: the message as JString[] (java type/class)
     """
-    return JString(msg).getBytes("utf-8")
+    start_jvm()
+    with JNI_COUNTERS.measure("to_jstring_in_bytes", estimated_crossings=2):
+        return JString(msg).getBytes("utf-8")
 
 
 def _recover_state_from_list(data: list):
@@ -154,29 +242,36 @@ def _recover_state_from_list(data: list):
     :param data: the state as a list
     :return: the state as JArray (java type/class)
     """
-    converted = JArray(jpype.java.lang.Byte, 1)(len(data))
-    counter = 0
-    for item in data:
-        if item <= 0:
-            item = JString("-#" + str(hex(item * -1)).replace("0x", ""))
-        else:
-            item = JString(str(hex(item)))
-        converted[counter] = jpype.java.lang.Byte.decode(item)
-        counter += 1
-    translate = JPackage('org').apache.commons.lang.ArrayUtils
-    converted = translate.toPrimitive(converted)
-    return converted
+    start_jvm()
+    # Per byte a JString, a Byte.decode and an array store, plus the array, the ArrayUtils lookup and toPrimitive
+    with JNI_COUNTERS.measure("_recover_state_from_list", estimated_crossings=3 * len(data) + 3):
+        converted = JArray(jpype.java.lang.Byte, 1)(len(data))
+        counter = 0
+        for item in data:
+            if item <= 0:
+                item = JString("-#" + str(hex(item * -1)).replace("0x", ""))
+            else:
+                item = JString(str(hex(item)))
+            converted[counter] = jpype.java.lang.Byte.decode(item)
+            counter += 1
+        translate = JPackage('org').apache.commons.lang.ArrayUtils
+        converted = translate.toPrimitive(converted)
+        return converted
 
 
 def coords_to_java_public_key(x, y, raw_state: list):
     """
     Recovers a java PublicKey from ECDSA coordinates and state
 
-    :param x: x coordinate
-    :param y: y coordinate
+    :param x: x coordinate (as int or hex string)
+    :param y: y coordinate (as int or hex string)
     :param raw_state: state as list of bytes
     :return: PublicKey (java type/class)
     """
-    curve_point = create_elliptic_curve_point(str(int(x, 0)), str(int(y, 0)))
+    start_jvm()
+    x = x if isinstance(x, int) else int(x, 0)
+    y = y if isinstance(y, int) else int(y, 0)
+    curve_point = create_elliptic_curve_point(str(x), str(y))
     byte_array = _recover_state_from_list(raw_state)
-    return PublicKey(curve_point, byte_array)
+    with JNI_COUNTERS.measure("PublicKey.<init>"):
+        return PublicKey(curve_point, byte_array)
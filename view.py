@@ -0,0 +1,339 @@
+# Author: Leandro Rometsch, 2021
+# Email: leandro@rometsch.org
+# TU Darmstadt, Chair of Applied Cryptography
+
+import mmap
+import os
+
+from utils.compact import COMPACT_HEADER, COMPACT_MAGIC, COMPACT_RECORD, RETIRED_GENERATION, get_segment_path
+from utils.records import PublicKey
+from wallet import SPK_VIEW_FILE_NAME
+
+
+class WalletView:
+    """A read-only view on the session public keys of a hot wallet, intended for (many) lookup processes.
+    The view memory-maps the compact keystore file maintained by the hot wallet, so all processes share one copy of the
+    data in the page cache. New derivations are noticed by checking the generation in the file header. No JVM needed.
+    Keystores split into segments (one per derivation lane) are mapped segment by segment."""
+
+    def __init__(self, base_directory_hw="data/"):
+        """
+        Instantiate a view on the hot wallet stored in the given directory.
+
+        :param base_directory_hw: specifies the storage location of the hot wallet (as given to Wallet)
+        """
+        self.__path = base_directory_hw + "HotWalletData/" + SPK_VIEW_FILE_NAME
+        if not os.path.exists(self.__path):
+            raise Exception("tudwallet - No compact keystore file found. Call Wallet.build_view() first!")
+
+        self.__segments = [_ViewSegment(self.__path)]
+        if not self.__segments[0].open():
+            raise Exception("tudwallet - No compact keystore file found. Call Wallet.build_view() first!")
+        self._update_segments()
+
+    def refresh(self):
+        """
+        Check for new derivations and make them visible. This is done automatically by every lookup.
+
+        :return: True if the view changed, False if not
+        """
+        changed = self.__segments[0].refresh()
+        changed = self._update_segments() or changed
+        for segment in self.__segments[1:]:
+            changed = segment.refresh() or changed
+        return changed
+
+    def get_generation(self):
+        """
+        Getter: Get the generation of the keystore the view currently shows (the sum of the segment generations).
+
+        :return: the generation
+        """
+        return sum(segment.get_generation() or 0 for segment in self.__segments)
+
+    def get_public_key(self, id):
+        """
+        Look up the session public key of the given id.
+
+        :param id: the id (as int)
+        :return: the session public key as record "PublicKey" or None if no key has been derived for this id
+        """
+        self.refresh()
+        segment = self._find_segment(id)
+        index = None if segment is None else segment.find(id)
+        if index is None:
+            return None
+        return segment.get_record(index)
+
+    def get_address(self, id):
+        """
+        Look up the Ethereum address of the given id.
+
+        :param id: the id (as int)
+        :return: the address or None if no key has been derived for this id
+        """
+        public_key = self.get_public_key(id)
+        return None if public_key is None else public_key.address
+
+    def get_max_id(self):
+        """
+        Learn the highest id of all derived session public keys.
+
+        :return: the highest id (0 if no key has been derived yet)
+        """
+        self.refresh()
+        for segment in reversed(self.__segments):
+            if segment.get_count() > 0:
+                return segment.get_id(segment.get_count() - 1)
+        return 0
+
+    def iter_public_keys(self, start_id=1):
+        """
+        Streams all session public keys visible in the view in ascending id order.
+
+        :param start_id: the lowest id to be returned
+        :return: generator of session public keys as record "PublicKey"
+        """
+        self.refresh()
+        for segment in list(self.__segments):
+            yield from segment.iter_records(start_id)
+
+    def close(self):
+        """
+        Unmap and close the compact keystore file.
+        """
+        for segment in self.__segments:
+            segment.close()
+
+    def __contains__(self, id):
+        self.refresh()
+        segment = self._find_segment(id)
+        return segment is not None and segment.find(id) is not None
+
+    def __len__(self):
+        self.refresh()
+        return sum(segment.get_count() for segment in self.__segments)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
+
+    def _update_segments(self):
+        """
+        Opens the segments added to the keystore and closes the removed ones (the first segment holds the count).
+
+        :return: True if segments were added or removed, False if not
+        """
+        segment_count = self.__segments[0].get_segment_count()
+        changed = len(self.__segments) != segment_count
+        while len(self.__segments) < segment_count:
+            segment = _ViewSegment(get_segment_path(self.__path, len(self.__segments)))
+            segment.open()  # A missing segment shows no keys until a refresh finds it
+            self.__segments.append(segment)
+        while len(self.__segments) > segment_count:
+            self.__segments.pop().close()
+        return changed
+
+    def _find_segment(self, id):
+        """
+        Finds the segment whose range contains an id (segments cover ascending id ranges).
+
+        :param id: the id (as int)
+        :return: the last non-empty segment starting at or below the id (None if there is none)
+        """
+        for segment in reversed(self.__segments):
+            if segment.get_count() > 0 and segment.get_id(0) <= id:
+                return segment
+        return None
+
+
+class _ViewSegment:
+    """A memory-mapped segment (file) of a compact keystore."""
+
+    def __init__(self, path):
+        """
+        Instantiate the segment. The file is mapped by open().
+
+        :param path: the path of the segment file
+        """
+        self.__path = path
+        self.__file = None
+        self.__map = None
+        self.__generation = None
+        self.__count = 0
+        self.__segment_count = 1
+
+    def refresh(self):
+        """
+        Check for changes of the segment file.
+
+        :return: True if the segment changed, False if not
+        """
+        if self.__map is None:
+            return self.open()
+
+        _, generation, count, _ = COMPACT_HEADER.unpack_from(self.__map, 0)
+        if generation == self.__generation:
+            return False
+
+        if generation == RETIRED_GENERATION:  # The file was replaced by a rebuilt one (or is being deleted)
+            return self.open()
+
+        if COMPACT_HEADER.size + count * COMPACT_RECORD.size > len(self.__map):  # Grown beyond the mapping
+            self._map()
+        else:
+            self._read_header()
+        return True
+
+    def open(self):
+        """
+        Opens and maps the segment file. If the file is missing or still the retired one (a rebuild or a reset of the
+        wallet is in progress), the current mapping is kept and the next refresh tries again.
+
+        :return: True if a new file was mapped, False if not
+        """
+        try:
+            compact_file = open(self.__path, 'rb')
+        except FileNotFoundError:
+            return False
+        compact_map = mmap.mmap(compact_file.fileno(), 0, access=mmap.ACCESS_READ)
+
+        magic, generation, _, _ = COMPACT_HEADER.unpack_from(compact_map, 0)
+        if magic != COMPACT_MAGIC:
+            compact_map.close()
+            compact_file.close()
+            raise Exception("tudwallet - Invalid compact keystore file: " + self.__path)
+        if generation == RETIRED_GENERATION and self.__map is not None:
+            compact_map.close()
+            compact_file.close()
+            return False
+
+        self.close()
+        self.__file = compact_file
+        self.__map = compact_map
+        self._read_header()
+        return True
+
+    def close(self):
+        """
+        Unmap and close the segment file.
+        """
+        if self.__map is not None:
+            self.__map.close()
+            self.__map = None
+        if self.__file is not None:
+            self.__file.close()
+            self.__file = None
+
+    def get_generation(self):
+        """
+        Getter: Get the generation of the segment the view currently shows.
+
+        :return: the generation (None if the segment has not been mapped yet)
+        """
+        return self.__generation
+
+    def get_count(self):
+        """
+        Getter: Get the number of records visible in the segment.
+
+        :return: the record count
+        """
+        return self.__count
+
+    def get_segment_count(self):
+        """
+        Getter: Get the number of segments of the keystore (only meaningful for the first segment).
+
+        :return: the segment count
+        """
+        return self.__segment_count
+
+    def get_id(self, index):
+        """
+        Getter: Get the id of the record at the given index.
+
+        :param index: the index of the record
+        :return: the id
+        """
+        return COMPACT_RECORD.unpack_from(self.__map, self._get_offset(index))[0]
+
+    def get_record(self, index):
+        """
+        Creates the public key record at the given index.
+
+        :param index: the index of the record
+        :return: the session public key as record "PublicKey"
+        """
+        id, coordinates = COMPACT_RECORD.unpack_from(self.__map, self._get_offset(index))
+        return PublicKey.from_coordinates(id, coordinates)
+
+    def iter_records(self, start_id):
+        """
+        Streams the records of the segment in ascending id order.
+
+        :param start_id: the lowest id to be returned
+        :return: generator of session public keys as record "PublicKey"
+        """
+        count = self.__count
+        index = self._lower_bound(start_id, count)
+        while index < count:
+            yield self.get_record(index)
+            index += 1
+
+    def find(self, id):
+        """
+        Binary search for an id.
+
+        :param id: the id (as int)
+        :return: the index of the record or None if not present
+        """
+        index = self._lower_bound(id, self.__count)
+        if index < self.__count and self.get_id(index) == id:
+            return index
+        return None
+
+    def _map(self):
+        """
+        Re-maps the whole (grown) segment file and reads its header.
+        """
+        self.__map.close()
+        self.__map = mmap.mmap(self.__file.fileno(), 0, access=mmap.ACCESS_READ)
+        self._read_header()
+
+    def _read_header(self):
+        """
+        Adopts the generation, record count and segment count of the mapped file. A retired file keeps the current
+        generation, so the next refresh looks for the file that replaced it (a view opened on a retired file shows its
+        records).
+        """
+        _, generation, count, segment_count = COMPACT_HEADER.unpack_from(self.__map, 0)
+        if generation != RETIRED_GENERATION:
+            self.__generation = generation
+        elif self.__generation is not None:
+            return
+        self.__count = min(count, (len(self.__map) - COMPACT_HEADER.size) // COMPACT_RECORD.size)
+        self.__segment_count = max(segment_count, 1)
+
+    def _lower_bound(self, id, count):
+        """
+        Finds the index of the first record with an id not lower than the given one.
+
+        :param id: the id (as int)
+        :param count: the number of records to search
+        :return: the index (count if all ids are lower)
+        """
+        low, high = 0, count
+        while low < high:
+            middle = (low + high) // 2
+            if self.get_id(middle) < id:
+                low = middle + 1
+            else:
+                high = middle
+        return low
+
+    @staticmethod
+    def _get_offset(index):
+        return COMPACT_HEADER.size + index * COMPACT_RECORD.size
@@ -2,42 +2,101 @@
 # Email: leandro@rometsch.org
 # TU Darmstadt, Chair of Applied Cryptography
 
+import bisect
+import itertools
+import threading
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
 from shutil import copyfile
 
-import eth_utils
 from eth_account import account
-from eth_account.messages import encode_defunct
+from eth_account._utils.legacy_transactions import encode_transaction, serializable_unsigned_transaction_from_dict
+from eth_account.datastructures import SignedMessage, SignedTransaction
+from eth_account.messages import SignableMessage, encode_defunct
+from eth_keys import keys
 from eth_utils import keccak
-
+from hexbytes import HexBytes
+
+from utils.bundle import BUNDLE_VERSION, REQUEST_BUNDLE_FORMAT, RESULT_BUNDLE_FORMAT, create_bundle_id, \
+    decode_message, encode_message, encode_transaction, load_bundle, save_bundle
+from utils.cache import SecretKeyCache, SignatureCache
+from utils.changelog import ChangeLog
+from utils.compact import CompactKeyFile, get_segment_path
+from utils.derivation import DERIVATION_ENGINES, ENGINE_JAVA, ENGINE_PYTHON, PythonDerivationEngine, \
+    derive_lane_state, derive_public_key_chain
+from utils.idset import IdIndex
+from utils.jvmmetrics import JNI_COUNTERS, MetricsDumper, get_jvm_metrics
+from utils.keystore import KeyStore
+from utils.wal import DURABILITY_RELAXED, DURABILITY_STRICT, WriteAheadLog, fsync_path
 from utils.support import *
+from utils.typeddata import TypedDataEncoder
 from utils.wrapper import ColdWalletWrapper, HotWalletWrapper
 
 MPK_FILE_NAME = "MPK.key"  # Master Public Key
 MSK_FILE_NAME = "MSK.key"  # Master Secret Key
-SSK_FILE_NAME = "SecretKeyID.key"  # Session Secret Keys
-SPK_FILE_NAME = "PublicKeyID.key"  # Session Public Keys
+SSK_FILE_NAME = "SecretKeyID.key"  # Session Secret Keys (legacy single file keystore, read-only)
+SSK_DIRECTORY_NAME = "SecretKeyID/"  # Session Secret Keys (sharded keystore)
+SPK_FILE_NAME = "PublicKeyID.key"  # Session Public Keys (legacy single file keystore, read-only)
+SPK_DIRECTORY_NAME = "PublicKeyID/"  # Session Public Keys (sharded keystore)
+SPK_VIEW_FILE_NAME = "PublicKeyID.bin"  # Session Public Keys (compact file for read-only views)
 STATE_FILE_NAME = "state.txt"
+ID_INDEX_FILE_NAME = "ids.bin"  # Run-length encoded ids of the state file
+WAL_FILE_NAME = "wal.log"  # Write-ahead log of the hot wallet
+BUNDLE_DIRECTORY_NAME = "bundles/"  # Signing requests of the hot wallet awaiting their results
+LANES_FILE_NAME = "lanes.txt"  # Anchor ids of the derivation lanes of the hot wallet
+DEFAULT_LANE_SIZE = 2 ** 32  # Number of ids reserved per derivation lane
+WAL_CHECKPOINT_RECORDS = 1024  # Number of logged derivations after which the log is applied durably and truncated
 
 
 class Wallet:
     """The main (HD) wallet, which joins hot and cold wallet functionality by performing sync/state management"""
 
-    def __init__(self, base_directory_hw="data/", base_directory_cw="data/"):
+    def __init__(self, base_directory_hw="data/", base_directory_cw="data/", secret_key_cache_size=0,
+                 secret_key_cache_ttl=300.0, cold_wallet_wrapper=None, hot_wallet_wrapper=None,
+                 durability=DURABILITY_STRICT, group_commit_interval_ms=5, group_commit_records=64,
+                 derivation_engine=ENGINE_JAVA, replication=False, signature_cache_size=0, signature_cache_ttl=300.0):
         """
         Instantiate an hot & cold wallet and prepare directories.
 
         :param base_directory_hw: specifies the storage location of the hot wallet
         :param base_directory_cw: specifies the storage location of the cold wallet
+        :param secret_key_cache_size: number of session secret keys kept in memory for signing (0 disables the cache)
+        :param secret_key_cache_ttl: seconds a cached session secret key stays valid (None for no expiry)
+        :param cold_wallet_wrapper: optional ColdWalletWrapper shared with other wallets (created on demand if None)
+        :param hot_wallet_wrapper: optional HotWalletWrapper shared with other wallets (created on demand if None)
+        :param durability: how derivations of the hot wallet are flushed to disk: "strict" (fsync of the log for every
+                           derivation), "group" (one fsync of the log every group_commit_interval_ms or
+                           group_commit_records derivations) or "relaxed" (left to the operating system); except in
+                           relaxed mode the states appended to the state file are synced as well
+        :param group_commit_interval_ms: (group durability) maximum time in ms a derivation stays unsynced
+        :param group_commit_records: (group durability) number of unsynced derivations that trigger a sync immediately
+        :param derivation_engine: how session public keys are derived: "java" (java implementation) or "python"
+                                  (pure Python, no JVM needed, same keys)
+        :param replication: maintain the change stream of the hot wallet that read replicas follow (see replica.py).
+                            Once created, the change stream is maintained regardless of this flag
+        :param signature_cache_size: number of signing results kept in memory to answer retried (identical) signing
+                                     requests (0 disables the cache)
+        :param signature_cache_ttl: seconds a cached signing result stays valid (None for no expiry)
         """
         if not os.path.exists(base_directory_hw):
             os.makedirs(base_directory_hw)
         if not os.path.exists(base_directory_cw):
             os.makedirs(base_directory_cw)
 
-        self.__cold_wallet = _ColdWallet(base_directory_cw + "ColdWalletData/")
-        self.__hot_wallet = _HotWallet(base_directory_hw + "HotWalletData/")
+        self.__cold_wallet = _ColdWallet(base_directory_cw + "ColdWalletData/", wrapper=cold_wallet_wrapper)
+        self.__hot_wallet = _HotWallet(base_directory_hw + "HotWalletData/", wrapper=hot_wallet_wrapper,
+                                       durability=durability, group_commit_interval_ms=group_commit_interval_ms,
+                                       group_commit_records=group_commit_records, derivation_engine=derivation_engine,
+                                       replication=replication)
         self.__cold_wallet_synced = False
 
+        self.__secret_key_cache = None
+        if secret_key_cache_size > 0:
+            self.__secret_key_cache = SecretKeyCache(secret_key_cache_size, secret_key_cache_ttl)
+        self.__signature_cache = None
+        if signature_cache_size > 0:
+            self.__signature_cache = SignatureCache(signature_cache_size, signature_cache_ttl)
+        self.__metrics_dumper = None
+
     def generate_master_key(self, overwrite=False):
         """
         Generate the master key pair of the wallet.
@@ -47,10 +106,16 @@ class Wallet:
         self.__cold_wallet.master_key_gen(overwrite=overwrite)  # Potential overwrite exception already raised here
 
         if overwrite:
-            delete_files_in_folder(self.__hot_wallet.get_base_path())
+            self.__hot_wallet.reset()
+            if self.__secret_key_cache is not None:
+                self.__secret_key_cache.clear()  # Cached keys belong to the replaced master key
+            if self.__signature_cache is not None:
+                self.__signature_cache.clear()
 
         self.__cold_wallet.copy_state_to(self.__hot_wallet.get_state_path())  # Transfer initial state
         self.__cold_wallet.copy_mpk_to(self.__hot_wallet.get_mpk_path())  # Init hot_wallet with MPK
+        self.__hot_wallet.rebuild_view()  # Init (empty) compact keystore file for read-only views
+        self.__hot_wallet.reset_change_log()  # Replicas start over with the new master key
         self.__cold_wallet_synced = True  # The initial state is the same for both wallets
 
     def secret_key_derive(self, id=None):
@@ -60,36 +125,68 @@ class Wallet:
         If the id is already existing, return the key from keystore.
 
         :param id: specifies the id (as int)
-        :return: the session private key as dataclass "PrivateKey"
+        :return: the session private key as record "PrivateKey"
         """
+        cache_generation = self._get_cache_generation()
+        if id is not None:
+            cached_sk = self._get_cached_secret_key(id)
+            if cached_sk is not None:  # Key was derived and validated earlier, no need to access the cold wallet
+                return cached_sk
+
         self._sync_wallets()  # Cold wallet must come "online" for secret key derive, therefore sync necessary
 
         if id is None:  # if id is not specified create session secret key for latest (id) derived public key
-            max_id = self.__cold_wallet.get_max_id()
+            max_id = self.__hot_wallet.get_max_key_id()
 
             if max_id < 1:  # If no public key has been derived throw exception
                 raise Exception("tudwallet - Derive session public key first!")
 
-            sk_raw = self.__cold_wallet.secret_key_derive(max_id)
-            return PrivateKey(key=sk_raw, id=max_id)
+            sk = PrivateKey(key=self.__cold_wallet.secret_key_derive(max_id), id=max_id)
+            self._cache_secret_key(sk, cache_generation)
+            return sk
 
-        if id not in self.__cold_wallet.get_ids():  # if there is no public key derived from given id throw Exception
+        # if there is no public key derived from given id (or the id anchors a derivation lane) throw Exception
+        if not self.__cold_wallet.has_id(id) or self.__hot_wallet.is_anchor(id):
             raise Exception("tudwallet - Derive session public key with ID = " + str(id) + " first!")
 
-        sk_raw = str(self.__cold_wallet.secret_key_derive(id))
+        sk = PrivateKey(key=self.__cold_wallet.secret_key_derive(id), id=id)
+        self._cache_secret_key(sk, cache_generation)
+        return sk
 
-        # Normalize secret key here to prevent loss of a zero byte
-        sk_raw_len = len(sk_raw)
-        if sk_raw_len < 66:
-            sk_raw = sk_raw[2:]  # remove 0x
+    def secret_key_derive_many(self, ids):
+        """
+        Derives the session secret keys for many ids within one cold wallet session.
+        The cold wallet state and master secret key are only loaded once for the whole batch and all new keys are
+        written to the keystore at once. Keys that have been derived earlier are returned from keystore (or cache).
 
-            i = 66 - sk_raw_len
-            for p in range(0, i):
-                sk_raw = "0" + sk_raw
+        :param ids: the ids (as int) of already derived session public keys
+        :return: list of the session private keys as record "PrivateKey" (same order as ids)
+        """
+        ids = list(dict.fromkeys(ids))  # Remove duplicates but keep the order
 
-            sk_raw = "0x" + sk_raw
+        cache_generation = self._get_cache_generation()
+        secret_keys = {}
+        missing_ids = []
+        for id in ids:
+            cached_sk = self._get_cached_secret_key(id)
+            if cached_sk is not None:
+                secret_keys[id] = cached_sk
+            else:
+                missing_ids.append(id)
 
-        return PrivateKey(key=sk_raw, id=id)
+        if missing_ids:
+            self._sync_wallets()  # Cold wallet must come "online" for secret key derive, therefore sync necessary
+
+            anchors = set(self.__hot_wallet.get_lane_anchors())  # Includes id 0
+            for id in missing_ids:
+                if id in anchors or not self.__cold_wallet.has_id(id):
+                    raise Exception("tudwallet - Derive session public key with ID = " + str(id) + " first!")
+
+            for id, sk_raw in self.__cold_wallet.secret_key_derive_many(missing_ids).items():
+                secret_keys[id] = PrivateKey(key=sk_raw, id=id)
+                self._cache_secret_key(secret_keys[id], cache_generation)
+
+        return [secret_keys[id] for id in ids]
 
     def public_key_derive(self, id=None):
         """
@@ -98,40 +195,126 @@ class Wallet:
         If the id is already existing, return the key from keystore.
 
         :param id: specifies the id
-        :return: the session public key as dataclass "PublicKey"
+        :return: the session public key as record "PublicKey"
         """
-        max_id = self.__hot_wallet.get_max_id()
+        self.__hot_wallet.get_max_id()  # Raises if the wallet is not initialized
         if id is not None:
-            if id <= max_id:  # in this case, check if a key from this id is already derived.
-                if id not in self.__hot_wallet.get_ids():  # If not, throw an Exception
-                    raise Exception("tudwallet - ID is lower then previous IDs. Choose ID higher than: " + str(max_id))
-                else:  # If yes, return the already derived key
-                    raw_pk = self.__hot_wallet.public_key_derive(id)
-                    return PublicKey(self._get_address(raw_pk), id, raw_pk["X"], raw_pk["Y"])
+            if self.__hot_wallet.has_id(id) and not self.__hot_wallet.is_anchor(id):  # Return the already derived key
+                return PublicKey.from_coordinates(id, self.__hot_wallet.public_key_derive(id))
+            max_id = self.__hot_wallet.get_lane_max_id(id)  # Ids only need to increase within a derivation lane
+            if id <= max_id:
+                raise Exception("tudwallet - ID is lower then previous IDs. Choose ID higher than: " + str(max_id))
             next_id = id
         else:  # If no id is given, derive the next key with the next higher id (= old_id +1)
-            next_id = max_id + 1
+            self.__cold_wallet_synced = False  # Change happened in hot_wallet
+            ids, coordinates = self.__hot_wallet.public_key_derive_next(1)
+            return PublicKey.from_coordinates(ids[0], coordinates[0])
+
+        self.__cold_wallet_synced = False  # Change happened in hot_wallet
+        return PublicKey.from_coordinates(next_id, self.__hot_wallet.public_key_derive(next_id))
+
+    def public_key_derive_many(self, count):
+        """
+        Derives several new session public keys with the next possible ids (= old_id + 1, old_id + 2, ...) at once.
+        All derivations share one write (and sync) of the hot wallet's write-ahead log.
+
+        :param count: the number of session public keys to derive
+        :return: the session public keys as "KeyTable" (ascending ids)
+        """
+        if count < 1:
+            raise ValueError("tudwallet - Derive at least one session public key.")
+
+        self.__cold_wallet_synced = False  # Change happened in hot_wallet
+        public_keys = KeyTable()
+        for id, coordinates in zip(*self.__hot_wallet.public_key_derive_next(count)):
+            public_keys.append_coordinates(id, coordinates)
+        return public_keys
+
+    def create_lanes(self, count, lane_size=DEFAULT_LANE_SIZE):
+        """
+        Opens new derivation lanes. Each lane has its own state chain and owns a range of lane_size ids (placed above
+        all existing ids), so the keys of several lanes can be derived concurrently (see public_key_derive_lanes()).
+        All other functions keep working on the unified id space; public_key_derive() without id continues the
+        lane of the highest id. Lane 0 (all ids below the first new lane) always exists.
+
+        :param count: the number of lanes to open
+        :param lane_size: the number of ids reserved per lane
+        :return: the lane numbers of the new lanes
+        """
+        self.__cold_wallet_synced = False  # Change happened in hot_wallet
+        return self.__hot_wallet.create_lanes(count, lane_size)
+
+    def get_lane_count(self):
+        """
+        Getter: Get the number of derivation lanes (at least 1).
+
+        :return: the number of lanes
+        """
+        return len(self.__hot_wallet.get_lane_anchors())
+
+    def public_key_derive_lanes(self, count_per_lane, lanes=None, processes=False):
+        """
+        Derives the next session public keys of several derivation lanes concurrently.
+
+        :param count_per_lane: the number of session public keys to derive in each lane
+        :param lanes: the lane numbers (all lanes if None)
+        :param processes: compute in worker processes instead of threads (python derivation engine only); threads
+                          only run in parallel with the java engine, as the python engine holds the GIL
+        :return: the session public keys of all lanes as "KeyTable" (ascending ids)
+        """
+        if count_per_lane < 1:
+            raise ValueError("tudwallet - Derive at least one session public key per lane.")
+        if lanes is None:
+            lanes = range(self.get_lane_count())
 
         self.__cold_wallet_synced = False  # Change happened in hot_wallet
-        raw_pk = self.__hot_wallet.public_key_derive(next_id)
-        return PublicKey(self._get_address(raw_pk), next_id, raw_pk["X"], raw_pk["Y"])
+        public_keys = KeyTable()
+        ids, coordinates = self.__hot_wallet.public_key_derive_lanes({lane: count_per_lane for lane in lanes},
+                                                                      processes=processes)
+        for id, public_key_coordinates in zip(ids, coordinates):
+            public_keys.append_coordinates(id, public_key_coordinates)
+        return public_keys
 
     def sign_transaction(self, transaction_dict, id: int):
         """
         Generates a ECDSA signature for the given transaction based on a already derived key pair given by id.
+        With the signature cache enabled, a retry of the same transaction is answered from the cache.
 
         :param dict transaction_dict: the transaction with nonce, chainId, to, data, value, gas, gasPrice, ...
         :param id: id of an already derived session key pair
         :return: the signed transaction, containing the rawTransaction, the transactionHash and v, r, s
         """
-        self._id_existing(id)
         if not isinstance(transaction_dict, dict):
             raise TypeError("tudwallet - Transaction given in unsupported format. Provide as dict with keys: nonce, "
                             "chainId, to, data, value, gas, and gasPrice.")
 
-        sk = self.secret_key_derive(id)  # Note that in this case no new key is derived. We only fetch the "old" one
-        sig = self.__cold_wallet.sign_transaction(transaction_dict, sk)
-        return sig
+        def sign():
+            return self.__cold_wallet.sign_transaction(transaction_dict, self._get_signing_key(id))
+        if self.__signature_cache is None:
+            return sign()
+
+        try:  # The hash of the unsigned transaction does not depend on key order or value representation
+            transaction_hash = serializable_unsigned_transaction_from_dict(dict(transaction_dict)).hash()
+        except Exception:  # Invalid transaction, signing reports the error
+            return sign()
+        return self.__signature_cache.get_or_sign((id, "transaction", bytes(transaction_hash)), sign)
+
+    def sign_transaction_many(self, items):
+        """
+        Signs many transactions. The session secret keys of all ids are fetched within one cold wallet session.
+
+        :param items: list of (id, transaction dict) tuples
+        :return: list of the signed transactions (same order as items)
+        """
+        items = list(items)
+        for _, transaction_dict in items:
+            if not isinstance(transaction_dict, dict):
+                raise TypeError("tudwallet - Transaction given in unsupported format. Provide as dict with keys: "
+                                "nonce, chainId, to, data, value, gas, and gasPrice.")
+
+        secret_keys = {sk.id: sk for sk in self.secret_key_derive_many(id for id, _ in items)}
+        return [self.__cold_wallet.sign_transaction(transaction_dict, secret_keys[id])
+                for id, transaction_dict in items]
 
     def sign_message(self, message, id: int):
         """
@@ -141,11 +324,134 @@ class Wallet:
         :param id: id of an already derived session key pair
         :return: the signed message, containing the messageHash, the signature in Hex and v, r, s
         """
-        self._id_existing(id)
+        def sign():
+            return self.__cold_wallet.sign_message(message, self._get_signing_key(id))
+        if self.__signature_cache is None or type(message) not in (str, bytes):
+            return sign()
+
+        signable = encode_defunct(text=message) if type(message) is str else encode_defunct(primitive=message)
+        return self.__signature_cache.get_or_sign((id, "message", self._hash_signable(signable)), sign)
+
+    def sign_typed_data(self, typed_data: dict, id: int):
+        """
+        Generates a ECDSA signature for EIP-712 typed data based on a already derived key pair given by id.
+
+        :param dict typed_data: the typed data with types, primaryType, domain and message
+        :param id: id of an already derived session key pair
+        :return: the signed message, containing the messageHash, the signature in Hex and v, r, s
+        """
+        if not isinstance(typed_data, dict):
+            raise TypeError("tudwallet - Typed data given in unsupported format. Provide as dict with keys: types, "
+                            "primaryType, domain and message.")
 
-        sk = self.secret_key_derive(id)  # Note that in this case no new key is derived. We only fetch the "old" one
-        sig = self.__cold_wallet.sign_message(message, sk)
-        return sig
+        if self.__signature_cache is None:
+            return self.__cold_wallet.sign_typed_data(typed_data, self._get_signing_key(id))
+
+        signable = self.__cold_wallet.get_typed_data_encoder().encode(typed_data)
+
+        def sign():
+            return self.__cold_wallet.sign_typed_data(typed_data, self._get_signing_key(id), signable=signable)
+        return self.__signature_cache.get_or_sign((id, "message", self._hash_signable(signable)), sign)
+
+    def sign_typed_data_many(self, items):
+        """
+        Signs many EIP-712 typed data messages. The session secret keys of all ids are fetched within one cold wallet
+        session and messages sharing a schema and domain are hashed structurally only once.
+
+        :param items: list of (id, typed data dict) tuples
+        :return: list of the signed messages (same order as items)
+        """
+        items = list(items)
+        for _, typed_data in items:
+            if not isinstance(typed_data, dict):
+                raise TypeError("tudwallet - Typed data given in unsupported format. Provide as dict with keys: "
+                                "types, primaryType, domain and message.")
+
+        secret_keys = {sk.id: sk for sk in self.secret_key_derive_many(id for id, _ in items)}
+        return [self.__cold_wallet.sign_typed_data(typed_data, secret_keys[id]) for id, typed_data in items]
+
+    def get_typed_data_cache_statistics(self):
+        """
+        Learn how well the caching of typed data schemas and domain separators performs.
+
+        :return: dict containing hits, misses and the numbers of cached schemas and domain separators
+        """
+        return self.__cold_wallet.get_typed_data_encoder().get_statistics()
+
+    def create_signing_bundle(self, path, transactions=(), messages=()):
+        """
+        Creates a signing request for an offline cold wallet (see ColdSigner). The request bundle contains the unsigned
+        transactions and messages with their ids and the states the cold wallet needs to derive the missing session
+        secret keys, so one cold wallet session signs all of them. The request is kept until its result is imported.
+
+        :param path: the path where the request bundle file should be written to
+        :param transactions: list of (id, transaction dict) tuples
+        :param messages: list of (id, message) tuples, the messages given as string or bytes
+        :return: the id of the bundle
+        """
+        transaction_entries = [{"id": id, "transaction": encode_transaction(transaction_dict)}
+                               for id, transaction_dict in transactions]
+        message_entries = [dict(encode_message(message), id=id) for id, message in messages]
+        ids = [entry["id"] for entry in transaction_entries + message_entries]
+        if not ids:
+            raise ValueError("tudwallet - A signing bundle needs at least one transaction or message.")
+
+        self.__hot_wallet.get_max_id()  # Raises if the wallet is not initialized
+        anchors = set(self.__hot_wallet.get_lane_anchors())  # Includes id 0
+        for id in ids:
+            if id in anchors or not self.__hot_wallet.has_id(id):
+                raise Exception("tudwallet - Derive session public key with ID = " + str(id) + " first!")
+
+        bundle = {"format": REQUEST_BUNDLE_FORMAT, "version": BUNDLE_VERSION, "bundle_id": create_bundle_id(),
+                  "master_public_key": [str(value) for value in
+                                        get_public_key_coordinates_from_file(self.__hot_wallet.get_mpk_path())],
+                  "states": self.__hot_wallet.get_derivation_states(ids),
+                  "transactions": transaction_entries, "messages": message_entries}
+        self.__hot_wallet.save_pending_bundle(bundle)
+        save_bundle(path, bundle)
+        return bundle["bundle_id"]
+
+    def import_signed_bundle(self, path):
+        """
+        Imports the result bundle the cold wallet wrote for a signing request (see create_signing_bundle()). Every
+        signature is verified against the requested transaction or message and the session public key of its id.
+
+        :param path: the path of the result bundle file
+        :return: dict containing the signed "transactions" and "messages" (same order as in the request)
+        """
+        result = load_bundle(path, RESULT_BUNDLE_FORMAT)
+        request = self.__hot_wallet.get_pending_bundle(result["bundle_id"])
+        if request is None:
+            raise Exception("tudwallet - No pending signing request with bundle id " + str(result["bundle_id"]) + ".")
+        if len(result["transactions"]) != len(request["transactions"]) or \
+                len(result["messages"]) != len(request["messages"]):
+            raise Exception("tudwallet - Signing result does not match the request " + request["bundle_id"] + ".")
+
+        signed_transactions = [self._verify_signed_transaction(request_entry, result_entry)
+                               for request_entry, result_entry in zip(request["transactions"], result["transactions"])]
+        signed_messages = [self._verify_signed_message(request_entry, result_entry)
+                           for request_entry, result_entry in zip(request["messages"], result["messages"])]
+        self.__hot_wallet.remove_pending_bundle(request["bundle_id"])
+        return {"transactions": signed_transactions, "messages": signed_messages}
+
+    def get_pending_bundle_ids(self):
+        """
+        Learn which signing requests have been created but their results not imported yet.
+
+        :return: list of bundle ids
+        """
+        return self.__hot_wallet.get_pending_bundle_ids()
+
+    def get_public_key(self, id):
+        """
+        Look up the session public key of an already derived id (nothing is derived).
+
+        :param id: the id (as int)
+        :return: the session public key as record "PublicKey" or None if no key has been derived for this id
+        """
+        if not self.__hot_wallet.has_id(id) or self.__hot_wallet.is_anchor(id):
+            return None
+        return PublicKey.from_coordinates(id, self.__hot_wallet.public_key_derive(id))
 
     def get_all_ids(self):
         """
@@ -153,34 +459,135 @@ class Wallet:
 
         :return: all ids used to derive public keys
         """
-        ids = self.__hot_wallet.get_ids()
-        ids.pop(0)  # 0 is always present because of the master key pair
-        return ids
+        anchors = set(self.__hot_wallet.get_lane_anchors())  # 0 is always present because of the master key
+        return [id for id in self.__hot_wallet.get_ids() if id not in anchors]
 
-    @staticmethod
-    def _get_address(public_key: dict):
+    def iter_public_keys(self, start_id=1):
         """
-        Generates the Ethereum address from a given public key.
+        Streams all derived session public keys in ascending id order directly from the hot wallet keystore.
+        Memory usage stays constant regardless of the number of derived keys.
 
-        :param public_key: containing x and y coordinates
-        :return: the Ethereum address of the given public key
+        :param start_id: the lowest id to be returned
+        :return: generator of session public keys as record "PublicKey"
         """
-        x = public_key["X"][2:]
-        y = public_key["Y"][2:]
+        for id, coordinates in self.__hot_wallet.iter_public_keys(start_id):
+            yield PublicKey.from_coordinates(id, coordinates)
 
-        #  Bring public key to same length (by extending with zeros as msb) in order to secure consistent hashing
-        i = 64 - len(x)
-        for i in range(0, i):
-            x = "0" + x
+    def iter_public_key_batches(self, start_id=1, batch_size=1000):
+        """
+        Streams all derived session public keys in ascending id order as pages of (at most) batch_size keys.
+        To resume later on, pass the id of the last returned key + 1 as start_id (cursor).
+
+        :param start_id: the lowest id to be returned
+        :param batch_size: the maximum number of keys per page
+        :return: generator of pages of session public keys as "KeyTable"
+        """
+        if batch_size < 1:
+            raise ValueError("tudwallet - Batch size must be at least 1.")
 
-        i = 64 - len(y)
-        for i in range(0, i):
-            y = "0" + y
+        batch = KeyTable()
+        for id, coordinates in self.__hot_wallet.iter_public_keys(start_id):
+            batch.append_coordinates(id, coordinates)
+            if len(batch) == batch_size:
+                yield batch
+                batch = KeyTable()
+
+        if len(batch) > 0:
+            yield batch
+
+    def iter_addresses(self, start_id=1):
+        """
+        Streams the Ethereum addresses of all derived session public keys in ascending id order.
+
+        :param start_id: the lowest id to be returned
+        :return: generator of (id, address) tuples
+        """
+        for public_key in self.iter_public_keys(start_id):
+            yield public_key.id, public_key.address
 
-        preimage = x + y
-        keccak256 = keccak(hexstr=preimage)
-        address = eth_utils.to_checksum_address("0x" + keccak256.hex()[24:])
-        return address
+    def build_view(self):
+        """
+        (Re-)builds the compact keystore file that read-only views (WalletView) map into memory.
+        Wallets created with generate_master_key() maintain this file automatically; for older wallets it has to be
+        built once, afterwards it is kept up to date on every derivation.
+        """
+        self.__hot_wallet.rebuild_view()
+
+    def get_replication_head(self):
+        """
+        Getter: Get the position of the latest change of the change stream that read replicas follow.
+
+        :return: dict containing the epoch and the position or None if replication is disabled
+        """
+        return self.__hot_wallet.get_replication_head()
+
+    def get_secret_key_cache_statistics(self):
+        """
+        Learn how well the session secret key cache performs.
+
+        :return: dict containing hits, misses, evictions and size of the cache (None if the cache is disabled)
+        """
+        if self.__secret_key_cache is None:
+            return None
+        return self.__secret_key_cache.get_statistics()
+
+    def get_signature_cache_statistics(self):
+        """
+        Learn how many signing requests were answered from the signature cache.
+
+        :return: dict containing hits, misses, coalesced, evictions, expirations, size and in_flight of the cache
+                 (None if the cache is disabled)
+        """
+        if self.__signature_cache is None:
+            return None
+        return self.__signature_cache.get_statistics()
+
+    def get_jvm_metrics(self):
+        """
+        Learn how the embedded JVM performs: heap, memory pool and garbage collection statistics (from the JMX MXBeans)
+        and, per call site of the wrapper, the number of calls, their cumulative time and an estimate of the Python to
+        Java crossings (declared per call site, not measured).
+        The JVM and the counters are shared by all wallets of the process.
+
+        :return: dict containing a timestamp, "jvm" (None if the JVM has not been started yet) and "jni"
+        """
+        return get_jvm_metrics()
+
+    def start_metrics_dump(self, path, interval=60.0):
+        """
+        Append the JVM metrics (see get_jvm_metrics()) to a file every interval seconds, one JSON object per line.
+        Dumping stops with stop_metrics_dump() or close().
+
+        :param path: the path of the file the metrics are appended to
+        :param interval: seconds between two dumps
+        """
+        self.stop_metrics_dump()
+        self.__metrics_dumper = MetricsDumper(path, interval)
+        self.__metrics_dumper.start()
+
+    def stop_metrics_dump(self):
+        """
+        Stop dumping the JVM metrics (a last dump is written).
+        """
+        if self.__metrics_dumper is not None:
+            self.__metrics_dumper.stop()
+            self.__metrics_dumper = None
+
+    def close(self):
+        """
+        Wipe all session secret keys held in memory, sync pending derivations to disk and stop dumping metrics.
+        The wallet can still be used afterwards.
+        """
+        if self.__secret_key_cache is not None:
+            self.__secret_key_cache.clear()
+        self.__hot_wallet.close()
+        self.stop_metrics_dump()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
 
     def _sync_wallets(self):
         """
@@ -191,6 +598,120 @@ class Wallet:
         self.__hot_wallet.copy_state_to(self.__cold_wallet.get_state_path())  # Copy state of hot wallet to cold wallet
         self.__cold_wallet_synced = True
 
+    def _get_signing_key(self, id):
+        """
+        Fetch the session secret key of an already derived key pair for signing.
+        The cache is consulted first, so repeated signing with the same id does not access the cold wallet.
+
+        :param id: id of an already derived session key pair
+        :return: the session private key as record "PrivateKey"
+        """
+        sk = self._get_cached_secret_key(id)
+        if sk is not None:
+            return sk
+
+        self._id_existing(id)
+        return self.secret_key_derive(id)  # Note that in this case no new key is derived. We only fetch the "old" one
+
+    def _get_cached_secret_key(self, id):
+        """
+        Look up a session secret key in the cache.
+
+        :param id: the id of the session key pair
+        :return: the session private key as record "PrivateKey" or None if not cached (or cache disabled)
+        """
+        if self.__secret_key_cache is None:
+            return None
+
+        sk_bytes = self.__secret_key_cache.get(id)
+        if sk_bytes is None:
+            return None
+        return PrivateKey(key=sk_bytes, id=id)
+
+    def _cache_secret_key(self, sk: PrivateKey, generation):
+        """
+        Put a session secret key into the cache (if enabled).
+
+        :param sk: the session private key as record "PrivateKey"
+        :param generation: the cache generation taken before the key was derived (see _get_cache_generation())
+        """
+        if self.__secret_key_cache is None:
+            return
+        self.__secret_key_cache.put(sk.id, sk.key_bytes, generation=generation)
+
+    def _get_cache_generation(self):
+        """
+        Getter: Get the generation of the secret key cache. Taken before a key is derived, it keeps a key of a replaced
+        master key out of the cache (see SecretKeyCache.put()).
+
+        :return: the generation (None if the cache is disabled)
+        """
+        if self.__secret_key_cache is None:
+            return None
+        return self.__secret_key_cache.get_generation()
+
+    @staticmethod
+    def _hash_signable(signable: SignableMessage) -> bytes:
+        """
+        Computes the hash of an EIP-191 signable message, which is what gets signed.
+
+        :param signable: the signable message
+        :return: the message hash (keccak256)
+        """
+        return keccak(b"\x19" + signable.version + signable.header + signable.body)
+
+    def _verify_signed_transaction(self, request_entry, result_entry):
+        """
+        Verifies that a signed transaction of a result bundle signs the requested transaction with the session key of
+        the requested id.
+
+        :param request_entry: the transaction entry of the request bundle
+        :param result_entry: the corresponding entry of the result bundle
+        :return: the signed transaction, containing the rawTransaction, the transactionHash and v, r, s
+        """
+        id = request_entry["id"]
+        coordinates = self.__hot_wallet.public_key_derive(id)  # Already derived, read from keystore
+        raw_transaction = HexBytes(result_entry["raw_transaction"])
+        v, r, s = result_entry["v"], result_entry["r"], result_entry["s"]
+        y_parity = v if v < 27 else (v - 27 if v < 35 else (v - 35) % 2)  # Typed, legacy or EIP-155 transaction
+        try:
+            unsigned_transaction = serializable_unsigned_transaction_from_dict(request_entry["transaction"])
+            signer = keys.Signature(vrs=(y_parity, r, s)).recover_public_key_from_msg_hash(unsigned_transaction.hash())
+            # The raw transaction has to be the requested one with exactly this signature (not just any transaction
+            # signed with the same key)
+            valid = result_entry["id"] == id and signer.to_bytes() == coordinates and \
+                raw_transaction == HexBytes(encode_transaction(unsigned_transaction, vrs=(v, r, s))) and \
+                keccak(raw_transaction) == HexBytes(result_entry["hash"])
+        except Exception:
+            valid = False
+        if not valid:
+            raise Exception("tudwallet - Invalid signature for the transaction with ID = " + str(id) + ".")
+        return SignedTransaction(raw_transaction, HexBytes(result_entry["hash"]), r, s, v)
+
+    def _verify_signed_message(self, request_entry, result_entry):
+        """
+        Verifies that a signed message of a result bundle signs the requested message with the session key of the
+        requested id.
+
+        :param request_entry: the message entry of the request bundle
+        :param result_entry: the corresponding entry of the result bundle
+        :return: the signed message, containing the messageHash, the signature in Hex and v, r, s
+        """
+        id = request_entry["id"]
+        address = PublicKey.from_coordinates(id, self.__hot_wallet.public_key_derive(id)).address
+        message = decode_message(request_entry)
+        signable = encode_defunct(text=message) if type(message) is str else encode_defunct(primitive=message)
+        signature = HexBytes(result_entry["signature"])
+        message_hash = keccak(b"\x19" + signable.version + signable.header + signable.body)
+        try:
+            valid = result_entry["id"] == id and HexBytes(result_entry["message_hash"]) == message_hash and \
+                account.Account.recover_message(signable, signature=signature) == address
+        except Exception:
+            valid = False
+        if not valid:
+            raise Exception("tudwallet - Invalid signature for the message with ID = " + str(id) + ".")
+        return SignedMessage(HexBytes(message_hash), result_entry["r"], result_entry["s"], result_entry["v"], signature)
+
     def _id_existing(self, id):
         """
         Check if a key pair is already derived from the given id. Both, public and private, keys are needed to be
@@ -201,18 +722,21 @@ class Wallet:
         self._sync_wallets()
         if id == 0:
             raise Exception("tudwallet - Requested ID is the initial one")
-        if id not in self.__cold_wallet.get_ids():
+        if self.__hot_wallet.is_anchor(id):
+            raise Exception("tudwallet - Requested ID is the anchor of a derivation lane")
+        if not self.__cold_wallet.has_id(id):
             raise Exception("tudwallet - Derive session public/secret key with ID = " + str(id) + " first!")
 
 
 class _ColdWallet:
     """The cold wallet. Most notably implementing the wallets signing functionality."""
 
-    def __init__(self, directory):
+    def __init__(self, directory, wrapper=None):
         """
         Initializes the cold wallet keystore.
 
         :param directory: the directory the cold wallet will use for keystore
+        :param wrapper: optional ColdWalletWrapper to be used (created on first use if None)
         """
         if not os.path.exists(directory):
             os.mkdir(directory)
@@ -220,8 +744,11 @@ class _ColdWallet:
         self.__master_secret_file_path = directory + MSK_FILE_NAME
         self.__master_public_file_path = directory + MPK_FILE_NAME
         self.__state_file_path = directory + STATE_FILE_NAME
-        self.__session_secret_file_path = directory + SSK_FILE_NAME
+        self.__id_index = IdIndex(self.__state_file_path, directory + ID_INDEX_FILE_NAME)
+        self.__session_secret_store = KeyStore(directory + SSK_DIRECTORY_NAME, legacy_path=directory + SSK_FILE_NAME)
         self.__base_directory = directory
+        self.__wrapper = wrapper
+        self.__typed_data_encoder = TypedDataEncoder()  # Caches schemas and domain separators across signatures
 
     def master_key_gen(self, overwrite=False):
         """
@@ -236,8 +763,7 @@ class _ColdWallet:
         elif overwrite:
             delete_files_in_folder(self.__base_directory)
 
-        cww = ColdWalletWrapper()
-        key = cww.master_gen()
+        key = self._get_wrapper().master_gen()
         state = key.getState()  # 32 Bytes
 
         id_state_map = {0: list(state)}  # dict is the state data structure
@@ -262,28 +788,52 @@ class _ColdWallet:
         If a key with the given id has been derived earlier, return it from keystore.
 
         :param id: specifies the id (as int)
-        :return: the session private key in hex
+        :return: the session private key as int
         """
-        self._check_initialization()  # Check if master key pair present
+        return self.secret_key_derive_many([id])[id]
 
-        id_state_map = get_dict_from_file(self.__state_file_path)
+    def secret_key_derive_many(self, ids):
+        """
+        Derives new session secret keys for many ids at once. A master key pair must be present.
+        The state and the master secret key are loaded only once and all new keys are appended to the keystore at once.
+        Keys with an id that has been derived earlier are returned from keystore.
 
-        key_hash_map = {}
-        if os.path.exists(self.__session_secret_file_path):
-            key_hash_map = get_dict_from_file(self.__session_secret_file_path)
-            if str(id) in key_hash_map:  # if key already derived return it directly from the key file
-                return hex(int(str(key_hash_map[str(id)])))
+        :param ids: specifies the ids (as int)
+        :return: dict mapping each id to its session private key as int
+        """
+        self._check_initialization()  # Check if master key pair present
 
-        last_state_id = find_second_highest_key_in_dict(id_state_map)
-        last_state = id_state_map[last_state_id]
+        secret_keys = {}
+        missing_ids = []
+        for id in dict.fromkeys(ids):  # Remove duplicates but keep the order
+            stored_key = self.__session_secret_store.get(id)
+            if stored_key is not None:  # if key already derived return it directly from the keystore
+                secret_keys[id] = int(stored_key)
+            else:
+                missing_ids.append(id)
 
-        master_sec_key = get_private_key_from_file(self.__master_secret_file_path)  # Type: java.math.BigInteger
+        if not missing_ids:
+            return secret_keys
 
-        session_secret_key = ColdWalletWrapper().sk_derive(master_sec_key, str(id), last_state).getSecretKey()
-        key_hash_map[str(id)] = str(session_secret_key)
-        save_dict_to_file(self.__session_secret_file_path, key_hash_map)  # Add the new key to keystore
+        id_state_map = get_dict_from_file(self.__state_file_path)
+        state_ids = sorted(map(int, id_state_map.keys()))  # Computed once for the whole batch
 
-        return hex(int(str(key_hash_map[str(id)])))
+        master_sec_key = get_private_key_from_file(self.__master_secret_file_path)  # Type: java.math.BigInteger
+        cww = self._get_wrapper()
+
+        derived_keys = []
+        for id in missing_ids:
+            # The session public key of id has been derived from the state of the id preceding it
+            last_state = id_state_map[str(find_preceding_id(state_ids, id))]
+            session_secret_key = cww.sk_derive(master_sec_key, str(id), last_state)
+            # getSecretKey and toString
+            with JNI_COUNTERS.measure("wallet.secret_key_conversion", estimated_crossings=2):
+                session_secret_key = str(session_secret_key.getSecretKey())
+            derived_keys.append((id, session_secret_key))
+            secret_keys[id] = int(session_secret_key)
+
+        self.__session_secret_store.put_many(derived_keys)  # Append all new keys to keystore at once
+        return secret_keys
 
     def sign_transaction(self, transaction_dict: dict, sk: PrivateKey):
         """
@@ -292,7 +842,7 @@ class _ColdWallet:
         Might switch to the wrapper.py signing functionality in future work.
 
         :param dict transaction_dict: the ethereum transaction
-        :param sk: the session secret key as PrivateKey dataclass
+        :param sk: the session secret key as PrivateKey record
         :return: the signed transaction
         """
         self._check_initialization()
@@ -307,7 +857,7 @@ class _ColdWallet:
         Might switch to the wrapper.py signing functionality in future work.
 
         :param message: the message to be signed
-        :param sk: the session secret key as PrivateKey dataclass
+        :param sk: the session secret key as PrivateKey record
         :return: the signed message
         """
         self._check_initialization()
@@ -321,14 +871,95 @@ class _ColdWallet:
 
         return account.Account.sign_message(message_hash, sk.key)
 
+    def sign_typed_data(self, typed_data: dict, sk: PrivateKey, signable: SignableMessage = None):
+        """
+        Sign EIP-712 typed data (e.g. a permit or an order).
+        The struct types and the domain are hashed only once per schema and domain (cached by the encoder).
+
+        :param typed_data: dict containing "types", "primaryType", "domain" and "message"
+        :param sk: the session secret key as PrivateKey record
+        :param signable: the typed data already encoded by get_typed_data_encoder() (encoded here if None)
+        :return: the signed message
+        """
+        self._check_initialization()
+        if signable is None:
+            signable = self.__typed_data_encoder.encode(typed_data)
+        return account.Account.sign_message(signable, sk.key)
+
+    def get_typed_data_encoder(self):
+        """
+        Getter: Get the encoder used for typed data (e.g. to inspect its cache statistics).
+
+        :return: the typed data encoder
+        """
+        return self.__typed_data_encoder
+
+    def sign_bundle(self, request: dict):
+        """
+        Signs all transactions and messages of a signing request bundle within one session: the states of the bundle
+        are merged into the cold wallet state, all missing session secret keys are derived at once and every entry is
+        signed.
+
+        :param request: the request bundle (created by the hot wallet)
+        :return: the result bundle
+        """
+        self._check_initialization()
+        master_public_key = get_public_key_coordinates_from_file(self.__master_public_file_path)
+        if tuple(int(value) for value in request["master_public_key"]) != master_public_key:
+            raise Exception("Signing request belongs to another master key.")
+
+        self.merge_states(request["states"])
+        ids = [entry["id"] for entry in request["transactions"] + request["messages"]]
+        secret_keys = self.secret_key_derive_many(ids)  # All missing keys at once
+
+        signed_transactions = []
+        for entry in request["transactions"]:
+            raw_transaction, transaction_hash, r, s, v = \
+                self.sign_transaction(entry["transaction"], PrivateKey(key=secret_keys[entry["id"]], id=entry["id"]))
+            signed_transactions.append({"id": entry["id"], "raw_transaction": raw_transaction.hex(),
+                                        "hash": transaction_hash.hex(), "r": r, "s": s, "v": v})
+
+        signed_messages = []
+        for entry in request["messages"]:
+            message_hash, r, s, v, signature = \
+                self.sign_message(decode_message(entry), PrivateKey(key=secret_keys[entry["id"]], id=entry["id"]))
+            signed_messages.append({"id": entry["id"], "message_hash": message_hash.hex(), "r": r, "s": s, "v": v,
+                                    "signature": signature.hex()})
+
+        return {"format": RESULT_BUNDLE_FORMAT, "version": BUNDLE_VERSION, "bundle_id": request["bundle_id"],
+                "transactions": signed_transactions, "messages": signed_messages}
+
+    def merge_states(self, states: dict):
+        """
+        Adds states transferred from the hot wallet (e.g. within a signing request) to the cold wallet state.
+        States the cold wallet already knows must be identical.
+
+        :param states: dict mapping ids (as str) to their states
+        :return: the number of added states
+        """
+        id_state_map = get_dict_from_file(self.__state_file_path)
+        new_ids = []
+        for id, state in states.items():
+            known_state = id_state_map.get(str(id))
+            if known_state is None:
+                id_state_map[str(id)] = state
+                new_ids.append(int(id))
+            elif list(known_state) != list(state):
+                raise Exception("State of id " + str(id) + " differs from the state of the cold wallet.")
+
+        if new_ids:
+            self.__id_index.get()  # The in-memory ids must belong to the state file before it is replaced
+            save_dict_to_file(self.__state_file_path, id_state_map, fsync=True)
+            self.__id_index.add_many(new_ids)
+        return len(new_ids)
+
     def get_ids(self):
         """
         List all ids that were used to derive keys earlier
 
         :return: already used ids
         """
-        id_state_map = get_dict_from_file(self.__state_file_path)
-        return list(map(int, id_state_map.keys()))
+        return list(self.__id_index.get())
 
     def get_max_id(self):
         """
@@ -339,7 +970,16 @@ class _ColdWallet:
         """
         if not os.path.exists(self.__state_file_path):
             raise Exception("No state file exists. Call master_key_gen first!")
-        return max(self.get_ids())
+        return self.__id_index.get().get_max()
+
+    def has_id(self, id):
+        """
+        Check if an id has been used to derive keys earlier (without reading the state file).
+
+        :param id: the id (as int)
+        :return: True if the id is used, False if not
+        """
+        return id in self.__id_index.get()
 
     def get_base_path(self):
         """
@@ -377,6 +1017,16 @@ class _ColdWallet:
         """
         copyfile(self.__master_public_file_path, path)
 
+    def _get_wrapper(self):
+        """
+        Getter: Get the (java) cold wallet wrapper. It is created on first use and reused afterwards.
+
+        :return: the cold wallet wrapper
+        """
+        if self.__wrapper is None:
+            self.__wrapper = ColdWalletWrapper()
+        return self.__wrapper
+
     def _check_initialization(self):
         """
         Check if the wallet is initialized.
@@ -390,19 +1040,52 @@ class _ColdWallet:
 class _HotWallet:
     """The hot wallet. Most notably implementing the wallets session public key derivation."""
 
-    def __init__(self, directory):
+    def __init__(self, directory, wrapper=None, durability=DURABILITY_STRICT, group_commit_interval_ms=5,
+                 group_commit_records=64, derivation_engine=ENGINE_JAVA, replication=False):
         """
-        Initializes the hot wallet keystore.
+        Initializes the hot wallet keystore. Derivations logged but not yet applied (e.g. due to a crash) are recovered.
 
         :param directory: the directory the hot wallet will use for keystore
+        :param wrapper: optional HotWalletWrapper to be used (created on first use if None)
+        :param durability: durability mode of the write-ahead log (DURABILITY_STRICT, DURABILITY_GROUP or
+                           DURABILITY_RELAXED)
+        :param group_commit_interval_ms: (group mode) maximum time in ms a derivation stays unsynced
+        :param group_commit_records: (group mode) number of unsynced derivations that trigger a sync immediately
+        :param derivation_engine: ENGINE_JAVA or ENGINE_PYTHON
+        :param replication: maintain the change stream for read replicas (an existing one is always maintained)
         """
+        if derivation_engine not in DERIVATION_ENGINES:
+            raise ValueError("Unknown derivation engine " + str(derivation_engine) + ". Use one of: " +
+                             ", ".join(DERIVATION_ENGINES))
         if not os.path.exists(directory):
             os.mkdir(directory)
 
         self.__master_public_file_path = directory + MPK_FILE_NAME
-        self.__session_public_file_path = directory + SPK_FILE_NAME
+        self.__session_public_store = KeyStore(directory + SPK_DIRECTORY_NAME, legacy_path=directory + SPK_FILE_NAME)
         self.__state_file_path = directory + STATE_FILE_NAME
+        self.__id_index = IdIndex(self.__state_file_path, directory + ID_INDEX_FILE_NAME)
         self.__base_directory = directory
+        self.__wrapper = wrapper
+        self.__derivation_engine = derivation_engine
+        self.__python_engine = None
+        self.__view_file = CompactKeyFile(directory + SPK_VIEW_FILE_NAME)
+        self.__lanes_file_path = directory + LANES_FILE_NAME
+        self.__bundle_directory = directory + BUNDLE_DIRECTORY_NAME
+        self.__lock = threading.RLock()
+        self.__wal = WriteAheadLog(directory + WAL_FILE_NAME, durability=durability,
+                                   group_commit_interval_ms=group_commit_interval_ms,
+                                   group_commit_records=group_commit_records)
+        self.__change_log = ChangeLog(directory)
+        self.__replication = replication or self.__change_log.exists()
+        self.__states = None  # Parsed state file, kept as long as the file is unchanged (see _read_states())
+        self.__states_version = None
+        self.__lane_anchors = None  # Read once from the lanes file, updated by create_lanes() and reset()
+        self.__lane_anchor_set = None
+        self._load_lane_anchors()
+        self._recover()
+        self._repair_lane_states()
+        if self.__replication and not self.__change_log.exists() and os.path.exists(self.__state_file_path):
+            self.reset_change_log()  # Replication enabled for an existing wallet: start with a snapshot
 
     def public_key_derive(self, id):
         """
@@ -410,35 +1093,215 @@ class _HotWallet:
         If a key with the given id has been derived earlier, return it from keystore.
 
         :param id: specifies the id (as int)
-        :return: the session public key coordinates in hex as dict
+        :return: the session public key coordinates as 64 raw bytes (x and y)
         """
         if not os.path.exists(self.__master_public_file_path):
             raise Exception("Wallet not initialized yet. Call master_key_gen first!")
 
-        id_state_map = get_dict_from_file(self.__state_file_path)
-        last_state = id_state_map[str(self.get_max_id())]
+        stored_key = self.__session_public_store.get(id)
+        if stored_key is not None:  # if key already derived return it directly from the keystore
+            return self._decode_public_key(stored_key)
 
-        key_hash_map = {}
-        if os.path.exists(self.__session_public_file_path):
-            key_hash_map = get_dict_from_file(self.__session_public_file_path)
-            if str(id) in key_hash_map:  # if key already derived return it directly from the key file
-                key = key_hash_map[str(id)].split(",")
-                x = hex(int(str(key[0])))
-                y = hex(int(str(key[1])))
-                return {"X": x, "Y": y}
+        return self.public_key_derive_many([id])[0]
 
-        master_public_key = get_public_key_from_file(self.__master_public_file_path)
-        pk = HotWalletWrapper().pk_derive(master_public_key, str(id), last_state)
-        session_public_key = pk.getPublicKey()
+    def public_key_derive_many(self, ids):
+        """
+        Derives new session public keys for several new ids at once. A master public key must be present.
+        Each state is chained from the state of the previous id (of the same derivation lane), the state file is
+        written once and all derivations share one write (and sync) of the write-ahead log.
+
+        :param ids: specifies the ids (as int, ascending and higher than all previous ids of their lane)
+        :return: list of the session public key coordinates as 64 raw bytes (same order as ids)
+        """
+        if not os.path.exists(self.__master_public_file_path):
+            raise Exception("Wallet not initialized yet. Call master_key_gen first!")
+
+        with self.__lock:
+            id_state_map = self._read_states()
+            anchors = self.get_lane_anchors()
+            lane_last_ids = {}
+
+            pk_derive = self._get_pk_derive()
+
+            records = []
+            try:
+                for id in ids:
+                    lane = bisect.bisect_right(anchors, id) - 1
+                    if lane not in lane_last_ids:
+                        lane_last_ids[lane] = self._get_lane_last_id(anchors, lane)
+                    last_id = lane_last_ids[lane]
+                    if id <= last_id:
+                        raise Exception("ID is lower then previous IDs. Choose ID higher than: " + str(last_id))
+
+                    (x, y), next_state = pk_derive(id, id_state_map[str(last_id)])
+                    id_state_map[str(id)] = next_state
+                    lane_last_ids[lane] = id
+
+                    records.append({"id": id, "state": next_state, "key": str(x) + "," + str(y)})
+
+                self.__wal.append(records)  # Log first, so a crash while applying can be recovered
+                self._apply(records, id_state_map)
+            except BaseException:
+                self.__states = None  # The parsed states may contain states that were not written
+                raise
+
+        return [self._decode_public_key(record["key"]) for record in records]
+
+    def public_key_derive_lanes(self, counts, processes=False):
+        """
+        Derives the next session public keys of several derivation lanes concurrently (one worker per lane).
+        Only the computation runs concurrently; all results are logged and applied at once afterwards.
+
+        :param counts: dict of lane number -> number of session public keys to derive in this lane
+        :param processes: use worker processes instead of threads (only for ENGINE_PYTHON, which holds the GIL)
+        :return: tuple of the ids (ascending) and the list of session public key coordinates as 64 raw bytes
+        """
+        if not os.path.exists(self.__master_public_file_path):
+            raise Exception("Wallet not initialized yet. Call master_key_gen first!")
+        if processes and self.__derivation_engine != ENGINE_PYTHON:
+            raise ValueError("Worker processes are only supported by the python derivation engine.")
+
+        with self.__lock:
+            id_state_map = self._read_states()
+            anchors = self.get_lane_anchors()
+
+            chains = {}
+            for lane, count in counts.items():
+                if not 0 <= lane < len(anchors):
+                    raise ValueError("Unknown derivation lane " + str(lane) + ".")
+                last_id = self._get_lane_last_id(anchors, lane)
+                ids = list(range(last_id + 1, last_id + count + 1))
+                if lane + 1 < len(anchors) and ids and ids[-1] >= anchors[lane + 1]:
+                    raise Exception("Derivation lane " + str(lane) + " is full.")
+                chains[lane] = (id_state_map[str(last_id)], ids)
+
+            if processes:
+                master_public_key = get_public_key_coordinates_from_file(self.__master_public_file_path)
+                with ProcessPoolExecutor(max_workers=len(chains) or 1) as executor:
+                    futures = [executor.submit(derive_public_key_chain, master_public_key, state, ids)
+                               for state, ids in chains.values()]
+            else:
+                shared_pk_derive = self._get_pk_derive() if self.__derivation_engine == ENGINE_PYTHON else None
+
+                def derive_chain(state, ids):
+                    # A java hot wallet must not be used by several threads at once: every worker gets its own
+                    pk_derive = shared_pk_derive or self._get_pk_derive(HotWalletWrapper())
+                    chain = []
+                    for id in ids:
+                        public_key, state = pk_derive(id, state)
+                        chain.append((id, public_key, state))
+                    return chain
+
+                with ThreadPoolExecutor(max_workers=len(chains) or 1) as executor:
+                    futures = [executor.submit(derive_chain, state, ids) for state, ids in chains.values()]
+
+            records = []
+            for future in futures:
+                for id, (x, y), next_state in future.result():
+                    records.append({"id": id, "state": next_state, "key": str(x) + "," + str(y)})
+            records.sort(key=lambda record: record["id"])
+
+            if records:
+                try:
+                    for record in records:
+                        id_state_map[str(record["id"])] = record["state"]
+                    self.__wal.append(records)  # Log first, so a crash while applying can be recovered
+                    self._apply(records, id_state_map)
+                except BaseException:
+                    self.__states = None  # The parsed states may contain states that were not written
+                    raise
+
+        return [record["id"] for record in records], [self._decode_public_key(record["key"]) for record in records]
+
+    def create_lanes(self, count, lane_size=DEFAULT_LANE_SIZE):
+        """
+        Opens new derivation lanes above all existing ids. Every lane owns lane_size consecutive ids starting at its
+        anchor id; the anchor itself carries the initial state of the lane and has no key pair.
+
+        :param count: the number of lanes to open
+        :param lane_size: the number of ids reserved per lane
+        :return: the lane numbers of the new lanes
+        """
+        if count < 1:
+            raise ValueError("Open at least one derivation lane.")
+        if not os.path.exists(self.__state_file_path):
+            raise Exception("No state file exists. Call master_key_gen first!")
+
+        with self.__lock:
+            anchors = self.get_lane_anchors()
+            first_anchor = (self.get_max_id() // lane_size + 1) * lane_size
+            new_anchors = [first_anchor + lane * lane_size for lane in range(count)]
+
+            # Register the lanes first: a crash before the states are written is repaired by _repair_lane_states()
+            save_dict_to_file(self.__lanes_file_path, {"anchors": anchors[1:] + new_anchors}, fsync=True)
+            self._set_lane_anchors(anchors + new_anchors)
+            self._write_lane_states(new_anchors)
+            if self.__view_file.exists():
+                self._extend_view(anchors + new_anchors, count)
+            return list(range(len(anchors), len(anchors) + count))
+
+    def get_lane_anchors(self):
+        """
+        Getter: Get the anchor ids of all derivation lanes. Lane 0 (anchored at id 0) always exists.
+
+        :return: ascending list of anchor ids, the index is the lane number
+        """
+        return list(self.__lane_anchors)
 
-        next_state = pk.getState()
-        id_state_map[str(id)] = list(next_state)
-        save_dict_to_file(self.__state_file_path, id_state_map)  # save new state in state file
+    def get_lane_max_id(self, id):
+        """
+        Getter: Get the highest id used so far in the derivation lane of the given id.
 
-        key_hash_map[str(id)] = str(session_public_key.getPointX()) + "," + str(session_public_key.getPointY())
-        save_dict_to_file(self.__session_public_file_path, key_hash_map)  # save new key in keystore
+        :param id: an id (as int) of the lane
+        :return: the highest id of the lane (its anchor id if no key has been derived in the lane yet)
+        """
+        anchors = self.get_lane_anchors()
+        return self._get_lane_last_id(anchors, bisect.bisect_right(anchors, id) - 1)
 
-        return {"X": hex(int(str(session_public_key.getPointX()))), "Y": hex(int(str(session_public_key.getPointY())))}
+    def get_max_key_id(self):
+        """
+        Getter: Get the highest id a session public key has been derived for (lane anchors do not count).
+
+        :return: the highest id (0 if no key has been derived yet)
+        """
+        anchors = self.get_lane_anchors()
+        for lane in range(len(anchors) - 1, -1, -1):
+            last_id = self._get_lane_last_id(anchors, lane)
+            if last_id != anchors[lane]:
+                return last_id
+        return 0
+
+    def is_anchor(self, id):
+        """
+        Check if an id is the anchor of a derivation lane (incl. id 0), which has no key pair.
+
+        :param id: the id (as int)
+        :return: True if the id is an anchor, False if not
+        """
+        return id in self.__lane_anchor_set
+
+    def public_key_derive_next(self, count):
+        """
+        Derives new session public keys for the next possible ids (= old_id + 1, old_id + 2, ...).
+        The ids are chosen while holding the lock, so concurrent callers never pick the same id.
+
+        :param count: the number of session public keys to derive
+        :return: tuple of the ids and the list of session public key coordinates as 64 raw bytes (same order)
+        """
+        with self.__lock:
+            max_id = self.get_max_id()
+            ids = list(range(max_id + 1, max_id + count + 1))
+            return ids, self.public_key_derive_many(ids)
+
+    def iter_public_keys(self, start_id=1):
+        """
+        Streams all session public keys from keystore in ascending id order.
+
+        :param start_id: the lowest id to be returned
+        :return: generator of (id, coordinates as 64 raw bytes) tuples
+        """
+        for id, stored_key in self.__session_public_store.iterate(start_id):
+            yield id, self._decode_public_key(stored_key)
 
     def get_state_path(self):
         """
@@ -464,6 +1327,63 @@ class _HotWallet:
         """
         return self.__base_directory
 
+    def get_derivation_states(self, ids):
+        """
+        Getter: Get the states the cold wallet needs to derive the session secret keys of the given ids: the state of
+        each id and the state of the id preceding it (the session key has been derived from).
+
+        :param ids: ids (as int) of derived session public keys
+        :return: dict mapping the ids (as str) to their states
+        """
+        with self.__lock:
+            id_set = self.__id_index.get()
+            id_state_map = self._read_states()
+            states = {}
+            for id in ids:
+                for state_id in (id_set.get_max_below(id), id):
+                    states[str(state_id)] = id_state_map[str(state_id)]
+            return states
+
+    def save_pending_bundle(self, bundle: dict):
+        """
+        Keeps a signing request until its result is imported.
+
+        :param bundle: the request bundle
+        """
+        if not os.path.exists(self.__bundle_directory):
+            os.mkdir(self.__bundle_directory)
+        save_bundle(self.__bundle_directory + bundle["bundle_id"] + ".json", bundle)
+
+    def get_pending_bundle(self, bundle_id):
+        """
+        Getter: Get a signing request whose result has not been imported yet.
+
+        :param bundle_id: the id of the bundle
+        :return: the request bundle or None if there is no such pending request
+        """
+        path = self.__bundle_directory + str(bundle_id) + ".json"
+        if os.path.basename(path) != str(bundle_id) + ".json" or not os.path.exists(path):
+            return None
+        return load_bundle(path, REQUEST_BUNDLE_FORMAT)
+
+    def get_pending_bundle_ids(self):
+        """
+        Getter: Get the ids of all signing requests whose results have not been imported yet.
+
+        :return: list of bundle ids
+        """
+        if not os.path.exists(self.__bundle_directory):
+            return []
+        return sorted(name[:-len(".json")] for name in os.listdir(self.__bundle_directory) if name.endswith(".json"))
+
+    def remove_pending_bundle(self, bundle_id):
+        """
+        Removes a signing request after its result has been imported.
+
+        :param bundle_id: the id of the bundle
+        """
+        os.remove(self.__bundle_directory + bundle_id + ".json")
+
     def copy_state_to(self, path):
         """
         Copies the state of the hot wallet to a given location.
@@ -472,7 +1392,9 @@ class _HotWallet:
 
         :param path: the path where the hot wallet state should be copied to
         """
-        copyfile(self.__state_file_path, path)
+        with self.__lock:
+            copy_file_atomically(self.__state_file_path, path)  # The cold wallet might read the state concurrently
+            self.__id_index.save_for(path, os.path.join(os.path.dirname(path), ID_INDEX_FILE_NAME))
 
     def get_ids(self):
         """
@@ -480,8 +1402,7 @@ class _HotWallet:
 
         :return: already used ids
         """
-        id_state_map = get_dict_from_file(self.__state_file_path)
-        return list(map(int, id_state_map.keys()))
+        return list(self.__id_index.get())
 
     def get_max_id(self):
         """
@@ -492,4 +1413,350 @@ class _HotWallet:
         """
         if not os.path.exists(self.__state_file_path):
             raise Exception("No state file exists. Call master_key_gen first!")
-        return max(self.get_ids())
+        return self.__id_index.get().get_max()
+
+    def has_id(self, id):
+        """
+        Check if an id has been used to derive keys earlier (without reading the state file).
+
+        :param id: the id (as int)
+        :return: True if the id is used, False if not
+        """
+        return id in self.__id_index.get()
+
+    def rebuild_view(self):
+        """
+        (Re-)builds the compact keystore file for read-only views from the keystore, one segment per derivation lane.
+        The first segment is written last, as it publishes the number of segments.
+        """
+        with self.__lock:
+            anchors = self.get_lane_anchors()
+            for lane in reversed(range(len(anchors))):
+                self._rebuild_view_segment(anchors, lane)
+
+    def reset(self):
+        """
+        Deletes all data of the hot wallet (e.g. before a new master key is installed). The compact keystore file is
+        marked as retired first, so read-only views release the old keys.
+        """
+        with self.__lock:
+            for segment in range(self.__view_file.get_segment_count()):
+                self._get_view_segment(segment).retire()
+            delete_files_in_folder(self.__base_directory)
+            self._set_lane_anchors([0])
+
+    def reset_change_log(self):
+        """
+        (Re-)starts the change stream for read replicas (new epoch) with a snapshot of all ids of the hot wallet.
+        Does nothing unless replication is enabled.
+        """
+        with self.__lock:
+            if not self.__replication:
+                return
+            id_state_map = self._read_states()
+
+            def snapshot():
+                keys = self.__session_public_store.iterate(0)
+                key_id, key = next(keys, (None, None))
+                for id in sorted(int(id) for id in id_state_map):
+                    while key_id is not None and key_id < id:
+                        key_id, key = next(keys, (None, None))
+                    yield {"id": id, "state": id_state_map[str(id)], "key": key if key_id == id else None}
+            self.__change_log.reset(snapshot())
+
+    def get_replication_head(self):
+        """
+        Getter: Get the position of the latest change of the change stream read replicas follow.
+
+        :return: dict containing the epoch and the position or None if replication is disabled
+        """
+        if not self.__replication:
+            return None
+        return {"epoch": self.__change_log.get_epoch(), "position": self.__change_log.get_head()}
+
+    def close(self):
+        """
+        Sync all logged derivations to disk (relevant for the group durability mode).
+        """
+        self.__wal.close()
+
+    def _apply(self, records, id_state_map):
+        """
+        Applies logged derivations to the state file and the keystore.
+        Once enough records are logged, the applied files are synced and the log is truncated (checkpoint).
+
+        :param records: the logged derivations (dicts with id, state and key)
+        :param id_state_map: the state containing the new states of all records
+        """
+        self.__id_index.get()  # The in-memory ids must belong to the state file before it is changed
+        self._append_states(records, id_state_map)
+        self.__id_index.add_many(record["id"] for record in records)
+        self.__session_public_store.put_many([(record["id"], record["key"]) for record in records])
+        if self.__view_file.exists():
+            self._append_view(records)
+        if self.__replication:
+            self.__change_log.append(records)
+
+        if self.__wal.get_record_count() >= WAL_CHECKPOINT_RECORDS:
+            self._checkpoint()
+
+    def _append_view(self, records):
+        """
+        Appends derived keys to the segments of the compact keystore file of their derivation lanes. A segment is only
+        rebuilt if its keys would not stay ascending (e.g. records applied again during recovery).
+
+        :param records: the applied derivations (dicts with id, state and key)
+        """
+        anchors = self.get_lane_anchors()
+        if self.__view_file.get_segment_count() != len(anchors):  # Built before the lanes were opened
+            self.rebuild_view()
+            return
+
+        lane_entries = {}
+        for record in sorted(records, key=lambda record: record["id"]):
+            lane = bisect.bisect_right(anchors, record["id"]) - 1
+            lane_entries.setdefault(lane, []).append((record["id"], self._decode_public_key(record["key"])))
+        for lane, entries in lane_entries.items():
+            segment = self._get_view_segment(lane)
+            if segment.exists() and entries[0][0] > segment.get_last_id():
+                segment.append(entries)
+            else:
+                self._rebuild_view_segment(anchors, lane)
+
+    def _extend_view(self, anchors, count):
+        """
+        Adds empty segments for new derivation lanes to the compact keystore file. A file whose segments do not match
+        the previous lanes is rebuilt instead.
+
+        :param anchors: the anchor ids of all lanes (incl. the new ones)
+        :param count: the number of new lanes (the last ones)
+        """
+        if self.__view_file.get_segment_count() != len(anchors) - count:
+            self.rebuild_view()
+            return
+        for lane in range(len(anchors) - count, len(anchors)):
+            self._get_view_segment(lane).rebuild([])
+        self.__view_file.set_segment_count(len(anchors))  # Published once the segments exist
+
+    def _rebuild_view_segment(self, anchors, lane):
+        """
+        Rebuilds the segment of the compact keystore file that holds the keys of a derivation lane.
+
+        :param anchors: the anchor ids of all lanes (see get_lane_anchors())
+        :param lane: the lane number
+        """
+        entries = self.iter_public_keys(anchors[lane] + 1)
+        if lane + 1 < len(anchors):
+            entries = itertools.takewhile(lambda entry: entry[0] < anchors[lane + 1], entries)
+        self._get_view_segment(lane).rebuild(entries, segment_count=len(anchors))
+
+    def _get_view_segment(self, lane):
+        """
+        Getter: Get the segment of the compact keystore file that holds the keys of a derivation lane.
+
+        :param lane: the lane number
+        :return: the segment as "CompactKeyFile" (the compact keystore file itself for lane 0)
+        """
+        if lane == 0:
+            return self.__view_file
+        return CompactKeyFile(get_segment_path(self.__view_file.get_path(), lane))
+
+    def _read_states(self):
+        """
+        Getter: Get the states of all ids. The parsed state file is kept in memory and only read again if the file has
+        been changed by someone else (detected by inode, modification time and size, like the id index).
+        The caller must hold the lock and must not keep changes that are not written to the state file.
+
+        :return: dict mapping ids (as str) to their states
+        """
+        version = self._get_state_version()
+        if self.__states is None or version != self.__states_version:
+            self.__states = get_dict_from_file(self.__state_file_path)
+            self.__states_version = version
+        return self.__states
+
+    def _get_state_version(self):
+        """
+        Identifies the version of the state file.
+
+        :return: tuple of inode, modification time (ns) and size
+        """
+        stat = os.stat(self.__state_file_path)
+        return stat.st_ino, stat.st_mtime_ns, stat.st_size
+
+    def _append_states(self, records, id_state_map):
+        """
+        Appends the states of new derivations to the state file instead of rewriting it, the checkpoint folds them
+        into the file. Unless durability is relaxed the appended states are synced: the log only holds the
+        derivations since the last checkpoint, so states lost by a power failure could not be restored from it.
+
+        :param records: the derivations (dicts with id, state and key)
+        :param id_state_map: the states of all ids (incl. the new ones), kept as parsed state file
+        """
+        append_dict_to_file(self.__state_file_path, {str(record["id"]): record["state"] for record in records},
+                            fsync=self.__wal.get_durability() != DURABILITY_RELAXED)
+        self.__states = id_state_map
+        self.__states_version = self._get_state_version()
+
+    def _checkpoint(self):
+        """
+        Folds the appended states into the state file, syncs the state file and the keystore to disk (unless durability
+        is relaxed) and truncates the log afterwards.
+        """
+        durable = self.__wal.get_durability() != DURABILITY_RELAXED
+        if os.path.exists(self.__state_file_path):
+            id_state_map = self._read_states()
+            self.__id_index.get()  # The in-memory ids must belong to the state file before it is replaced
+            save_dict_to_file(self.__state_file_path, id_state_map, fsync=durable)
+            if durable:
+                fsync_path(self.__base_directory)
+            self.__id_index.add_many(())
+            self.__states = id_state_map
+            self.__states_version = self._get_state_version()
+        if durable:
+            self.__session_public_store.sync()
+            if self.__replication:
+                self.__change_log.sync()
+        self.__wal.truncate()
+
+    def _recover(self):
+        """
+        Replays the write-ahead log: every logged derivation missing in the state file or the keystore is applied.
+        """
+        records = self.__wal.read_records()
+        if not records:
+            return
+
+        if os.path.exists(self.__state_file_path):  # Otherwise the wallet has been reset, nothing to recover
+            id_state_map = get_dict_from_file(self.__state_file_path)
+            state_changed = False
+            missing_keys = []
+            for record in records:
+                if str(record["id"]) not in id_state_map:
+                    id_state_map[str(record["id"])] = record["state"]
+                    state_changed = True
+                if self.__session_public_store.get(record["id"]) is None:
+                    missing_keys.append((record["id"], record["key"]))
+
+            if state_changed:
+                self.__id_index.get()
+                self._save_states(id_state_map)
+                self.__id_index.add_many(record["id"] for record in records)
+            self.__session_public_store.put_many(missing_keys)
+
+            if self.__view_file.exists():
+                self.rebuild_view()
+
+            if self.__replication and self.__change_log.exists():  # Changes are logged last, a crash may lose them
+                logged_ids = self.__change_log.get_tail_ids(len(records) + len(self.get_lane_anchors()))
+                self.__change_log.append([record for record in records if record["id"] not in logged_ids])
+
+        self._checkpoint()
+
+    @staticmethod
+    def _decode_public_key(stored_key):
+        """
+        Converts a keystore entry to the session public key coordinates.
+
+        :param stored_key: the keystore entry (decimal coordinates separated by a comma)
+        :return: the session public key coordinates as 64 raw bytes (x and y)
+        """
+        x, y = stored_key.split(",")
+        return int(x).to_bytes(32, "big") + int(y).to_bytes(32, "big")
+
+    def _get_lane_last_id(self, anchors, lane):
+        """
+        Finds the highest id used so far in a derivation lane.
+
+        :param anchors: the anchor ids of all lanes (see get_lane_anchors())
+        :param lane: the lane number
+        :return: the highest id of the lane (its anchor id if no key has been derived in the lane yet)
+        """
+        id_set = self.__id_index.get()
+        if lane + 1 < len(anchors):
+            return id_set.get_max_below(anchors[lane + 1])
+        return id_set.get_max()
+
+    def _load_lane_anchors(self):
+        """
+        Reads the anchor ids of the derivation lanes from the lanes file.
+        """
+        anchors = [0]
+        if os.path.exists(self.__lanes_file_path):
+            anchors += get_dict_from_file(self.__lanes_file_path)["anchors"]
+        self._set_lane_anchors(anchors)
+
+    def _set_lane_anchors(self, anchors):
+        """
+        Replaces the cached anchor ids of the derivation lanes.
+
+        :param anchors: ascending list of anchor ids (incl. 0)
+        """
+        self.__lane_anchors = anchors
+        self.__lane_anchor_set = frozenset(anchors)
+
+    def _repair_lane_states(self):
+        """
+        Writes the initial states of lanes that were registered but lost their states (crash within create_lanes()).
+        """
+        if not os.path.exists(self.__state_file_path):
+            return
+        missing_anchors = [anchor for anchor in self.__lane_anchors if not self.has_id(anchor)]
+        if missing_anchors:
+            self._write_lane_states(missing_anchors)
+
+    def _write_lane_states(self, anchors):
+        """
+        Writes the initial states of derivation lanes to the state file.
+
+        :param anchors: the anchor ids of the lanes
+        """
+        with self.__lock:
+            id_state_map = get_dict_from_file(self.__state_file_path)
+            for anchor in anchors:
+                id_state_map[str(anchor)] = derive_lane_state(anchor, id_state_map["0"])
+
+            self.__id_index.get()
+            save_dict_to_file(self.__state_file_path, id_state_map, fsync=True)
+            self.__id_index.add_many(anchors)
+            if self.__replication and self.__change_log.exists():
+                self.__change_log.append([{"id": anchor, "state": id_state_map[str(anchor)], "key": None}
+                                          for anchor in anchors])
+
+    def _get_pk_derive(self, wrapper=None):
+        """
+        Getter: Get the derivation function of the selected engine for the current master public key.
+        The returned function maps an id and the state of the previous id to the session public key coordinates (ints)
+        and the next state.
+
+        :param wrapper: optional HotWalletWrapper the java engine derives with (the wallet's wrapper if None)
+        :return: the derivation function
+        """
+        if self.__derivation_engine == ENGINE_PYTHON:
+            master_public_key = get_public_key_coordinates_from_file(self.__master_public_file_path)
+            if self.__python_engine is None or self.__python_engine.get_master_public_key() != master_public_key:
+                self.__python_engine = PythonDerivationEngine(master_public_key)  # Master key new or overwritten
+            return self.__python_engine.pk_derive
+
+        master_public_key = get_public_key_from_file(self.__master_public_file_path)
+        wrapper = self._get_wrapper() if wrapper is None else wrapper
+
+        def java_pk_derive(id, state):
+            pk = wrapper.pk_derive(master_public_key, str(id), state)
+            # getPublicKey, getPointX/Y with toString each, getState and the conversion of the state array
+            with JNI_COUNTERS.measure("wallet.public_key_conversion", estimated_crossings=7):
+                session_public_key = pk.getPublicKey()
+                return (int(str(session_public_key.getPointX())), int(str(session_public_key.getPointY()))), \
+                    list(pk.getState())
+
+        return java_pk_derive
+
+    def _get_wrapper(self):
+        """
+        Getter: Get the (java) hot wallet wrapper. It is created on first use and reused afterwards.
+
+        :return: the hot wallet wrapper
+        """
+        if self.__wrapper is None:
+            self.__wrapper = HotWalletWrapper()
+        return self.__wrapper